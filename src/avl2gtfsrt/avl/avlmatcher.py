@@ -1,12 +1,14 @@
 import logging
-import polyline
 
-from shapely.geometry import LineString, Point, Polygon
+from shapely.geometry import Point
 from time import time
 
+from avl2gtfsrt.avl.matchingengine import MatchingEngine, get_trip_key
+from avl2gtfsrt.avl.matchingstate import SpatialMatchState, VehicleMatchingState, get_vehicle_matching_state
 from avl2gtfsrt.avl.spatialmatch import SpatialMatch
 from avl2gtfsrt.avl.temporalmatch import TemporalMatch
 from avl2gtfsrt.avl.spatialvector import SpatialVectorCollection
+from avl2gtfsrt.avl.tripshape import TripShape, get_trip_shape
 from avl2gtfsrt.common.shared import web_mercator, wgs_84
 from avl2gtfsrt.common.statistics import bayesian_update
 from avl2gtfsrt.model.types import Vehicle, GnssPosition, Trip, TripMetrics
@@ -14,10 +16,12 @@ from avl2gtfsrt.objectstorage import ObjectStorage
 
 class AvlMatcher:
 
-    def __init__(self, object_storage: ObjectStorage, trip_candidates: list[Trip], shape_filter_enabled: bool = True, shape_filter_distance_meters: int = 50) -> None:
+    def __init__(self, object_storage: ObjectStorage, trip_candidates: list[Trip], shape_filter_enabled: bool = True, shape_filter_distance_meters: int = 50, matching_engine: MatchingEngine|None = None) -> None:
         self._storage = object_storage
         self._trip_candidates = trip_candidates
 
+        self._matching_engine = matching_engine if matching_engine is not None else MatchingEngine(object_storage)
+
         self._shape_filter_enabled = shape_filter_enabled
         self._shape_filter_distance_meters = shape_filter_distance_meters
 
@@ -29,51 +33,16 @@ class AvlMatcher:
             start_time: float = time()
 
             if len(gnss_positions) > 1:
-                movement: SpatialVectorCollection = SpatialVectorCollection(gnss_positions)
 
-                trip_candidate_scores: dict[str, float] = dict()
-                for trip_candidate in self._trip_candidates:
-
-                    # check for prerequisites
-
-                    # check whether another vehicle has logged on this trip
-                    # skip the ressource-consuming matching in that case and skip the candidate
-                    if any(
-                        v.activity is not None
-                        and v.activity.trip_descriptor is not None 
-                        and v.activity.trip_descriptor.trip_id == trip_candidate.descriptor.trip_id
-                        for v in self._storage.get_vehicles()
-                    ):
-                        continue
-                    
-                    # match trip candidate for scoring
-                    # 1. step: spatial matching
-                    # 2. step: temporal matching
-
-                    # generate LineString in web-mercator projection for spatial and temporal matching
-                    trip_shape: LineString = LineString([c[::-1] for c in polyline.decode(trip_candidate.shape_polyline)])
-                    trip_shape = web_mercator(trip_shape)
-
-                    # run spatial matching for trip candidate
-                    spatial_match: SpatialMatch = SpatialMatch(trip_shape)
-                    spatial_match_score: float = spatial_match.calculate_match_score(movement)
-                    if spatial_match_score == 0.0:
-                        continue
-
-                    # run temporal matching for trip candidate
-                    temporal_match: TemporalMatch = TemporalMatch(
-                        trip_candidate.stop_times, 
-                        trip_shape
-                    )
-
-                    temporal_match_score: float = temporal_match.calculate_match_score(spatial_match.spatial_progress_percentage)
-                    if temporal_match_score == 0.0:
-                        continue
+                # score all trip candidates by spatial and temporal matching
+                # trip candidates which are assigned to another vehicle already are skipped by the matching engine
+                # depending on the matching engine, this runs in the current thread, in a matching process or in a batch
+                trip_candidate_scores: dict[str, float] = self._matching_engine.score(
+                    vehicle.vehicle_ref,
+                    gnss_positions,
+                    self._trip_candidates
+                )
 
-                    # finally calculate trip candidate score and store it for this iteration
-                    trip_candidate_score: float = spatial_match_score * temporal_match_score
-                    trip_candidate_scores[trip_candidate.descriptor.trip_id] = trip_candidate_score
-                
                 # log if all trips have been discarded
                 # in this case, the process function is done at all
                 if len(trip_candidate_scores) == 0:
@@ -135,13 +104,17 @@ class AvlMatcher:
                 trip_matching: bool = False
                 trip_candidate: Trip = self._trip_candidates[0]
 
-                # generate LineString in web-mercator projection for spatial and temporal matching
-                trip_shape: LineString = LineString([c[::-1] for c in polyline.decode(trip_candidate.shape_polyline)])
-                trip_shape = web_mercator(trip_shape)
+                # load prepared trip shape in web-mercator projection for spatial and temporal matching
+                trip_shape: TripShape = get_trip_shape(trip_candidate)
 
                 # run spatial matching for trip candidate
-                spatial_match: SpatialMatch = SpatialMatch(trip_shape)
-                spatial_match_score: float = spatial_match.calculate_match_score(movement)
+                vehicle_matching_state: VehicleMatchingState = get_vehicle_matching_state(vehicle.vehicle_ref)
+                vehicle_matching_state.retain({get_trip_key(trip_candidate)})
+
+                spatial_match_state: SpatialMatchState = vehicle_matching_state.get_spatial_match_state(get_trip_key(trip_candidate))
+
+                spatial_match: SpatialMatch = SpatialMatch(trip_shape.line, trip_shape.buffered_line)
+                spatial_match_score: float = spatial_match.calculate_match_score(movement, spatial_match_state)
                 if spatial_match_score == 0.0:
                     trip_matching = False
                 else:
@@ -150,10 +123,10 @@ class AvlMatcher:
                 # filter position to shape if enabled
                 if self._shape_filter_enabled:
                     web_mercator_position: Point = web_mercator(Point(gnss_positions[-1].longitude, gnss_positions[-1].latitude))
-                    shape_distance: float = web_mercator_position.distance(trip_shape)
+                    shape_distance: float = web_mercator_position.distance(trip_shape.line)
 
                     if shape_distance < self._shape_filter_distance_meters:
-                        snapped_point: Point = trip_shape.interpolate(spatial_match.spatial_progress_distance)
+                        snapped_point: Point = trip_shape.line.interpolate(spatial_match.spatial_progress_distance)
                         snapped_point = wgs_84(snapped_point)
 
                         self.matched_vehicle_position = GnssPosition(
@@ -162,6 +135,10 @@ class AvlMatcher:
                             timestamp=gnss_positions[-1].timestamp
                         )
 
+                        # the filtered position replaces the last position of the vehicle
+                        # keep the matching state in sync, the filtered position is on the trip shape
+                        spatial_match_state.replace_last(self.matched_vehicle_position, True, spatial_match.spatial_progress_distance)
+
                         logging.info(f"{self.__class__.__name__}: Filtered AVL position for vehicle {vehicle.vehicle_ref} to {snapped_point.y}, {snapped_point.x} on trip {trip_candidate.descriptor.trip_id}.")
                 else:
                     self.matched_vehicle_position = gnss_positions[-1]
@@ -188,14 +165,15 @@ class AvlMatcher:
 
             for trip_candidate in self._trip_candidates:
                 
-                # generate LineString in web-mercator projection for spatial and temporal matching
-                trip_shape: LineString = LineString([c[::-1] for c in polyline.decode(trip_candidate.shape_polyline)])
-                trip_shape = web_mercator(trip_shape)
+                # load prepared trip shape in web-mercator projection for temporal matching
+                trip_shape: TripShape = get_trip_shape(trip_candidate)
 
                 # run temporal matching for trip candidate
                 temporal_match: TemporalMatch = TemporalMatch(
                     trip_candidate.stop_times, 
-                    trip_shape
+                    trip_shape.line,
+                    trip_shape.stop_projections,
+                    trip_shape.stop_time_index
                 )
 
                 trip_metrics[trip_candidate.descriptor.trip_id] = temporal_match.predict_trip_metrics(gnss_position)
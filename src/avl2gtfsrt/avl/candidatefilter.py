@@ -0,0 +1,89 @@
+import numpy as np
+import shapely
+
+from shapely import STRtree
+from shapely.geometry import LineString, Polygon
+
+from avl2gtfsrt.avl.spatialmatch import SpatialMatch
+from avl2gtfsrt.avl.spatialvector import SpatialVectorCollection
+from avl2gtfsrt.avl.tripshape import TripShape, get_trip_shape
+from avl2gtfsrt.common.cache import LruCache
+from avl2gtfsrt.common.env import is_set
+from avl2gtfsrt.common.shared import web_mercator_coords
+from avl2gtfsrt.model.types import Trip
+
+
+class CandidateFilter:
+
+    MAX_BEARING_DEVIATION: float = 90.0
+
+    def __init__(self, trip_candidates: list[Trip]) -> None:
+        self._trip_shapes: list[TripShape] = [get_trip_shape(t) for t in trip_candidates]
+
+        # index all buffered trip shapes by their bounding boxes
+        self._tree: STRtree = STRtree([s.buffered_line for s in self._trip_shapes])
+
+        # split all trip shapes into their segments and calculate the bearing of each segment once
+        # web-mercator is conformal, so the bearings are comparable with the geodetic bearing of the movement
+        self._segments: list[np.ndarray] = list()
+        self._segment_bearings: list[np.ndarray] = list()
+        for trip_shape in self._trip_shapes:
+            starts: np.ndarray = trip_shape.coords[:-1]
+            ends: np.ndarray = trip_shape.coords[1:]
+
+            self._segments.append(shapely.linestrings(np.stack([starts, ends], axis=1)))
+            self._segment_bearings.append((np.degrees(np.arctan2(ends[:, 0] - starts[:, 0], ends[:, 1] - starts[:, 1])) + 360) % 360)
+
+    def query(self, vehicle_movement: SpatialVectorCollection) -> list[int]:
+        gnss_positions = vehicle_movement.gnss_positions
+
+        movement_x, movement_y = web_mercator_coords([p.longitude for p in gnss_positions], [p.latitude for p in gnss_positions])
+
+        # 1. step: select all trip candidates whose buffered shape intersects the envelope of the movement
+        # trip candidates outside the envelope can not cover any GNSS position at all
+        movement_envelope: Polygon = shapely.box(movement_x.min(), movement_y.min(), movement_x.max(), movement_y.max())
+        candidate_indices: np.ndarray = np.sort(self._tree.query(movement_envelope))
+
+        # 2. step: check whether the trip candidate runs into the same direction as the movement
+        # if the movement is shorter than the buffer of the trip shapes, there's no reliable direction to compare with
+        if np.hypot(movement_x[-1] - movement_x[0], movement_y[-1] - movement_y[0]) < SpatialMatch.TRIP_SHAPE_BUFFER_SIZE:
+            return [int(c) for c in candidate_indices]
+
+        movement_line: LineString = shapely.linestrings(movement_x, movement_y)
+        movement_bearing: float = vehicle_movement.bearing()
+
+        result: list[int] = list()
+        for c in candidate_indices:
+
+            # loops and out-and-back trips pass the movement several times
+            # so the trip candidate is kept if any of its segments next to the movement runs into the same direction
+            nearby_segments: np.ndarray = shapely.dwithin(self._segments[c], movement_line, SpatialMatch.TRIP_SHAPE_BUFFER_SIZE)
+            if not nearby_segments.any():
+                continue
+
+            bearing_deviations: np.ndarray = np.abs((movement_bearing - self._segment_bearings[c][nearby_segments] + 180) % 360 - 180)
+            if bearing_deviations.min() > self.MAX_BEARING_DEVIATION:
+                continue
+
+            result.append(int(c))
+
+        return result
+
+
+# candidate filters are shared by all vehicles with the same set of trip candidates
+# trip candidates of vehicles near the same stops are mostly the same
+_candidate_filter_enabled: bool = is_set('A2G_MATCHING_PREFILTER_ENABLED')
+_candidate_filter_cache: LruCache = LruCache(100)
+
+def filter_trip_candidates(vehicle_movement: SpatialVectorCollection, trip_candidates: list[Trip]) -> list[Trip]:
+    if not _candidate_filter_enabled or len(trip_candidates) == 0:
+        return trip_candidates
+
+    cache_key: tuple = tuple((t.descriptor.trip_id, t.descriptor.start_date, hash(t.shape_polyline)) for t in trip_candidates)
+
+    candidate_filter: CandidateFilter|None = _candidate_filter_cache.get(cache_key)
+    if candidate_filter is None:
+        candidate_filter = CandidateFilter(trip_candidates)
+        _candidate_filter_cache.put(cache_key, candidate_filter)
+
+    return [trip_candidates[c] for c in candidate_filter.query(vehicle_movement)]
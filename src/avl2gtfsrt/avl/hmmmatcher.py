@@ -0,0 +1,315 @@
+import logging
+import math
+import numpy as np
+import os
+import shapely
+
+from time import time
+
+from avl2gtfsrt.avl.avlmatcher import AvlMatcher
+from avl2gtfsrt.avl.candidatefilter import filter_trip_candidates
+from avl2gtfsrt.avl.matchingengine import get_trip_key
+from avl2gtfsrt.avl.spatialvector import SpatialVectorCollection
+from avl2gtfsrt.avl.tripshape import TripShape, get_trip_shape, get_trip_version_key
+from avl2gtfsrt.common.cache import LruCache
+from avl2gtfsrt.common.shared import web_mercator_coords
+from avl2gtfsrt.common.statistics import PROBABILITY_HISTORY_LENGTH, is_converged
+from avl2gtfsrt.model.types import Vehicle, GnssPosition, Trip
+
+
+class HmmTripModel:
+
+    SEGMENT_LENGTH: float = 20.0
+
+    GNSS_SIGMA_METERS: float = 15.0
+    SCHEDULE_SIGMA_PERCENTAGE: float = 15.0
+    TRANSITION_BETA_METERS: float = 20.0
+
+    def __init__(self, trip: Trip) -> None:
+        trip_shape: TripShape = get_trip_shape(trip)
+
+        # split the trip shape into segments of equal length, these are the hidden states of the trip
+        # segments are short, so each segment is approximated by the straight line between its bounds
+        # the length is the same for all trips, so the segments of all trip candidates are updated together, only the last segment may be shorter
+        num_segments: int = max(1, math.ceil(trip_shape.length / self.SEGMENT_LENGTH))
+        segment_bounds: np.ndarray = np.minimum(np.arange(num_segments + 1) * self.SEGMENT_LENGTH, trip_shape.length)
+        segment_bound_coords: np.ndarray = shapely.get_coordinates(shapely.line_interpolate_point(trip_shape.line, segment_bounds))
+
+        self.segment_starts: np.ndarray = segment_bound_coords[:-1]
+        self.segment_vectors: np.ndarray = segment_bound_coords[1:] - segment_bound_coords[:-1]
+        self.segment_squared_lengths: np.ndarray = np.maximum((self.segment_vectors ** 2).sum(axis=1), 1e-9)
+
+        self.segment_centers: np.ndarray = (segment_bounds[:-1] + segment_bounds[1:]) / 2.0
+
+        # nominal progress along the trip shape is interpolated between the departures at the stops
+        self.departure_timestamps: np.ndarray = np.array(trip_shape.stop_time_index.departure_timestamps, dtype=np.float64)
+        self.departure_projections: np.ndarray = np.array([trip_shape.stop_projections[s.stop_sequence] for s in trip.stop_times], dtype=np.float64)
+
+        self.schedule_sigma_meters: float = max(1.0, trip_shape.length * self.SCHEDULE_SIGMA_PERCENTAGE / 100.0)
+
+    def nominal_projection(self, timestamp: int) -> float:
+        return float(np.interp(timestamp, self.departure_timestamps, self.departure_projections))
+
+
+class HmmTripModelSet:
+
+    def __init__(self, trip_models: list[HmmTripModel]) -> None:
+        self.trip_models: list[HmmTripModel] = trip_models
+
+        # segments of all trip candidates are concatenated, so each update step runs once for all trip candidates
+        num_segments: list[int] = [len(m.segment_starts) for m in trip_models]
+
+        self.num_segments: np.ndarray = np.array(num_segments, dtype=np.int64)
+        self.offsets: np.ndarray = np.cumsum(self.num_segments)[:-1]
+
+        self.segment_starts: np.ndarray = _concatenate([m.segment_starts for m in trip_models], (0, 2))
+        self.segment_vectors: np.ndarray = _concatenate([m.segment_vectors for m in trip_models], (0, 2))
+        self.segment_squared_lengths: np.ndarray = _concatenate([m.segment_squared_lengths for m in trip_models], (0,))
+        self.segment_centers: np.ndarray = _concatenate([m.segment_centers for m in trip_models], (0,))
+        self.schedule_sigmas_meters: np.ndarray = np.repeat([m.schedule_sigma_meters for m in trip_models], num_segments)
+
+        # position of each segment within its trip, used to keep transitions inside of the trip
+        self.segment_indices: np.ndarray = _concatenate([np.arange(n) for n in num_segments], (0,))
+        self.remaining_segments: np.ndarray = np.repeat(self.num_segments, num_segments) - self.segment_indices - 1
+
+    def split(self, values: np.ndarray) -> list[np.ndarray]:
+        return np.split(values, self.offsets)
+
+    def log_emission(self, point: shapely.Point, timestamp: int) -> np.ndarray:
+
+        # the GNSS position is expected near the segment and near the nominal progress of the trip
+        distances: np.ndarray = self._distances(point)
+        nominal_projections: np.ndarray = np.repeat([m.nominal_projection(timestamp) for m in self.trip_models], self.num_segments)
+
+        return -0.5 * (distances / HmmTripModel.GNSS_SIGMA_METERS) ** 2 - 0.5 * ((self.segment_centers - nominal_projections) / self.schedule_sigmas_meters) ** 2
+
+    def _distances(self, point: shapely.Point) -> np.ndarray:
+
+        # distances to all segments at once, each position is projected onto the nearest point of each segment
+        offsets: np.ndarray = np.array([point.x, point.y]) - self.segment_starts
+        fractions: np.ndarray = np.clip((offsets * self.segment_vectors).sum(axis=1) / self.segment_squared_lengths, 0.0, 1.0)
+
+        return np.hypot(*(offsets - fractions[:, None] * self.segment_vectors).T)
+
+    def log_transition(self, log_probabilities: np.ndarray, distance: float) -> np.ndarray:
+        num_segments: int = len(log_probabilities)
+        segment_length: float = HmmTripModel.SEGMENT_LENGTH
+
+        # the vehicle may move forward by the travelled distance or stay, moving backwards by one segment allows for GNSS noise
+        # transitions are limited to a band of segments, so the update is linear in the number of segments
+        max_shift: int = math.ceil((distance + 2 * segment_length) / segment_length)
+
+        shifts: np.ndarray = np.arange(-1, max_shift + 1)
+        log_transitions: np.ndarray = -np.abs(shifts * segment_length - distance) / HmmTripModel.TRANSITION_BETA_METERS
+        log_transitions = log_transitions - np.log(np.exp(log_transitions).sum())
+
+        # transitions crossing the bounds of a trip are masked, the segments of the next trip are not reachable
+        result: np.ndarray = np.full(num_segments, -np.inf)
+        for shift, log_transition in zip(shifts, log_transitions):
+            if abs(shift) >= num_segments:
+                continue
+
+            if shift >= 0:
+                np.maximum(result[shift:], log_probabilities[:num_segments - shift] + log_transition, out=result[shift:], where=self.segment_indices[shift:] >= shift)
+            else:
+                np.maximum(result[:shift], log_probabilities[-shift:] + log_transition, out=result[:shift], where=self.remaining_segments[:shift] >= -shift)
+
+        return result
+
+class HmmVehicleState:
+
+    def __init__(self) -> None:
+        self.last_gnss_position: GnssPosition|None = None
+        self.last_point: shapely.Point|None = None
+
+        # viterbi log probabilities per trip candidate and segment
+        # the vehicle is off all trip candidates in the null hypothesis
+        self.log_probabilities: dict[tuple, np.ndarray] = dict()
+        self.null_log_probability: float = 0.0
+
+        # concatenated models of the trip candidates of the last update, trip candidates rarely change between two updates
+        self.trip_model_set: HmmTripModelSet|None = None
+
+    def retain(self, trip_keys: set[tuple]) -> None:
+        # remove states of trip candidates which are not considered anymore
+        self.log_probabilities = {k: v for k, v in self.log_probabilities.items() if k in trip_keys}
+
+    def clear(self) -> None:
+        self.last_gnss_position = None
+        self.last_point = None
+        self.log_probabilities = dict()
+        self.null_log_probability = 0.0
+
+
+# experimental matcher, which is not selectable in the worker
+# it needs less CPU time per message than AvlMatcher only with many trip candidates, see util/benchmark_matchers.py
+class HmmMatcher(AvlMatcher):
+
+    NULL_DISTANCE_METERS: float = 30.0
+    MIN_PROBABILITY: float = 1e-6
+
+    def match(self, vehicle: Vehicle, gnss_positions: list[GnssPosition], last_trip_candidate_probabilities: dict|None) -> tuple[bool, dict]:
+        if len(self._trip_candidates) > 0:
+            logging.info(f"{self.__class__.__name__}: Matching AVL data for vehicle {vehicle.vehicle_ref} with {len(self._trip_candidates)} possible trip candidates ...")
+            start_time: float = time()
+
+            if len(gnss_positions) > 1:
+
+                # check whether another vehicle has logged on a trip candidate
+                # skip the ressource-consuming matching in that case and skip the candidate
+                assigned_trip_ids: set[str] = self._storage.get_assigned_trip_ids()
+                trip_candidates: list[Trip] = [t for t in self._trip_candidates if t.descriptor.trip_id not in assigned_trip_ids]
+
+                # pre-filter trip candidates like the matching engine if enabled
+                # the HMM state is kept in the matching threads, so matching processes and batches are not used here
+                trip_candidates = filter_trip_candidates(SpatialVectorCollection(gnss_positions), trip_candidates)
+
+                # load HMM state of the vehicle and run the update with all positions which are not processed yet
+                vehicle_state: HmmVehicleState = get_hmm_vehicle_state(vehicle.vehicle_ref)
+                vehicle_state.retain({get_trip_key(t) for t in trip_candidates})
+
+                self._update(vehicle_state, gnss_positions, trip_candidates)
+
+                # the probability of each trip candidate is the probability of its best path
+                # compared to the best paths of all other trip candidates and the null hypothesis
+                max_log_probabilities: dict[str, float] = {t.descriptor.trip_id: float(vehicle_state.log_probabilities[get_trip_key(t)].max()) for t in trip_candidates}
+                total_probability: float = math.exp(vehicle_state.null_log_probability) + sum(math.exp(v) for v in max_log_probabilities.values())
+
+                if last_trip_candidate_probabilities is None:
+                    last_trip_candidate_probabilities = dict()
+
+                trip_candidate_probabilities: dict = dict()
+                for trip_id in sorted(max_log_probabilities.keys()):
+                    probability: float = math.exp(max_log_probabilities[trip_id]) / total_probability
+                    if probability < self.MIN_PROBABILITY:
+                        continue
+
+                    trip_candidate_probabilities[trip_id] = (last_trip_candidate_probabilities.get(trip_id, list()) + [probability])[-PROBABILITY_HISTORY_LENGTH:]
+
+                # log if all trips have been discarded
+                # in this case, the process function is done at all
+                if len(trip_candidate_probabilities) == 0:
+                    logging.warning(f"{self.__class__.__name__}: All trip candidates have been discarded due to logical or spatial, temporal mismatch.")
+
+                    # no convergence and no candidates ...
+                    return (False, dict())
+
+                # check best candidate for convergence
+                convergence_key: str = max(trip_candidate_probabilities, key=lambda k: trip_candidate_probabilities[k][-1])
+                trip_candidate_convergence: bool = is_converged(trip_candidate_probabilities[convergence_key])
+
+                # stop time elapsed and print scored trip candidates
+                end_time: float = time()
+                logging.info(f"{self.__class__.__name__}: Matching completed after {(end_time - start_time)}s.")
+
+                for trip_id, probability_vector in trip_candidate_probabilities.items():
+                    logging.info(f"{self.__class__.__name__}: Matched [TripID] {trip_id} [Score] {probability_vector[-1]}, [Convergence] {trip_candidate_convergence}")
+
+                # finally return updated trip scores
+                return (trip_candidate_convergence, trip_candidate_probabilities)
+            else:
+                logging.warning(f"{self.__class__.__name__}: No AVL data for vehicle {vehicle.vehicle_ref}.")
+
+                return (False, last_trip_candidate_probabilities)
+
+        else:
+            logging.warning(f"{self.__class__.__name__}: No trip candidates available to match AVL data for vehicle {vehicle.vehicle_ref}.")
+
+            return (False, last_trip_candidate_probabilities)
+
+    def _update(self, vehicle_state: HmmVehicleState, gnss_positions: list[GnssPosition], trip_candidates: list[Trip]) -> None:
+
+        # restart if the positions are not continuing the former update
+        if vehicle_state.last_gnss_position is not None:
+            if gnss_positions[-1].timestamp < vehicle_state.last_gnss_position.timestamp or gnss_positions[0].timestamp - vehicle_state.last_gnss_position.timestamp > self._max_gap_seconds():
+                vehicle_state.clear()
+
+        # only positions after the last processed position are new
+        if vehicle_state.last_gnss_position is not None:
+            gnss_positions = [p for p in gnss_positions if p.timestamp > vehicle_state.last_gnss_position.timestamp]
+
+        trip_keys: list[tuple] = [get_trip_key(t) for t in trip_candidates]
+        trip_models: list[HmmTripModel] = [get_hmm_trip_model(t) for t in trip_candidates]
+
+        trip_model_set: HmmTripModelSet|None = vehicle_state.trip_model_set
+        if trip_model_set is None or len(trip_model_set.trip_models) != len(trip_models) or any(a is not b for a, b in zip(trip_model_set.trip_models, trip_models)):
+            trip_model_set = HmmTripModelSet(trip_models)
+            vehicle_state.trip_model_set = trip_model_set
+
+        # viterbi log probabilities of all trip candidates in one array
+        # trip candidates without former state or with a changed trip shape start with the current position
+        former_log_probabilities: list[np.ndarray|None] = [vehicle_state.log_probabilities.get(k, None) for k in trip_keys]
+        former_log_probabilities = [v if v is not None and len(v) == n else None for v, n in zip(former_log_probabilities, trip_model_set.num_segments)]
+
+        has_state: np.ndarray = np.repeat([v is not None for v in former_log_probabilities], trip_model_set.num_segments)
+        log_probabilities: np.ndarray = _concatenate([v if v is not None else np.full(n, -np.inf) for v, n in zip(former_log_probabilities, trip_model_set.num_segments)], (0,))
+
+        # project all new coordinates with one single call
+        if len(gnss_positions) > 0:
+            x, y = web_mercator_coords([p.longitude for p in gnss_positions], [p.latitude for p in gnss_positions])
+            points: np.ndarray = shapely.points(x, y)
+        else:
+            points: np.ndarray = np.array([])
+
+        null_log_emission: float = -0.5 * (self.NULL_DISTANCE_METERS / HmmTripModel.GNSS_SIGMA_METERS) ** 2
+
+        for gnss_position, point in zip(gnss_positions, points):
+            log_emission: np.ndarray = trip_model_set.log_emission(point, gnss_position.timestamp)
+
+            # travelled distance in web-mercator projection like the trip shape
+            if vehicle_state.last_point is None:
+                log_probabilities = log_emission
+            else:
+                distance: float = float(shapely.distance(vehicle_state.last_point, point))
+                log_probabilities = np.where(has_state, trip_model_set.log_transition(log_probabilities, distance) + log_emission, log_emission)
+
+            has_state = np.full(len(log_probabilities), True)
+            null_log_probability: float = vehicle_state.null_log_probability + null_log_emission
+
+            # normalize all log probabilities to the best one in order to keep them in range
+            max_log_probability: float = max(null_log_probability, float(log_probabilities.max())) if len(log_probabilities) > 0 else null_log_probability
+
+            vehicle_state.null_log_probability = null_log_probability - max_log_probability
+            log_probabilities = log_probabilities - max_log_probability
+
+            vehicle_state.last_gnss_position = gnss_position
+            vehicle_state.last_point = point
+
+        # trip candidates which are new with the latest position start with the current position
+        if not has_state.all():
+            log_probabilities = np.where(has_state, log_probabilities, trip_model_set.log_emission(vehicle_state.last_point, vehicle_state.last_gnss_position.timestamp))
+
+        vehicle_state.log_probabilities = dict(zip(trip_keys, trip_model_set.split(log_probabilities)))
+
+    def _max_gap_seconds(self) -> int:
+        return int(os.getenv('A2G_MATCHING_DATA_REVIEW_SECONDS', '120'))
+
+
+# process-wide HMM models of trip candidates and HMM states of all vehicles
+# processing of one vehicle is always serialized, so states are not shared between threads
+_hmm_trip_model_cache: LruCache = LruCache(int(os.getenv('A2G_MATCHING_SHAPE_CACHE_SIZE', '500')))
+_hmm_vehicle_states: LruCache = LruCache(int(os.getenv('A2G_MATCHING_STATE_CACHE_SIZE', '1000')))
+
+def _concatenate(values: list[np.ndarray], empty_shape: tuple) -> np.ndarray:
+    if len(values) == 0:
+        return np.empty(empty_shape)
+
+    return np.concatenate(values)
+
+def get_hmm_trip_model(trip: Trip) -> HmmTripModel:
+    cache_key: tuple = get_trip_version_key(trip)
+
+    trip_model: HmmTripModel|None = _hmm_trip_model_cache.get(cache_key)
+    if trip_model is None:
+        trip_model = HmmTripModel(trip)
+        _hmm_trip_model_cache.put(cache_key, trip_model)
+
+    return trip_model
+
+def get_hmm_vehicle_state(vehicle_ref: str) -> HmmVehicleState:
+    vehicle_state: HmmVehicleState|None = _hmm_vehicle_states.get(vehicle_ref)
+    if vehicle_state is None:
+        vehicle_state = HmmVehicleState()
+        _hmm_vehicle_states.put(vehicle_ref, vehicle_state)
+
+    return vehicle_state
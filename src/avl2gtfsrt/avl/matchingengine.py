@@ -0,0 +1,434 @@
+import logging
+import time
+import zlib
+
+import numpy as np
+import shapely
+
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from threading import Condition, Event, Lock, Thread
+
+from avl2gtfsrt.avl.candidatefilter import filter_trip_candidates
+from avl2gtfsrt.avl.matchingstate import SpatialMatchState, VehicleMatchingState, get_vehicle_matching_state
+from avl2gtfsrt.avl.spatialmatch import SpatialMatch
+from avl2gtfsrt.avl.spatialvector import SpatialVectorCollection
+from avl2gtfsrt.avl.temporalmatch import TemporalMatch
+from avl2gtfsrt.avl.tripshape import TripShape, get_trip_shape, get_trip_version_key
+from avl2gtfsrt.common.env import is_debug
+from avl2gtfsrt.common.shared import web_mercator_coords
+from avl2gtfsrt.model.types import GnssPosition, Trip
+from avl2gtfsrt.objectstorage import ObjectStorage, WriteBehindObjectStorage
+
+
+def get_trip_key(trip: Trip) -> tuple:
+    return (trip.descriptor.trip_id, trip.descriptor.start_date)
+
+def score_trip_candidates(vehicle_ref: str, gnss_positions: list[GnssPosition], trip_candidates: list[Trip]) -> dict[str, float]:
+    movement: SpatialVectorCollection = SpatialVectorCollection(gnss_positions)
+
+    # load matching state of the vehicle, only new positions need to be evaluated
+    # states of trip candidates which are not considered anymore are removed
+    vehicle_matching_state: VehicleMatchingState = get_vehicle_matching_state(vehicle_ref)
+    vehicle_matching_state.retain({get_trip_key(t) for t in trip_candidates})
+
+    # reject trip candidates which are far away or run into another direction before the exact matching
+    trip_candidate_scores: dict[str, float] = dict()
+    for trip_candidate in filter_trip_candidates(movement, trip_candidates):
+
+        # match trip candidate for scoring
+        # 1. step: spatial matching
+        # 2. step: temporal matching
+
+        # load prepared trip shape in web-mercator projection for spatial and temporal matching
+        trip_shape: TripShape = get_trip_shape(trip_candidate)
+
+        # run spatial matching for trip candidate
+        spatial_match: SpatialMatch = SpatialMatch(trip_shape.line, trip_shape.buffered_line)
+        spatial_match_score: float = spatial_match.calculate_match_score(
+            movement,
+            vehicle_matching_state.get_spatial_match_state(get_trip_key(trip_candidate))
+        )
+
+        if spatial_match_score == 0.0:
+            continue
+
+        # run temporal matching for trip candidate
+        temporal_match: TemporalMatch = TemporalMatch(
+            trip_candidate.stop_times,
+            trip_shape.line,
+            trip_shape.stop_projections,
+            trip_shape.stop_time_index
+        )
+
+        temporal_match_score: float = temporal_match.calculate_match_score(spatial_match.spatial_progress_percentage)
+        if temporal_match_score == 0.0:
+            continue
+
+        # finally calculate trip candidate score and store it for this iteration
+        trip_candidate_score: float = spatial_match_score * temporal_match_score
+        trip_candidate_scores[trip_candidate.descriptor.trip_id] = trip_candidate_score
+
+    return trip_candidate_scores
+
+
+# trip candidates which have been sent to this process, when running as shard of the matching engine
+_shard_trip_candidates: dict[tuple, Trip] = dict()
+
+def score_shard_trip_candidates(vehicle_ref: str, gnss_positions: list[GnssPosition], trip_keys: list[tuple], trip_candidates: list[Trip], reset: bool) -> dict[str, float]:
+
+    # only trip candidates which are new or have changed are sent, all others are known already
+    if reset:
+        _shard_trip_candidates.clear()
+
+    for trip_candidate in trip_candidates:
+        _shard_trip_candidates[get_trip_key(trip_candidate)] = trip_candidate
+
+    return score_trip_candidates(vehicle_ref, gnss_positions, [_shard_trip_candidates[k] for k in trip_keys])
+
+
+def score_trip_candidates_batch(requests: list[tuple[str, list[GnssPosition], list[Trip]]]) -> list[dict[str, float]]:
+
+    # collect positions which are not evaluated yet of all vehicles and trip candidates
+    # each trip candidate is evaluated once for all vehicles which consider it
+    trip_candidates: dict[tuple, Trip] = dict()
+    trip_candidate_evaluations: dict[tuple, list[tuple[SpatialMatchState, int, int]]] = dict()
+
+    gnss_positions: list[GnssPosition] = list()
+    filtered_trip_candidates: list[list[Trip]] = list()
+    for vehicle_ref, vehicle_gnss_positions, vehicle_trip_candidates in requests:
+        vehicle_matching_state: VehicleMatchingState = get_vehicle_matching_state(vehicle_ref)
+        vehicle_matching_state.retain({get_trip_key(t) for t in vehicle_trip_candidates})
+
+        # reject trip candidates which are far away or run into another direction before the exact matching
+        filtered_trip_candidates.append(filter_trip_candidates(SpatialVectorCollection(vehicle_gnss_positions), vehicle_trip_candidates))
+
+        # positions which are not evaluated yet are always the latest positions of the vehicle
+        # so the positions are added once per vehicle, starting with the first position not evaluated for any trip candidate
+        vehicle_evaluations: list[tuple[tuple, SpatialMatchState, int]] = list()
+        for trip_candidate in filtered_trip_candidates[-1]:
+            trip_key: tuple = get_trip_key(trip_candidate)
+            spatial_match_state: SpatialMatchState = vehicle_matching_state.get_spatial_match_state(trip_key)
+
+            num_new_gnss_positions: int = len(spatial_match_state.sync(vehicle_gnss_positions))
+
+            trip_candidates[trip_key] = trip_candidate
+            vehicle_evaluations.append((trip_key, spatial_match_state, len(vehicle_gnss_positions) - num_new_gnss_positions))
+
+        if len(vehicle_evaluations) == 0:
+            continue
+
+        vehicle_offset: int = min(e[2] for e in vehicle_evaluations)
+        vehicle_start: int = len(gnss_positions) - vehicle_offset
+
+        gnss_positions.extend(vehicle_gnss_positions[vehicle_offset:])
+
+        # each trip candidate refers to its new positions in the range of the vehicle
+        for trip_key, spatial_match_state, num_evaluated_gnss_positions in vehicle_evaluations:
+            trip_candidate_evaluations.setdefault(trip_key, list()).append((spatial_match_state, vehicle_start + num_evaluated_gnss_positions, len(gnss_positions)))
+
+    # project all new coordinates of all vehicles with one single call
+    movement_x, movement_y = web_mercator_coords([p.longitude for p in gnss_positions], [p.latitude for p in gnss_positions])
+    movement_points: np.ndarray = shapely.points(movement_x, movement_y)
+
+    # evaluate all new positions against each trip candidate with one single call per trip candidate
+    temporal_matches: dict[tuple, TemporalMatch] = dict()
+    for trip_key, evaluations in trip_candidate_evaluations.items():
+        trip_shape: TripShape = get_trip_shape(trip_candidates[trip_key])
+
+        indices: np.ndarray = np.concatenate([np.arange(start, end) for _, start, end in evaluations])
+        if len(indices) > 0:
+            covered: np.ndarray = shapely.covers(trip_shape.buffered_line, movement_points[indices])
+            projections: np.ndarray = shapely.line_locate_point(trip_shape.line, movement_points[indices])
+
+            offset: int = 0
+            for spatial_match_state, start, end in evaluations:
+                spatial_match_state.extend(gnss_positions[start:end], covered[offset:offset + end - start], projections[offset:offset + end - start])
+                offset = offset + end - start
+
+        # temporal matching depends only on the trip candidate, so it's shared by all vehicles
+        temporal_matches[trip_key] = TemporalMatch(
+            trip_candidates[trip_key].stop_times,
+            trip_shape.line,
+            trip_shape.stop_projections,
+            trip_shape.stop_time_index
+        )
+
+    # finally score the trip candidates of each vehicle based on the updated states
+    results: list[dict[str, float]] = list()
+    for (vehicle_ref, _, _), vehicle_trip_candidates in zip(requests, filtered_trip_candidates):
+        vehicle_matching_state: VehicleMatchingState = get_vehicle_matching_state(vehicle_ref)
+
+        trip_candidate_scores: dict[str, float] = dict()
+        for trip_candidate in vehicle_trip_candidates:
+            trip_key: tuple = get_trip_key(trip_candidate)
+            trip_shape: TripShape = get_trip_shape(trip_candidate)
+
+            # run spatial matching for trip candidate
+            spatial_match: SpatialMatch = SpatialMatch(trip_shape.line, trip_shape.buffered_line)
+            spatial_match_score: float = spatial_match.calculate_state_match_score(vehicle_matching_state.get_spatial_match_state(trip_key))
+            if spatial_match_score == 0.0:
+                continue
+
+            # run temporal matching for trip candidate
+            temporal_match_score: float = temporal_matches[trip_key].calculate_match_score(spatial_match.spatial_progress_percentage)
+            if temporal_match_score == 0.0:
+                continue
+
+            # finally calculate trip candidate score and store it for this iteration
+            trip_candidate_scores[trip_candidate.descriptor.trip_id] = spatial_match_score * temporal_match_score
+
+        results.append(trip_candidate_scores)
+
+    return results
+
+
+class MatchingEngine:
+
+    # maximum number of trip candidates kept by each shard, all are sent again after exceeding it
+    MAX_SHARD_TRIP_CANDIDATES: int = 5000
+
+    # maximum time a matching thread waits for its shard before scoring its request on its own
+    SCORE_TIMEOUT_SECONDS: float = 30.0
+
+    def __init__(self, object_storage: ObjectStorage, num_processes: int = 0) -> None:
+        self._storage = object_storage
+        self._num_processes: int = max(0, num_processes)
+
+        # each shard is a process of its own, vehicles are always assigned to the same shard
+        # by a stable hash of their vehicle ref, so trip shapes and matching states stay warm
+        self._shards: list[ProcessPoolExecutor|None] = [None] * self._num_processes
+        self._shards_lock: Lock = Lock()
+
+        # trip candidates which have been sent to each shard, so they're not pickled with every request
+        self._shard_trip_candidates: list[dict[tuple, tuple]] = [dict() for _ in range(0, self._num_processes)]
+
+    def score(self, vehicle_ref: str, gnss_positions: list[GnssPosition], trip_candidates: list[Trip]) -> dict[str, float]:
+
+        # check whether another vehicle has logged on a trip candidate
+        # skip the ressource-consuming matching in that case and skip the candidate
+        assigned_trip_ids: set[str] = self._storage.get_assigned_trip_ids()
+        trip_candidates = [t for t in trip_candidates if t.descriptor.trip_id not in assigned_trip_ids]
+
+        if self._num_processes == 0:
+            return score_trip_candidates(vehicle_ref, gnss_positions, trip_candidates)
+
+        shard_index: int = zlib.crc32(vehicle_ref.encode('utf-8')) % self._num_processes
+
+        shard: ProcessPoolExecutor|None = None
+
+        try:
+            # the calling thread waits for the result without holding the GIL
+            shard, future = self._submit(shard_index, vehicle_ref, gnss_positions, trip_candidates)
+            return future.result(timeout=self.SCORE_TIMEOUT_SECONDS)
+
+        except BrokenProcessPool as ex:
+            if is_debug():
+                logging.exception(ex)
+            else:
+                logging.error(str(ex))
+
+            # restart the shard with the next update, score this update in the current thread
+            logging.warning(f"{self.__class__.__name__}: Matching process {shard_index} terminated unexpectedly. Scoring trip candidates for vehicle {vehicle_ref} locally ...")
+            self._reset_shard(shard_index, shard)
+
+            return score_trip_candidates(vehicle_ref, gnss_positions, trip_candidates)
+
+        except TimeoutError:
+            logging.error(f"{self.__class__.__name__}: Matching process {shard_index} did not score trip candidates for vehicle {vehicle_ref} within {self.SCORE_TIMEOUT_SECONDS}s. Scoring trip candidates locally ...")
+
+            # the request may be withdrawn before the shard received its trip candidates, so the shard is not consistent anymore
+            # a hung or overloaded shard is replaced by a new one with the next update, requests submitted to it already are finished by it
+            future.cancel()
+            self._reset_shard(shard_index, shard)
+
+            return score_trip_candidates(vehicle_ref, gnss_positions, trip_candidates)
+
+    def close(self) -> None:
+        with self._shards_lock:
+            for shard in self._shards:
+                if shard is not None:
+                    shard.shutdown(wait=True)
+
+            self._shards = [None] * self._num_processes
+            self._shard_trip_candidates = [dict() for _ in range(0, self._num_processes)]
+
+    def _submit(self, shard_index: int, vehicle_ref: str, gnss_positions: list[GnssPosition], trip_candidates: list[Trip]) -> tuple[ProcessPoolExecutor, Future]:
+        with self._shards_lock:
+            if self._shards[shard_index] is None:
+                logging.info(f"{self.__class__.__name__}: Starting matching process {shard_index} ...")
+                self._shards[shard_index] = ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn'))
+
+            # the shard processes its requests in order of submission, so it knows all trip candidates sent before
+            # changed trip candidates are detected by their version key, comparing the whole trips is too expensive
+            known_trip_candidates: dict[tuple, tuple] = self._shard_trip_candidates[shard_index]
+
+            reset: bool = len(known_trip_candidates) > self.MAX_SHARD_TRIP_CANDIDATES
+            if reset:
+                known_trip_candidates.clear()
+
+            trip_keys: list[tuple] = list()
+            new_trip_candidates: list[Trip] = list()
+            for trip_candidate in trip_candidates:
+                trip_key: tuple = get_trip_key(trip_candidate)
+                trip_version_key: tuple = get_trip_version_key(trip_candidate)
+
+                if known_trip_candidates.get(trip_key, None) != trip_version_key:
+                    known_trip_candidates[trip_key] = trip_version_key
+                    new_trip_candidates.append(trip_candidate)
+
+                trip_keys.append(trip_key)
+
+            shard: ProcessPoolExecutor = self._shards[shard_index]
+            return (shard, shard.submit(score_shard_trip_candidates, vehicle_ref, gnss_positions, trip_keys, new_trip_candidates, reset))
+
+    def _reset_shard(self, shard_index: int, shard: ProcessPoolExecutor|None) -> None:
+        with self._shards_lock:
+
+            # several matching threads may fail with the same shard, it's replaced only once
+            if shard is not None and self._shards[shard_index] is not shard:
+                return
+
+            if self._shards[shard_index] is not None:
+                self._shards[shard_index].shutdown(wait=False)
+                self._shards[shard_index] = None
+
+            self._shard_trip_candidates[shard_index] = dict()
+
+
+class BatchMatchingEngine(MatchingEngine):
+
+    # maximum time a matching thread waits for the next tick before scoring its request on its own
+    SCORE_TIMEOUT_SECONDS: float = 30.0
+
+    def __init__(self, object_storage: ObjectStorage, batch_interval_ms: int = 200, max_batch_size: int = 10) -> None:
+        super().__init__(object_storage, 0)
+
+        self._batch_interval_seconds: float = max(1, batch_interval_ms) / 1000.0
+        self._max_batch_size: int = max(1, max_batch_size)
+
+        # pending requests of all vehicles, which are scored together with the next tick
+        # each vehicle is processed by one matching thread at a time, so there's one request per vehicle at most
+        # matching threads wait for the result, so a tick contains one request per matching thread at most
+        # the tick is started as soon as all matching threads are waiting, the batch interval is the maximum waiting time
+        self._pending_requests: list[tuple[str, list[GnssPosition], list[Trip], Future]] = list()
+        self._pending_requests_lock: Lock = Lock()
+        self._pending_requests_condition: Condition = Condition(self._pending_requests_lock)
+
+        self._should_run: Event = Event()
+        self._should_run.set()
+
+        self._thread: Thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def score(self, vehicle_ref: str, gnss_positions: list[GnssPosition], trip_candidates: list[Trip]) -> dict[str, float]:
+        future: Future|None = Future()
+
+        # requests after closing the engine are not scored by any tick anymore, so they're scored in the current thread
+        with self._pending_requests_lock:
+            if self._should_run.is_set():
+                self._pending_requests.append((vehicle_ref, gnss_positions, trip_candidates, future))
+
+                if len(self._pending_requests) >= self._max_batch_size:
+                    self._pending_requests_condition.notify()
+            else:
+                future = None
+
+        if future is None:
+            return super().score(vehicle_ref, gnss_positions, trip_candidates)
+
+        # the matching thread waits until the request was scored with the next tick
+        try:
+            return future.result(timeout=self.SCORE_TIMEOUT_SECONDS)
+        except TimeoutError:
+
+            # requests which are scored by a tick right now are awaited, all others are withdrawn and scored here
+            if not future.cancel():
+                return future.result()
+
+            logging.warning(f"{self.__class__.__name__}: Trip candidates for vehicle {vehicle_ref} not scored within {self.SCORE_TIMEOUT_SECONDS}s. Scoring trip candidates locally ...")
+            return super().score(vehicle_ref, gnss_positions, trip_candidates)
+
+    def close(self) -> None:
+        with self._pending_requests_lock:
+            self._should_run.clear()
+            self._pending_requests_condition.notify()
+
+        self._thread.join()
+
+        # score all remaining requests in order to release the waiting matching threads
+        self._process_batch()
+
+    def _run(self) -> None:
+        next_flush_time: float = time.monotonic() + self._batch_interval_seconds
+
+        try:
+            while self._should_run.is_set():
+                with self._pending_requests_condition:
+                    self._pending_requests_condition.wait_for(
+                        lambda: len(self._pending_requests) >= self._max_batch_size or not self._should_run.is_set(),
+                        timeout=self._batch_interval_seconds
+                    )
+
+                try:
+                    # write all vehicles which have been updated since the last flush with one bulk write
+                    # ticks may follow each other quickly under load, so vehicles are flushed once per batch interval
+                    if isinstance(self._storage, WriteBehindObjectStorage) and time.monotonic() >= next_flush_time:
+                        self._storage.flush()
+                        next_flush_time = time.monotonic() + self._batch_interval_seconds
+
+                    self._process_batch()
+                except Exception as ex:
+                    if is_debug():
+                        logging.exception(ex)
+                    else:
+                        logging.error(str(ex))
+        finally:
+
+            # if the thread terminates unexpectedly, further requests are scored by the matching threads on their own
+            with self._pending_requests_lock:
+                self._should_run.clear()
+
+            self._process_batch()
+
+    def _process_batch(self) -> None:
+        with self._pending_requests_lock:
+            requests: list[tuple[str, list[GnssPosition], list[Trip], Future]] = self._pending_requests
+            self._pending_requests = list()
+
+        # requests which have been withdrawn by their matching thread after a timeout are skipped
+        requests = [r for r in requests if r[3].set_running_or_notify_cancel()]
+
+        if len(requests) == 0:
+            return
+
+        try:
+            start_time: float = time.time()
+
+            # load all trips which are assigned to vehicles with one single lookup for the whole batch
+            assigned_trip_ids: set[str] = self._storage.get_assigned_trip_ids()
+
+            results: list[dict[str, float]] = score_trip_candidates_batch([
+                (vehicle_ref, gnss_positions, [t for t in trip_candidates if t.descriptor.trip_id not in assigned_trip_ids])
+                for vehicle_ref, gnss_positions, trip_candidates, _ in requests
+            ])
+
+            for request, result in zip(requests, results):
+                request[3].set_result(result)
+
+            end_time: float = time.time()
+            logging.info(f"{self.__class__.__name__}: Scored trip candidates of {len(requests)} vehicles after {(end_time - start_time)}s.")
+
+        except BaseException as ex:
+            if is_debug():
+                logging.exception(ex)
+            else:
+                logging.error(str(ex))
+
+            for request in requests:
+                if not request[3].done():
+                    request[3].set_exception(ex)
+
+            if not isinstance(ex, Exception):
+                raise
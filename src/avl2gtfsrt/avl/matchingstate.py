@@ -0,0 +1,131 @@
+import os
+
+from collections import deque
+
+from avl2gtfsrt.common.cache import LruCache
+from avl2gtfsrt.model.types import GnssPosition
+
+
+class SpatialMatchState:
+
+    def __init__(self) -> None:
+
+        # evaluated GNSS positions of the current window
+        # each position is identified by its timestamp and coordinates
+        self._keys: deque = deque()
+        self._covered: deque = deque()
+        self._projections: deque = deque()
+
+        # running counters for the current window
+        self.num_points_matching: int = 0
+        self.num_forward_movements: int = 0
+        self.num_backward_movements: int = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def last_projection(self) -> float|None:
+        return self._projections[-1] if len(self._projections) > 0 else None
+
+    def sync(self, gnss_positions: list[GnssPosition]) -> list[GnssPosition]:
+        keys: list[tuple] = [self._get_key(p) for p in gnss_positions]
+
+        # drop all positions which are not part of the window anymore
+        while len(self._keys) > 0 and self._keys[0] != keys[0]:
+            self._pop_left()
+
+        # the remaining positions must be the start of the window,
+        # otherwise the history has changed and the state is rebuilt completely
+        if len(self._keys) > len(keys) or (len(self._keys) > 0 and self._keys[-1] != keys[len(self._keys) - 1]):
+            self.clear()
+
+        # return all positions which are not evaluated yet
+        return gnss_positions[len(self._keys):]
+
+    def extend(self, gnss_positions: list[GnssPosition], covered: list[bool], projections: list[float]) -> None:
+        for p, c, d in zip(gnss_positions, covered, projections):
+            if len(self._projections) > 0:
+                self._count_movement(self._projections[-1], float(d), 1)
+
+            self._keys.append(self._get_key(p))
+            self._covered.append(bool(c))
+            self._projections.append(float(d))
+
+            if c:
+                self.num_points_matching = self.num_points_matching + 1
+
+    def replace_last(self, gnss_position: GnssPosition, covered: bool, projection: float) -> None:
+        if len(self._keys) == 0:
+            return
+
+        self._pop_right()
+        self.extend([gnss_position], [covered], [projection])
+
+    def clear(self) -> None:
+        self._keys.clear()
+        self._covered.clear()
+        self._projections.clear()
+
+        self.num_points_matching = 0
+        self.num_forward_movements = 0
+        self.num_backward_movements = 0
+
+    def _pop_left(self) -> None:
+        self._keys.popleft()
+        covered: bool = self._covered.popleft()
+        projection: float = self._projections.popleft()
+
+        if covered:
+            self.num_points_matching = self.num_points_matching - 1
+
+        if len(self._projections) > 0:
+            self._count_movement(projection, self._projections[0], -1)
+
+    def _pop_right(self) -> None:
+        self._keys.pop()
+        covered: bool = self._covered.pop()
+        projection: float = self._projections.pop()
+
+        if covered:
+            self.num_points_matching = self.num_points_matching - 1
+
+        if len(self._projections) > 0:
+            self._count_movement(self._projections[-1], projection, -1)
+
+    def _count_movement(self, from_projection: float, to_projection: float, increment: int) -> None:
+        if from_projection < to_projection:
+            self.num_forward_movements = self.num_forward_movements + increment
+        elif from_projection > to_projection:
+            self.num_backward_movements = self.num_backward_movements + increment
+
+    def _get_key(self, gnss_position: GnssPosition) -> tuple:
+        return (gnss_position.timestamp, gnss_position.latitude, gnss_position.longitude)
+
+
+class VehicleMatchingState:
+
+    def __init__(self) -> None:
+        self._spatial_match_states: dict[tuple, SpatialMatchState] = dict()
+
+    def get_spatial_match_state(self, trip_key: tuple) -> SpatialMatchState:
+        if trip_key not in self._spatial_match_states:
+            self._spatial_match_states[trip_key] = SpatialMatchState()
+
+        return self._spatial_match_states[trip_key]
+
+    def retain(self, trip_keys: set[tuple]) -> None:
+        # remove states of trip candidates which are not considered anymore
+        self._spatial_match_states = {k: v for k, v in self._spatial_match_states.items() if k in trip_keys}
+
+
+# process-wide matching states of all vehicles
+# processing of one vehicle is always serialized, so states are not shared between threads
+_vehicle_matching_states: LruCache = LruCache(int(os.getenv('A2G_MATCHING_STATE_CACHE_SIZE', '1000')))
+
+def get_vehicle_matching_state(vehicle_ref: str) -> VehicleMatchingState:
+    vehicle_matching_state: VehicleMatchingState|None = _vehicle_matching_states.get(vehicle_ref)
+    if vehicle_matching_state is None:
+        vehicle_matching_state = VehicleMatchingState()
+        _vehicle_matching_states.put(vehicle_ref, vehicle_matching_state)
+
+    return vehicle_matching_state
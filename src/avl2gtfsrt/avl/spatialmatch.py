@@ -1,9 +1,13 @@
 import logging
+import numpy as np
+import shapely
 
-from shapely.geometry import LineString, Polygon, Point
+from shapely.geometry import LineString, Polygon
 
-from avl2gtfsrt.common.shared import clamp, web_mercator
+from avl2gtfsrt.common.shared import clamp, web_mercator_coords
+from avl2gtfsrt.avl.matchingstate import SpatialMatchState
 from avl2gtfsrt.avl.spatialvector import SpatialVectorCollection
+from avl2gtfsrt.model.types import GnssPosition
 
 
 class SpatialMatch:
@@ -12,31 +16,55 @@ class SpatialMatch:
     TRIP_SHAPE_MATCHING_RATIO: float = 0.60
     TRIP_SHAPE_FORWARD_MOVEMENT_RATIO: float = 0.75
 
-    def __init__(self, trip_shape: LineString) -> None:
+    def __init__(self, trip_shape: LineString, buffered_trip_shape: Polygon|None = None) -> None:
         
         # transform shape of the trip candidate into a LineString
         self._trip_shape: LineString = trip_shape
         
         # add buffer around trip shape to allow for some tolerance in matching
-        self._buffered_trip_shape: Polygon = self._trip_shape.buffer(self.TRIP_SHAPE_BUFFER_SIZE)
+        # use the already buffered trip shape if available
+        if buffered_trip_shape is not None:
+            self._buffered_trip_shape: Polygon = buffered_trip_shape
+        else:
+            self._buffered_trip_shape: Polygon = self._trip_shape.buffer(self.TRIP_SHAPE_BUFFER_SIZE)
+            shapely.prepare(self._buffered_trip_shape)
 
         # containers for later calculated data
         self.match_score: float = 0.0
         self.spatial_progress_distance: float|None = None
         self.spatial_progress_percentage: float|None = None
     
-    def calculate_match_score(self, vehicle_movement: SpatialVectorCollection) -> float:
-        movement_coords: list = [(v.start.longitude, v.start.latitude) for v in vehicle_movement.spatial_vectors]
-        movement_coords.append((vehicle_movement.spatial_vectors[-1].end.longitude, vehicle_movement.spatial_vectors[-1].end.latitude))
-        movement_coords = [web_mercator(Point(*c)) for c in movement_coords]
+    def calculate_match_score(self, vehicle_movement: SpatialVectorCollection, state: SpatialMatchState|None = None) -> float:
+
+        # use a temporary state if there's no state of former matchings available
+        # otherwise only the new positions are evaluated and added to the state
+        if state is None:
+            state = SpatialMatchState()
+
+        gnss_positions: list[GnssPosition] = state.sync(vehicle_movement.gnss_positions)
+        if len(gnss_positions) > 0:
+
+            # project all new coordinates with one single call
+            movement_x, movement_y = web_mercator_coords([p.longitude for p in gnss_positions], [p.latitude for p in gnss_positions])
+            movement_points: np.ndarray = shapely.points(movement_x, movement_y)
+
+            state.extend(
+                gnss_positions,
+                shapely.covers(self._buffered_trip_shape, movement_points),
+                shapely.line_locate_point(self._trip_shape, movement_points)
+            )
+
+        return self.calculate_state_match_score(state)
+
+    def calculate_state_match_score(self, state: SpatialMatchState) -> float:
 
         # calculate percentual progress of the trip determined by position
-        self.spatial_progress_distance = self._trip_shape.project(movement_coords[-1])
+        self.spatial_progress_distance = state.last_projection()
         self.spatial_progress_percentage = self.spatial_progress_distance / self._trip_shape.length * 100.0
 
         # check if the GNSS coordinate activty matches the trip candidate
-        num_points_matching: int = sum(1 for c in movement_coords if self._buffered_trip_shape.covers(c))
-        num_points_total: int = len(movement_coords)
+        num_points_matching: int = state.num_points_matching
+        num_points_total: int = len(state)
 
         match_ratio: float = num_points_matching / num_points_total if num_points_total > 0 else 0.0
         if match_ratio < self.TRIP_SHAPE_MATCHING_RATIO:
@@ -46,10 +74,8 @@ class SpatialMatch:
 
         # check if the activity runs into the same direction as the trip candidate
         # therefore, a certain proportion of the activity must move forward along the trip shape
-        activity_projections: list = [self._trip_shape.project(c) for c in movement_coords]
-
-        num_forward_movements: int = sum(1 for i in range(len(activity_projections) - 1) if activity_projections[i] < activity_projections[i + 1])
-        num_backward_movements: int = sum(1 for i in range(len(activity_projections) - 1) if activity_projections[i] > activity_projections[i + 1])
+        num_forward_movements: int = state.num_forward_movements
+        num_backward_movements: int = state.num_backward_movements
 
         forward_movement_ratio: float = clamp(num_forward_movements / num_backward_movements if num_backward_movements > 0 else 1.0, 0.0, 1.0)
         if forward_movement_ratio < self.TRIP_SHAPE_FORWARD_MOVEMENT_RATIO:
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 from avl2gtfsrt.model.types import GnssPosition
 
@@ -60,41 +61,85 @@ class SpatialVector:
 class SpatialVectorCollection:
 
     def __init__(self, gnss_positions: list[GnssPosition]) -> None:
-        self.spatial_vectors: list[SpatialVector] = []
+        self.gnss_positions: list[GnssPosition] = gnss_positions
 
         if len(gnss_positions) < 2:
             raise ValueError('At least 2 GNSS positions are required for creating a vector or vector collection!')
 
-        for p in range(0, len(gnss_positions) - 1):
-            pos1: GnssPosition = gnss_positions[p]
-            pos2: GnssPosition = gnss_positions[p + 1]
+        # store all coordinates in arrays, vectors between consecutive positions are calculated at once
+        self.latitudes: np.ndarray = np.fromiter((p.latitude for p in gnss_positions), dtype=np.float64, count=len(gnss_positions))
+        self.longitudes: np.ndarray = np.fromiter((p.longitude for p in gnss_positions), dtype=np.float64, count=len(gnss_positions))
+        self.timestamps: np.ndarray = np.fromiter((p.timestamp for p in gnss_positions), dtype=np.float64, count=len(gnss_positions))
 
-            self.spatial_vectors.append(
-                SpatialVector(pos1, pos2)
+        self._cached_lengths: np.ndarray|None = None
+        self._cached_spatial_vectors: list[SpatialVector]|None = None
+
+    @property
+    def spatial_vectors(self) -> list[SpatialVector]:
+        if self._cached_spatial_vectors is None:
+            self._cached_spatial_vectors = [SpatialVector(p1, p2) for p1, p2 in zip(self.gnss_positions[:-1], self.gnss_positions[1:])]
+
+        return self._cached_spatial_vectors
+
+    def lengths(self) -> np.ndarray:
+        if self._cached_lengths is None:
+            self._cached_lengths = _haversine_distances(
+                self.latitudes[:-1], self.longitudes[:-1],
+                self.latitudes[1:], self.longitudes[1:]
             )
 
+        return self._cached_lengths
+
+    def bearings(self) -> np.ndarray:
+        return _bearings(
+            self.latitudes[:-1], self.longitudes[:-1],
+            self.latitudes[1:], self.longitudes[1:]
+        )
+
     def length(self) -> float:
-        total_length: float = sum([v.length() for v in self.spatial_vectors])
+        total_length: float = float(self.lengths().sum())
         return total_length
     
     def bearing(self) -> float:
-        bearing_vector: SpatialVector = SpatialVector(
-            self.spatial_vectors[0].start,
-            self.spatial_vectors[-1].end
-        )
-
-        return bearing_vector.bearing()
+        return float(_bearings(
+            self.latitudes[0], self.longitudes[0],
+            self.latitudes[-1], self.longitudes[-1]
+        ))
 
     def is_movement(self, min_distance: int = 50) -> bool:
         total_distance: float = self.length()
-        direct_distance: float = SpatialVector(
-            self.spatial_vectors[0].start,
-            self.spatial_vectors[-1].end
-        ).length()
+        direct_distance: float = float(_haversine_distances(
+            self.latitudes[0], self.longitudes[0],
+            self.latitudes[-1], self.longitudes[-1]
+        ))
 
         if total_distance < min_distance:
             return False
         
         linearity: float = direct_distance / total_distance if total_distance > 0 else 0
 
-        return linearity > 0.35
\ No newline at end of file
+        return linearity > 0.35
+
+
+def _haversine_distances(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return 6371000 * c
+
+def _bearings(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+
+    dlon = lon2 - lon1
+
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+
+    bearing_deg = np.degrees(np.arctan2(x, y))
+
+    return (bearing_deg + 360) % 360
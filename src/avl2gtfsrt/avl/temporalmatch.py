@@ -1,19 +1,45 @@
 import logging
 import os
 
+from bisect import bisect_left
+
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 from shapely.geometry import LineString, Point
 
-from avl2gtfsrt.common.shared import web_mercator, clamp
+from avl2gtfsrt.common.shared import web_mercator, web_mercator_coords, clamp
 from avl2gtfsrt.model.types import GnssPosition, StopTime, TripMetrics
 
 
+class StopTimeIndex:
+
+    def __init__(self, stop_times: list[StopTime], stop_projections_on_trip_shape: dict) -> None:
+
+        # sorted departure timestamps for finding the current segment by time
+        self.departure_timestamps: list[int] = [s.departure_timestamp for s in stop_times]
+
+        # stop sequences and their projections in order of the trip
+        # the running maximum of the projections is sorted, so the first stop beyond a position can be found by bisection
+        self.stop_sequences: list[int] = list(stop_projections_on_trip_shape.keys())
+        self.stop_projections: list[float] = list(stop_projections_on_trip_shape.values())
+
+        self.stop_projection_maxima: list[float] = list()
+        for stop_projection in self.stop_projections:
+            self.stop_projection_maxima.append(max(stop_projection, self.stop_projection_maxima[-1]) if len(self.stop_projection_maxima) > 0 else stop_projection)
+
+        self.last_stop_sequence: int = max(self.stop_sequences)
+
+        # stop times by their stop sequence, the first stop time is used for duplicate stop sequences
+        self.stop_times_by_stop_sequence: dict[int, StopTime] = dict()
+        for s in stop_times:
+            self.stop_times_by_stop_sequence.setdefault(s.stop_sequence, s)
+
+
 class TemporalMatch:
 
     MAX_DEVIATION_PERCENTAGE: float = 30.0
 
-    def __init__(self, stop_times: list[StopTime], trip_shape: LineString) -> None:
+    def __init__(self, stop_times: list[StopTime], trip_shape: LineString, stop_projections_on_trip_shape: dict|None = None, stop_time_index: StopTimeIndex|None = None) -> None:
 
         # store stop times for further processing
         self._stop_times: list[StopTime] = stop_times
@@ -21,7 +47,18 @@ class TemporalMatch:
         # transform shape of the trip candidate into a LineString
         self._trip_shape: LineString = trip_shape
 
-        self._stop_projections_on_trip_shape: dict = {s.stop_sequence: self._trip_shape.project(web_mercator(Point(s.stop.longitude, s.stop.latitude))) for s in self._stop_times}
+        # use already projected stops if available
+        if stop_projections_on_trip_shape is not None:
+            self._stop_projections_on_trip_shape: dict = stop_projections_on_trip_shape
+        else:
+            stop_x, stop_y = web_mercator_coords([s.stop.longitude for s in self._stop_times], [s.stop.latitude for s in self._stop_times])
+            self._stop_projections_on_trip_shape: dict = {s.stop_sequence: self._trip_shape.project(Point(x, y)) for s, x, y in zip(self._stop_times, stop_x, stop_y)}
+
+        # use already indexed stop times if available
+        if stop_time_index is not None:
+            self._stop_time_index: StopTimeIndex = stop_time_index
+        else:
+            self._stop_time_index: StopTimeIndex = StopTimeIndex(self._stop_times, self._stop_projections_on_trip_shape)
 
         # containers for later calculated data
         self.time_based_progress_percentage: float = 0.0
@@ -48,33 +85,30 @@ class TemporalMatch:
 
         # calculate the current percentual progress of the trip 
         # based on times of stop times
-        for c in range(0, len(self._stop_times) - 1):
-            this_stop_time: StopTime = self._stop_times[c]
-            next_stop_time: StopTime = self._stop_times[c + 1]
-
-            this_departure: int = this_stop_time.departure_timestamp
-            next_departure: int = next_stop_time.departure_timestamp
+        # the current timestamp is on/between the stop before the first departure not before the current timestamp and that stop
+        c: int = bisect_left(self._stop_time_index.departure_timestamps, current_timestamp) - 1
 
-            # if the current timestamp is on/bewteen two stops
-            if this_departure <= current_timestamp <= next_departure:
+        this_stop_time: StopTime = self._stop_times[c]
+        next_stop_time: StopTime = self._stop_times[c + 1]
 
-                # calculate the percentual progress of the trip based on the current timestamp
-                this_duration: int = abs(current_timestamp - this_departure)
-                next_duration: int = abs(next_departure - this_departure)
+        this_departure: int = this_stop_time.departure_timestamp
+        next_departure: int = next_stop_time.departure_timestamp
 
-                time_based_progress: float = (this_duration / next_duration) if next_duration > 0.0 else 1.0
+        # calculate the percentual progress of the trip based on the current timestamp
+        this_duration: int = abs(current_timestamp - this_departure)
+        next_duration: int = abs(next_departure - this_departure)
 
-                # calculate the projection length based on the time-based progress
-                this_projection: float = self._stop_projections_on_trip_shape[this_stop_time.stop_sequence]
-                next_projection: float = self._stop_projections_on_trip_shape[next_stop_time.stop_sequence]
-                
-                self.time_based_progress_percentage = (this_projection + (next_projection - this_projection) * time_based_progress) / self._trip_shape.length * 100.0
-                self.time_based_progress_percentage = clamp(self.time_based_progress_percentage, 0.0, 100.0)
+        time_based_progress: float = (this_duration / next_duration) if next_duration > 0.0 else 1.0
 
-                self.time_based_current_stop_sequence: int = this_stop_time.stop_sequence
-                self.time_based_next_stop_sequence: int = next_stop_time.stop_sequence
+        # calculate the projection length based on the time-based progress
+        this_projection: float = self._stop_projections_on_trip_shape[this_stop_time.stop_sequence]
+        next_projection: float = self._stop_projections_on_trip_shape[next_stop_time.stop_sequence]
+        
+        self.time_based_progress_percentage = (this_projection + (next_projection - this_projection) * time_based_progress) / self._trip_shape.length * 100.0
+        self.time_based_progress_percentage = clamp(self.time_based_progress_percentage, 0.0, 100.0)
 
-                break  
+        self.time_based_current_stop_sequence: int = this_stop_time.stop_sequence
+        self.time_based_next_stop_sequence: int = next_stop_time.stop_sequence
 
     def calculate_match_score(self, spatial_progress_percentage: float) -> float:
         
@@ -112,40 +146,41 @@ class TemporalMatch:
         position_projection: float = self._trip_shape.project(web_mercator(Point(gnss_position.longitude, gnss_position.latitude)))
 
         # determine current and next stop index
-        for stop_sequence, stop_projection in self._stop_projections_on_trip_shape.items():
-            if stop_projection >= position_projection:
-                # calculate distance to the next stop and predict stop status
-                distance: float = stop_projection - position_projection
-                if abs(distance) < 30:
-                    trip_metrics.current_stop_status = 'STOPPED_AT'
-
-                    if stop_sequence == max(list(self._stop_projections_on_trip_shape.keys())):
-                        trip_metrics.current_stop_is_final = True
-
-                elif distance < 60:
-                    trip_metrics.current_stop_status = 'INCOMING_AT'
-
-                    if stop_sequence == max(list(self._stop_projections_on_trip_shape.keys())):
-                        trip_metrics.current_stop_is_final = True
-
-                # set current and next stop sequence and ID
-                if stop_sequence > 0:
-                    trip_metrics.current_stop_sequence = stop_sequence - 1
-                    trip_metrics.current_stop_id = self._stop_times[stop_sequence - 1].stop.stop_id
-                
-                trip_metrics.next_stop_sequence = stop_sequence
-                trip_metrics.next_stop_id = self._stop_times[stop_sequence].stop.stop_id
-
-                # monitor delay between nominal next stop and AVL-based next stop
-                # calculate the difference based on the departure times
-                # TODO: implement a better delay prediciton here ... this is quite... basic
-                current_timestamp: int = int(datetime.now(timezone.utc).timestamp())
-                actual_next_stop_time: StopTime|None = next((s for s in self._stop_times if s.stop_sequence == trip_metrics.next_stop_sequence), None)
-                nominal_next_stop_time: StopTime|None = next((s for s in self._stop_times if s.stop_sequence == self.time_based_next_stop_sequence), None)
-                
-                if actual_next_stop_time is not None:
-                    trip_metrics.current_delay = current_timestamp - actual_next_stop_time.departure_timestamp
-                    
-                break
+        # the next stop is the first stop which is projected on or beyond the current position
+        c: int = bisect_left(self._stop_time_index.stop_projection_maxima, position_projection)
+        if c < len(self._stop_time_index.stop_sequences):
+            stop_sequence: int = self._stop_time_index.stop_sequences[c]
+            stop_projection: float = self._stop_time_index.stop_projections[c]
+
+            # calculate distance to the next stop and predict stop status
+            distance: float = stop_projection - position_projection
+            if abs(distance) < 30:
+                trip_metrics.current_stop_status = 'STOPPED_AT'
+
+                if stop_sequence == self._stop_time_index.last_stop_sequence:
+                    trip_metrics.current_stop_is_final = True
+
+            elif distance < 60:
+                trip_metrics.current_stop_status = 'INCOMING_AT'
+
+                if stop_sequence == self._stop_time_index.last_stop_sequence:
+                    trip_metrics.current_stop_is_final = True
+
+            # set current and next stop sequence and ID
+            if stop_sequence > 0:
+                trip_metrics.current_stop_sequence = stop_sequence - 1
+                trip_metrics.current_stop_id = self._stop_times[stop_sequence - 1].stop.stop_id
+            
+            trip_metrics.next_stop_sequence = stop_sequence
+            trip_metrics.next_stop_id = self._stop_times[stop_sequence].stop.stop_id
+
+            # monitor delay between nominal next stop and AVL-based next stop
+            # calculate the difference based on the departure times
+            # TODO: implement a better delay prediciton here ... this is quite... basic
+            current_timestamp: int = int(datetime.now(timezone.utc).timestamp())
+            actual_next_stop_time: StopTime|None = self._stop_time_index.stop_times_by_stop_sequence.get(trip_metrics.next_stop_sequence, None)
+            
+            if actual_next_stop_time is not None:
+                trip_metrics.current_delay = current_timestamp - actual_next_stop_time.departure_timestamp
 
         return trip_metrics
@@ -0,0 +1,61 @@
+import numpy as np
+import os
+import polyline
+import shapely
+
+from shapely.geometry import LineString, Polygon
+
+from avl2gtfsrt.avl.spatialmatch import SpatialMatch
+from avl2gtfsrt.avl.temporalmatch import StopTimeIndex
+from avl2gtfsrt.common.cache import LruCache
+from avl2gtfsrt.common.shared import web_mercator, web_mercator_coords
+from avl2gtfsrt.model.types import Trip
+
+
+class TripShape:
+
+    def __init__(self, trip: Trip) -> None:
+
+        # generate LineString in web-mercator projection for spatial and temporal matching
+        self.line: LineString = LineString([c[::-1] for c in polyline.decode(trip.shape_polyline)])
+        self.line = web_mercator(self.line)
+
+        self.length: float = self.line.length
+        self.coords: np.ndarray = shapely.get_coordinates(self.line)
+
+        # add buffer around trip shape to allow for some tolerance in matching
+        # the buffer is prepared for fast repeated spatial predicates
+        self.buffered_line: Polygon = self.line.buffer(SpatialMatch.TRIP_SHAPE_BUFFER_SIZE)
+        shapely.prepare(self.buffered_line)
+
+        # project all stops onto the trip shape once
+        stop_x, stop_y = web_mercator_coords([s.stop.longitude for s in trip.stop_times], [s.stop.latitude for s in trip.stop_times])
+        stop_projections: np.ndarray = shapely.line_locate_point(self.line, shapely.points(stop_x, stop_y))
+
+        self.stop_projections: dict[int, float] = {s.stop_sequence: float(p) for s, p in zip(trip.stop_times, stop_projections)}
+
+        # index stop times and stop projections once for all temporal matchings
+        self.stop_time_index: StopTimeIndex = StopTimeIndex(trip.stop_times, self.stop_projections)
+
+
+def get_trip_version_key(trip: Trip) -> tuple:
+    # prepared trip shapes contain the stop projections and the absolute stop times of the trip
+    # so the version contains the stop times as well as the shape, changed nominal data are never mixed up
+    stop_times_hash: int = hash(tuple((s.stop_sequence, s.stop.stop_id, s.arrival_timestamp, s.departure_timestamp) for s in trip.stop_times))
+
+    return (trip.descriptor.trip_id, trip.descriptor.start_date, hash(trip.shape_polyline), stop_times_hash)
+
+
+# process-wide cache of prepared trip shapes, shared by all matching threads
+# the key contains the service date and the version of the trip, so changed nominal data are never mixed up
+_trip_shape_cache: LruCache = LruCache(int(os.getenv('A2G_MATCHING_SHAPE_CACHE_SIZE', '500')))
+
+def get_trip_shape(trip: Trip) -> TripShape:
+    cache_key: tuple = get_trip_version_key(trip)
+
+    trip_shape: TripShape|None = _trip_shape_cache.get(cache_key)
+    if trip_shape is None:
+        trip_shape = TripShape(trip)
+        _trip_shape_cache.put(cache_key, trip_shape)
+
+    return trip_shape
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LruCache:
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float|None = None) -> None:
+        self._max_entries: int = max(1, max_entries)
+        self._ttl_seconds: float|None = ttl_seconds if ttl_seconds is not None and ttl_seconds > 0 else None
+
+        # entries are stored as key -> (expiration, value) in access order
+        # the least recently used entry is always the first one
+        self._entries: OrderedDict = OrderedDict()
+        self._lock: Lock = Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key: object, default: object = None) -> object:
+        with self._lock:
+            entry: tuple|None = self._entries.get(key, None)
+            if entry is None:
+                self.misses = self.misses + 1
+                return default
+
+            expiration, value = entry
+            if expiration is not None and expiration <= monotonic():
+                del self._entries[key]
+
+                self.misses = self.misses + 1
+                return default
+
+            self._entries.move_to_end(key)
+
+            self.hits = self.hits + 1
+            return value
+
+    def put(self, key: object, value: object) -> None:
+        expiration: float|None = monotonic() + self._ttl_seconds if self._ttl_seconds is not None else None
+
+        with self._lock:
+            self._entries[key] = (expiration, value)
+            self._entries.move_to_end(key)
+
+            # evict least recently used entries if the cache exceeds its size
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def remove(self, key: object) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def hit_ratio(self) -> float:
+        with self._lock:
+            total: int = self.hits + self.misses
+            return self.hits / total if total > 0 else 0.0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
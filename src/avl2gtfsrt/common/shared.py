@@ -1,9 +1,17 @@
+import numpy as np
+import shapely
 import uuid
 
 from datetime import datetime, timezone
-from shapely.ops import transform
+from functools import lru_cache
 from pyproj import CRS, Transformer
 
+from avl2gtfsrt.common.env import is_set
+
+EARTH_RADIUS_WEB_MERCATOR: float = 6378137.0
+
+_fast_projection_enabled: bool = is_set('A2G_FAST_PROJECTION_ENABLED')
+
 def isotimestamp() -> str:
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
@@ -19,23 +27,49 @@ def uid() -> str:
     return str(uuid.uuid4())
 
 def web_mercator(geometry: object) -> object:
-    transformer = Transformer.from_crs(
-        CRS("EPSG:4326"),
-        CRS("EPSG:3857"),
-        always_xy=True
-    )
-
-    return transform(transformer.transform, geometry)
+    return shapely.transform(geometry, lambda c: np.column_stack(web_mercator_coords(c[:, 0], c[:, 1])))
 
 def wgs_84(geometry: object) -> object:
-    transformer = Transformer.from_crs(
-        CRS("EPSG:3857"),
-        CRS("EPSG:4326"),
+    return shapely.transform(geometry, lambda c: np.column_stack(wgs_84_coords(c[:, 0], c[:, 1])))
+
+def web_mercator_coords(longitudes: np.ndarray|list, latitudes: np.ndarray|list) -> tuple[np.ndarray, np.ndarray]:
+    longitudes = np.asarray(longitudes, dtype=float)
+    latitudes = np.asarray(latitudes, dtype=float)
+
+    # EPSG:3857 is defined on a sphere, so the closed form is equivalent
+    # to the transformation of pyproj but does not need to call into PROJ at all
+    if _fast_projection_enabled:
+        x: np.ndarray = EARTH_RADIUS_WEB_MERCATOR * np.radians(longitudes)
+        y: np.ndarray = EARTH_RADIUS_WEB_MERCATOR * np.log(np.tan(np.pi / 4.0 + np.radians(latitudes) / 2.0))
+
+        return (x, y)
+
+    x, y = _get_transformer('EPSG:4326', 'EPSG:3857').transform(longitudes, latitudes)
+    return (np.asarray(x), np.asarray(y))
+
+def wgs_84_coords(x: np.ndarray|list, y: np.ndarray|list) -> tuple[np.ndarray, np.ndarray]:
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    if _fast_projection_enabled:
+        longitudes: np.ndarray = np.degrees(x / EARTH_RADIUS_WEB_MERCATOR)
+        latitudes: np.ndarray = np.degrees(2.0 * np.arctan(np.exp(y / EARTH_RADIUS_WEB_MERCATOR)) - np.pi / 2.0)
+
+        return (longitudes, latitudes)
+
+    longitudes, latitudes = _get_transformer('EPSG:3857', 'EPSG:4326').transform(x, y)
+    return (np.asarray(longitudes), np.asarray(latitudes))
+
+@lru_cache(maxsize=None)
+def _get_transformer(source_crs: str, target_crs: str) -> Transformer:
+    # creating a transformer takes some milliseconds, so create each transformer only once
+    # transformers are thread-safe since pyproj 3.1
+    return Transformer.from_crs(
+        CRS(source_crs),
+        CRS(target_crs),
         always_xy=True
     )
 
-    return transform(transformer.transform, geometry)
-
 def clamp(value: float|int, min_value: float|int, max_value: float|int) -> float|int:
     return max(min_value, min(max_value, value))
 
@@ -1,4 +1,9 @@
 import math
+import numpy as np
+
+# number of probabilities kept per trip candidate
+# convergence is tested with the last three probabilities only
+PROBABILITY_HISTORY_LENGTH: int = 3
 
 def softmax(scores: list):
     if len(scores) == 0:
@@ -11,62 +16,62 @@ def softmax(scores: list):
     return [e / sum_exp for e in exp_scores]
 
 def bayesian_update(prior_vectors: dict, likelihood: dict, normalized: bool = False, alpha: float = 1.0) -> tuple[bool, dict]:
-    
+
     # normalize all values for likelihood using softmax activation
     if not normalized:
-        likelihood_values: list = list(likelihood.values())
-        likelihood_values = softmax(likelihood_values)
+        likelihood = dict(zip(likelihood.keys(), softmax(list(likelihood.values()))))
 
-        for i, (k, _) in enumerate(likelihood.items()):
-            likelihood[k] = likelihood_values[i]
-    
-    # remove keys from prior if the are not considered as 
-    # trip candidates in the current update anymore
-    # also add new candidates to prior if they are in likelihood
-    prior_vectors = {k: v for k, v in prior_vectors.items() if k in likelihood}
+    # ensure that prior and likelihood are sorted both by their key
+    # keys of the prior which are not considered as trip candidates in the current update anymore are removed
+    keys: list[str] = sorted(likelihood.keys())
+    likelihood_values: np.ndarray = np.array([likelihood[k] for k in keys], dtype=np.float64)
 
-    for k, v in likelihood.items():
-        if k not in prior_vectors:
-            prior_vectors[k] = [v]
+    # load the last probabilities of each trip candidate into a fixed-size matrix, missing values are NaN
+    # new candidates from the likelihood are added with their likelihood as prior
+    history: np.ndarray = np.full((len(keys), PROBABILITY_HISTORY_LENGTH), np.nan)
+    for i, k in enumerate(keys):
+        prior_vector: list[float] = prior_vectors.get(k, None) or [likelihood[k]]
+        prior_vector = prior_vector[-PROBABILITY_HISTORY_LENGTH:]
 
-    # ensure that prior and likelihood are sorted both by their key 
-    prior_vectors = dict(sorted(prior_vectors.items()))
-    likelihood = dict(sorted(likelihood.items()))
-
-    # extract all values
-    likelihood_values: list = list(likelihood.values())
-    prior_vectors_values: list = list(prior_vectors.values())
+        history[i, PROBABILITY_HISTORY_LENGTH - len(prior_vector):] = prior_vector
 
     # calulate update according to the bayesian rule
-    unnormalized_posterior: list = [
-        p[-1] * (l ** alpha) for p, l in zip(prior_vectors_values, likelihood_values)
-    ]
+    unnormalized_posterior: np.ndarray = history[:, -1] * (likelihood_values ** alpha)
 
-    total_posterior: float = sum(unnormalized_posterior)
+    # sum up sequentially like the former implementation for identical results
+    total_posterior: float = float(np.cumsum(unnormalized_posterior)[-1]) if len(keys) > 0 else 0.0
 
-    # normalize posterior and re-create dict
+    # normalize posterior
     if total_posterior == 0.0:
-        posterior: list = [0.0 for _ in unnormalized_posterior]
+        posterior: np.ndarray = np.zeros(len(keys))
     else:
-        posterior: list = [u / total_posterior for u in unnormalized_posterior]
+        posterior: np.ndarray = unnormalized_posterior / total_posterior
+
+    # append posterior to the history, the oldest probabilities are dropped
+    history = np.roll(history, -1, axis=1)
+    history[:, -1] = posterior
 
-    posterior_vectors: dict = prior_vectors
-    for i, (k, _) in enumerate(prior_vectors.items()):
-        posterior_vectors[k].append(posterior[i])
+    posterior_vectors: dict = {k: [float(v) for v in history[i] if not math.isnan(v)] for i, k in enumerate(keys)}
 
     # check best candidate for convergence
-    convergence: bool = False
+    if len(keys) == 0:
+        return (False, posterior_vectors)
+
+    convergence_key: str = keys[int(np.argmax(history[:, -1]))]
+    convergence: bool = is_converged(posterior_vectors[convergence_key])
 
-    convergence_key: str = max(posterior_vectors, key=lambda k: posterior_vectors[k][-1])
-    convergence_vector: list[float] = posterior_vectors[convergence_key]
-    convergence_test: float = convergence_vector[-1]
+    return (convergence, posterior_vectors)
+
+def is_converged(probability_vector: list[float]) -> bool:
+    convergence: bool = False
+    convergence_test: float = probability_vector[-1]
 
     if convergence_test > 0.98:
         convergence = True
     elif convergence_test > 0.50:
-        convergence_vector = convergence_vector[-3:]
+        convergence_vector: list[float] = probability_vector[-PROBABILITY_HISTORY_LENGTH:]
 
         deltas: list[float] = [abs(b - a) for a, b in zip(convergence_vector, convergence_vector[1:])]
-        convergence = all(delta < 0.02 for delta in deltas)
+        convergence = len(deltas) > 0 and all(delta < 0.02 for delta in deltas)
 
-    return (convergence, posterior_vectors)
\ No newline at end of file
+    return convergence
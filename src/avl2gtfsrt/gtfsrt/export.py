@@ -20,7 +20,12 @@ class GtfsRealtimeExport():
     def _extract_vehicle_positions(self, vehicle_id: str|None = None) -> list[dict]:
         entities: list[dict] = list()
         
-        vehicles: list[Vehicle] = self._object_storage.get_vehicles()
+        # load only vehicles which are considered with their latest GNSS position
+        if vehicle_id is not None:
+            vehicles: list[Vehicle] = self._object_storage.get_vehicles(vehicle_ref=vehicle_id, latest_gnss_position_only=True)
+        else:
+            vehicles: list[Vehicle] = self._object_storage.get_vehicles(is_technically_logged_on=True, latest_gnss_position_only=True)
+
         for vehicle in vehicles:
             # assume we want a differential export
             # bring up only vehicles matching the vehicle ID
@@ -82,7 +87,15 @@ class GtfsRealtimeExport():
     def _extract_trip_updates(self, vehicle_id: str|None = None) -> list[dict]:
         entities: list[dict] = list()
         
-        vehicles: list[Vehicle] = self._object_storage.get_vehicles()
+        # load only vehicles which are considered with their latest GNSS position
+        if vehicle_id is not None:
+            vehicles: list[Vehicle] = self._object_storage.get_vehicles(vehicle_ref=vehicle_id, latest_gnss_position_only=True)
+        else:
+            vehicles: list[Vehicle] = self._object_storage.get_vehicles(is_technically_logged_on=True, is_operationally_logged_on=True, latest_gnss_position_only=True)
+
+        # load the trips of all vehicles with one single query
+        trips: dict[str, Trip] = self._object_storage.get_trips_by_ids([v.activity.trip_descriptor.trip_id for v in vehicles if v.activity is not None and v.activity.trip_descriptor is not None])
+
         for vehicle in vehicles:
 
             # assume we want a differential export
@@ -98,7 +111,7 @@ class GtfsRealtimeExport():
             if vehicle.activity is None or vehicle.activity.trip_descriptor is None:
                 continue
 
-            trip: Trip = self._object_storage.get_trip(vehicle.activity.trip_descriptor.trip_id)
+            trip: Trip|None = trips.get(vehicle.activity.trip_descriptor.trip_id, None)
             vehicle_position: GnssPosition = vehicle.activity.gnss_positions[-1] if vehicle.activity is not None and vehicle.activity.gnss_positions is not None and len(vehicle.activity.gnss_positions) > 0 else None
 
             if trip is not None:
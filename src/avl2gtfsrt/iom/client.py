@@ -25,6 +25,8 @@ class IomRole:
     
 class IomClient:
 
+    NUM_VEHICLE_HANDLER_LOCKS: int = 1024
+
     def __init__(self, config: dict, iom_role: IomRole, thread_executor: ThreadPoolExecutor) -> None:
         self.instance_id: str = config['instance_id']
         self.organisation_id = config['organisation_id']
@@ -43,6 +45,15 @@ class IomClient:
         self._vehicle_queues: dict[str, Queue] = dict()
         self._lock = Lock()
 
+        # all handlers of a vehicle run under its handler lock, whether they run on the MQTT thread or the executor
+        # so handlers never modify the same vehicle at once, e.g. a log off while a GNSS update is processed
+        # locks are striped over a fixed number of locks, as a lock cannot be removed safely while a handler may still wait for it
+        self._vehicle_handler_locks: list[Lock] = [Lock() for _ in range(0, self.NUM_VEHICLE_HANDLER_LOCKS)]
+
+        # number of messages submitted to and finished by the executor
+        self._num_submitted_tasks: int = 0
+        self._num_finished_tasks: int = 0
+
         # correlation ID and latch for running requests via MQTT
         self._correlation_id: str|None = None
         self._correlation_result: str|None = None
@@ -128,6 +139,19 @@ class IomClient:
         else:
             self._handle_message(topic, payload)
 
+    def get_queue_stats(self) -> tuple[int, int]:
+        with self._lock:
+            num_vehicles: int = len(self._vehicle_queues)
+            num_queued_messages: int = sum(q.qsize() for q in self._vehicle_queues.values())
+
+        return (num_vehicles, num_queued_messages)
+
+    def get_executor_stats(self) -> int:
+        with self._lock:
+            num_pending_tasks: int = self._num_submitted_tasks - self._num_finished_tasks
+
+        return num_pending_tasks
+
     def terminate(self) -> None:
         logging.info(f"{self.instance_id}/{self.__class__.__name__}: Shutting down MQTT connection ...")
         self._mqtt.disconnect()
@@ -259,10 +283,11 @@ class IomClient:
         # handle request
         if isinstance(msg, TechnicalVehicleLogOnRequestStructure):
             if self.on_technical_vehicle_log_on is not None:
-                response: AbstractBasicStructure = self.on_technical_vehicle_log_on(msg)
-
                 vehicle_ref: str = msg.vehicle_ref.value
 
+                with self._get_vehicle_handler_lock(vehicle_ref):
+                    response: AbstractBasicStructure = self.on_technical_vehicle_log_on(msg)
+
                 with self._lock:
                     # register vehicle or reset all monitoring lists  
                     if vehicle_ref not in self._vehicle_locks:
@@ -283,10 +308,11 @@ class IomClient:
 
         elif isinstance(msg, TechnicalVehicleLogOffRequestStructure):
             if self.on_technical_vehicle_log_off is not None:
-                response: AbstractBasicStructure = self.on_technical_vehicle_log_off(msg)
-
                 vehicle_ref: str = msg.vehicle_ref.value
 
+                with self._get_vehicle_handler_lock(vehicle_ref):
+                    response: AbstractBasicStructure = self.on_technical_vehicle_log_off(msg)
+
                 with self._lock:
                     # reset all monitoring lists
                     if vehicle_ref in self._vehicle_locks:
@@ -340,6 +366,7 @@ class IomClient:
             if not self._vehicle_locks[vehicle_ref]:
                 # mark vehicle as locked and put the action into the executor
                 self._vehicle_locks[vehicle_ref] = True
+                self._num_submitted_tasks = self._num_submitted_tasks + 1
                 self._executor.submit(
                     self._handle_message_on_executor,
                     vehicle_ref,
@@ -366,7 +393,8 @@ class IomClient:
             # handle incoming GnssPhysicalPositionData update
             if isinstance(msg, GnssPhysicalPositionDataStructure):
                 if self.on_gnss_position_update is not None:
-                    self.on_gnss_position_update(topic, msg)
+                    with self._get_vehicle_handler_lock(vehicle_ref):
+                        self.on_gnss_position_update(topic, msg)
                 else:
                     logging.warning(f"{self.instance_id}/{self.__class__.__name__}: No handler defined for GnssPhysicalPositionDataStructure messages. Message will be ignored.")
 
@@ -376,6 +404,7 @@ class IomClient:
                 # if so, process them too; else remove the lock from the vehicle
                 if not self._vehicle_queues[vehicle_ref].empty():
                     next_message: tuple = self._vehicle_queues[vehicle_ref].get()
+                    self._num_submitted_tasks = self._num_submitted_tasks + 1
                     self._executor.submit(
                         self._handle_message_on_executor,
                         *next_message
@@ -394,6 +423,14 @@ class IomClient:
             with self._lock:
                 self._vehicle_locks[vehicle_ref] = False
 
+        finally:
+            with self._lock:
+                self._num_finished_tasks = self._num_finished_tasks + 1
+
+    def _get_vehicle_handler_lock(self, vehicle_ref: str) -> Lock:
+        # vehicles sharing a lock are processed one after another, handlers never hold more than one lock
+        return self._vehicle_handler_locks[hash(vehicle_ref) % len(self._vehicle_handler_locks)]
+
     def _get_tls(self, tls_name: str) -> tuple[str, int]:
         if not tls_name.startswith('_tls_'):
             tls_name = f"_tls_{tls_name}"
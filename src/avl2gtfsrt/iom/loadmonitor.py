@@ -0,0 +1,70 @@
+import logging
+
+from threading import Lock
+
+from avl2gtfsrt.common.cache import LruCache
+from avl2gtfsrt.iom.client import IomClient
+
+
+class LoadMonitor:
+
+    LATENCY_SMOOTHING_FACTOR: float = 0.2
+
+    def __init__(self, iom_client: IomClient, num_threads: int, base_interval_seconds: int = 5, max_interval_seconds: int = 30, target_latency_ms: int = 500) -> None:
+        self._iom = iom_client
+        self._num_threads: int = max(1, num_threads)
+
+        self._base_interval_seconds: int = max(1, base_interval_seconds)
+        self._max_interval_seconds: int = max(self._base_interval_seconds, max_interval_seconds)
+        self._target_latency_seconds: float = max(1, target_latency_ms) / 1000.0
+
+        # exponentially weighted moving average of the processing latency of GNSS updates
+        self._latency_seconds: float = 0.0
+        self._latency_lock: Lock = Lock()
+
+        # GNSS timestamp of the last matching per vehicle
+        self._last_matching_timestamps: LruCache = LruCache(10000)
+
+    def record_latency(self, latency_seconds: float) -> None:
+        with self._latency_lock:
+            self._latency_seconds = self._latency_seconds + self.LATENCY_SMOOTHING_FACTOR * (latency_seconds - self._latency_seconds)
+
+    def get_load(self) -> float:
+
+        # load is the highest of executor queue depth per thread, queued messages per vehicle
+        # and the processing latency compared to the target latency, a value above 1.0 means overload
+        # tasks which are not running on one of the threads are waiting in the executor queue
+        num_pending_tasks: int = self._iom.get_executor_stats()
+        executor_load: float = max(0, num_pending_tasks - self._num_threads) / self._num_threads
+
+        num_vehicles, num_queued_messages = self._iom.get_queue_stats()
+        queue_load: float = num_queued_messages / max(1, num_vehicles)
+
+        latency_load: float = self._latency_seconds / self._target_latency_seconds
+
+        return max(executor_load, queue_load, latency_load)
+
+    def get_matching_interval(self) -> int:
+        load: float = self.get_load()
+        if load <= 1.0:
+            return 0
+
+        return min(self._max_interval_seconds, int(self._base_interval_seconds * load))
+
+    def is_matching_required(self, vehicle_ref: str, timestamp: int, is_operationally_logged_on: bool) -> bool:
+
+        # vehicles which are not operationally logged on are still searching for their trip and always matched at full rate
+        if not is_operationally_logged_on:
+            return True
+
+        # vehicles which are operationally logged on to their trip already are verified less often under load
+        matching_interval: int = self.get_matching_interval()
+
+        last_matching_timestamp: int|None = self._last_matching_timestamps.get(vehicle_ref)
+        if last_matching_timestamp is not None and 0 <= timestamp - last_matching_timestamp < matching_interval:
+            logging.debug(f"{self.__class__.__name__}: Skipping matching for vehicle {vehicle_ref} due to load, matching interval is {matching_interval}s.")
+            return False
+
+        self._last_matching_timestamps.put(vehicle_ref, timestamp)
+
+        return True
@@ -36,7 +36,7 @@ class TechnicalVehicleLogOnHandler(AbstractRequestResponseHandler):
             vehicle.cache = VehicleCache()
 
             self._storage.update_vehicle(vehicle)
-            self._event_stream.publish(EventMessage(EventMessage.TECHNICAL_VEHICLE_LOG_ON, vehicle_ref))
+            self._storage.publish_when_stored(self._event_stream.publish, EventMessage(EventMessage.TECHNICAL_VEHICLE_LOG_ON, vehicle_ref))
 
             response: TechnicalVehicleLogOnResponseStructure = TechnicalVehicleLogOnResponseStructure()
             response.technical_vehicle_log_on_response_data = TechnicalVehicleLogOnResponseDataStructure()
@@ -89,7 +89,7 @@ class TechnicalVehicleLogOffHandler(AbstractRequestResponseHandler):
             vehicle.is_differential_deleted = True
 
             self._storage.update_vehicle(vehicle)
-            self._event_stream.publish(EventMessage(EventMessage.TECHNICAL_VEHICLE_LOG_OFF, vehicle_ref))
+            self._storage.publish_when_stored(self._event_stream.publish, EventMessage(EventMessage.TECHNICAL_VEHICLE_LOG_OFF, vehicle_ref))
 
             response: TechnicalVehicleLogOffResponseStructure = TechnicalVehicleLogOffResponseStructure()
             response.technical_vehicle_log_off_response_data = TechnicalVehicleLogOffResponseDataStructure()
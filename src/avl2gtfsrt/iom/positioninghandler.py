@@ -1,16 +1,18 @@
-import json
 import logging
 import os
 
+from dataclasses import replace
 from datetime import datetime
 from typing import cast
 
 from avl2gtfsrt.avl.avlmatcher import AvlMatcher
-from avl2gtfsrt.avl.spatialvector import SpatialVectorCollection
+from avl2gtfsrt.avl.matchingengine import MatchingEngine
+from avl2gtfsrt.avl.spatialvector import SpatialVector, SpatialVectorCollection
 from avl2gtfsrt.common.env import is_set
 from avl2gtfsrt.common.mqtt import get_tls_value
 from avl2gtfsrt.common.shared import unixtimestamp
 from avl2gtfsrt.iom.basehandler import AbstractHandler
+from avl2gtfsrt.iom.loadmonitor import LoadMonitor
 from avl2gtfsrt.model.types import Trip, GnssPosition, Vehicle, TripMetrics
 from avl2gtfsrt.nominal.dataclient import NominalDataClient
 from avl2gtfsrt.vdv.vdv435 import AbstractBasicStructure
@@ -22,10 +24,13 @@ from avl2gtfsrt.events.eventmessage import EventMessage
 
 class GnssPhysicalPositionHandler(AbstractHandler):
 
-    def __init__(self, object_storage: ObjectStorage, event_stream: EventPublisher) -> None:
+    def __init__(self, object_storage: ObjectStorage, event_stream: EventPublisher, nominal_data_client: NominalDataClient, matching_engine: MatchingEngine, load_monitor: LoadMonitor|None = None) -> None:
         super().__init__(object_storage)
 
         self._event_stream = event_stream
+        self._nominal_data_client = nominal_data_client
+        self._matching_engine = matching_engine
+        self._load_monitor = load_monitor
 
     def handle(self, topic: str, msg: AbstractBasicStructure) -> None:
         msg = cast(GnssPhysicalPositionDataStructure, msg)
@@ -50,12 +55,24 @@ class GnssPhysicalPositionHandler(AbstractHandler):
 
             return
 
-        # update vehicle activity data
-        vehicle.activity.gnss_positions.append(GnssPosition(
+        gnss_position: GnssPosition = GnssPosition(
             timestamp=timestamp,
             latitude=latitude,
             longitude=longitude
-        ))
+        )
+
+        # skip duplicate and stationary positions, e.g. of vehicles waiting at a terminus
+        # there's no matching, no storage write and no event for them, except a periodic heartbeat
+        # the last position of the activity may be filtered to the trip shape, so compare with the last raw position
+        if is_set('A2G_STATIONARY_FILTER_ENABLED') and vehicle.cache is not None:
+            if vehicle.cache.last_raw_gnss_position is not None and self._is_skippable(vehicle.cache.last_raw_gnss_position, gnss_position):
+                logging.debug(f"{self.__class__.__name__}: Skipped duplicate or stationary GNSS data update for vehicle {vehicle_ref}.")
+                return
+
+            vehicle.cache.last_raw_gnss_position = gnss_position
+
+        # update vehicle activity data
+        vehicle.activity.gnss_positions.append(gnss_position)
 
         # run all other processing steps
         
@@ -78,6 +95,10 @@ class GnssPhysicalPositionHandler(AbstractHandler):
                         break
             else:
                 matching_enabled: bool = True
+
+            # under load, vehicles which are operationally logged on already are matched less often
+            if matching_enabled and self._load_monitor is not None:
+                matching_enabled = self._load_monitor.is_matching_required(vehicle_ref, timestamp, vehicle.is_operationally_logged_on)
             
             # run matching here ...
             gnss_vector: SpatialVectorCollection = SpatialVectorCollection(vehicle.activity.gnss_positions)
@@ -90,32 +111,19 @@ class GnssPhysicalPositionHandler(AbstractHandler):
                 if not vehicle.is_operationally_logged_on:
                     logging.debug(f"{self.__class__.__name__} Vehicle {vehicle_ref} is not operationally logged on. Loading nominal trip candidates ...")
 
-                    # load configured adapter and fetch trip candidates ...
-                    adapter_type: str = os.getenv('A2G_NOMINAL_ADAPTER_TYPE', 'otp')
-                    adapter_config: str = os.getenv('A2G_NOMINAL_ADAPTER_CONFIG', None)
-
-                    if adapter_type not in ['otp']:
-                        raise RuntimeError(f"Invalid nominal adapter type {adapter_type}. Please configure a valid adapter type.")
-
-                    if adapter_config is None:
-                        raise RuntimeError('Nominal adapter configuration is not set. Please set a valid adapter configuration.')
-                    
-                    client: NominalDataClient = NominalDataClient(
-                        adapter_type,
-                        json.loads(adapter_config)
-                    )
-
-                    trip_candidates: list[Trip]|None = client.get_trip_candidates(latitude, longitude)
+                    # fetch trip candidates using the nominal data client of the worker ...
+                    trip_candidates: list[Trip]|None = self._nominal_data_client.get_trip_candidates(latitude, longitude)
 
                     # if trip candidates could not be loaded or list was empty, try to use cached trip candidates
                     if trip_candidates is None or len(trip_candidates) == 0:
-                        trip_candidates = vehicle.cache.trip_candidates
+                        trip_candidates = self._storage.get_trip_candidates(vehicle.cache.trip_candidate_refs)
 
                     # rund AVL matcher
                     matcher: AvlMatcher = AvlMatcher(
                         self._storage,
                         trip_candidates,
-                        False
+                        False,
+                        matching_engine=self._matching_engine
                     )
                     
                     result: tuple[bool, dict] = matcher.match(
@@ -131,11 +139,11 @@ class GnssPhysicalPositionHandler(AbstractHandler):
                     vehicle.activity.trip_candidate_convergence = trip_candidate_convergence
                     vehicle.activity.trip_candidate_probabilities = trip_candidate_probabilities
 
-                    # save considered trip candidates to vehicle cache
-                    vehicle.cache.trip_candidates = list()
-                    for trip_candidate in trip_candidates:
-                        if trip_candidate.descriptor.trip_id in trip_candidate_probabilities:
-                            vehicle.cache.trip_candidates.append(trip_candidate)
+                    # save considered trip candidates once for all vehicles and their references to vehicle cache
+                    considered_trip_candidates: list[Trip] = [t for t in trip_candidates if t.descriptor.trip_id in trip_candidate_probabilities]
+                    self._storage.update_trip_candidates(considered_trip_candidates)
+
+                    vehicle.cache.trip_candidate_refs = [t.descriptor for t in considered_trip_candidates]
 
                     # finally update all vehicle data
                     self._storage.update_vehicle(vehicle)
@@ -143,7 +151,7 @@ class GnssPhysicalPositionHandler(AbstractHandler):
                     # return result
                     # (bool, (bool, object)) <--- (Success/Failure of the Handler, (TripConvergence, TripObject))
                     if trip_candidate_convergence:
-                        trip_candidate_id: str = max(trip_candidate_probabilities, key=trip_candidate_probabilities.get)
+                        trip_candidate_id: str = max(trip_candidate_probabilities, key=lambda k: trip_candidate_probabilities[k][-1])
                         trip_candidate: Trip|None = next((t for t in trip_candidates if t.descriptor.trip_id == trip_candidate_id), None)
 
                         if not vehicle.is_operationally_logged_on:
@@ -163,12 +171,11 @@ class GnssPhysicalPositionHandler(AbstractHandler):
                             vehicle.activity.trip_metrics = trip_metrics[trip_candidate_id]
 
                             # finally update vehicle data
-                            trip_candidate.is_differential_deleted = False
-
+                            # trip candidates may be shared with other vehicles by the nominal data cache, so the trip is copied
                             self._storage.update_vehicle(vehicle)
-                            self._storage.update_trip(trip_candidate)
+                            self._storage.update_trip(replace(trip_candidate, is_differential_deleted=False))
 
-                            self._event_stream.publish(EventMessage(EventMessage.OPERATIONAL_VEHICLE_LOG_ON, vehicle_ref))
+                            self._storage.publish_when_stored(self._event_stream.publish, EventMessage(EventMessage.OPERATIONAL_VEHICLE_LOG_ON, vehicle_ref))
                             
                 else:
                     logging.debug(f"{self.__class__.__name__} Vehicle {vehicle_ref} is operationally logged on. Verifying current trip ...")
@@ -180,7 +187,8 @@ class GnssPhysicalPositionHandler(AbstractHandler):
                         self._storage,
                         [current_trip],
                         is_set('A2G_SHAPE_FILTER_ENABLED'),
-                        int(os.getenv('A2G_SHAPE_FILTER_DISTANCE_METERS', '50'))
+                        int(os.getenv('A2G_SHAPE_FILTER_DISTANCE_METERS', '50')),
+                        matching_engine=self._matching_engine
                     )
 
                     trip_matches: bool = matcher.test(
@@ -231,7 +239,7 @@ class GnssPhysicalPositionHandler(AbstractHandler):
                             self._storage.update_vehicle(vehicle)
                             self._storage.update_trip(current_trip)
 
-                            self._event_stream.publish(EventMessage(EventMessage.OPERATIONAL_VEHICLE_LOG_OFF, vehicle_ref))
+                            self._storage.publish_when_stored(self._event_stream.publish, EventMessage(EventMessage.OPERATIONAL_VEHICLE_LOG_OFF, vehicle_ref))
 
                     # if there're too many failures, perform a log off and delete trip descriptor
                     max_failures: int = int(os.getenv('A2G_MATCHING_MAX_FAILURES', '5'))
@@ -251,9 +259,24 @@ class GnssPhysicalPositionHandler(AbstractHandler):
                             self._storage.update_vehicle(vehicle)
                             self._storage.update_trip(current_trip)
 
-                            self._event_stream.publish(EventMessage(EventMessage.OPERATIONAL_VEHICLE_LOG_OFF, vehicle_ref))
+                            self._storage.publish_when_stored(self._event_stream.publish, EventMessage(EventMessage.OPERATIONAL_VEHICLE_LOG_OFF, vehicle_ref))
 
         # save update vehicle data and 
         logging.info(f"{self.__class__.__name__}: Processed GNSS data update for vehicle {vehicle_ref} successfully.")
         self._storage.update_vehicle(vehicle)
-        self._event_stream.publish(EventMessage(EventMessage.GNSS_PHYSICAL_POSITION_UPDATE, vehicle_ref))
\ No newline at end of file
+        self._storage.publish_when_stored(self._event_stream.publish, EventMessage(EventMessage.GNSS_PHYSICAL_POSITION_UPDATE, vehicle_ref))
+
+    def _is_skippable(self, last_gnss_position: GnssPosition, gnss_position: GnssPosition) -> bool:
+
+        # duplicate or outdated positions do not contain any new information
+        if gnss_position.timestamp <= last_gnss_position.timestamp:
+            return True
+        
+        # stationary positions are skipped until the heartbeat interval has elapsed
+        stationary_distance_meters: int = int(os.getenv('A2G_STATIONARY_DISTANCE_METERS', '10'))
+        stationary_heartbeat_seconds: int = int(os.getenv('A2G_STATIONARY_HEARTBEAT_SECONDS', '60'))
+
+        if gnss_position.timestamp - last_gnss_position.timestamp >= stationary_heartbeat_seconds:
+            return False
+
+        return SpatialVector(last_gnss_position, gnss_position).length() < stationary_distance_meters
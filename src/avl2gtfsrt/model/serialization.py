@@ -1,8 +1,112 @@
-from dataclasses import asdict
-from dacite import from_dict
+import types as pytypes
+import typing
+
+from dataclasses import MISSING, asdict, fields, is_dataclass
+
+from avl2gtfsrt.model import types
+
+# converters of all model types, which are generated once at import
+# each converter is a plain function accessing the fields directly, without any reflection at runtime
+_serializers: dict[type, typing.Callable] = dict()
+_deserializers: dict[type, typing.Callable] = dict()
 
 def serialize(obj):
-    return asdict(obj)
+    serializer: typing.Callable|None = _serializers.get(type(obj), None)
+    if serializer is None:
+        return asdict(obj)
+
+    return serializer(obj)
 
 def deserialize(cls, data):
-    return from_dict(cls, data)
\ No newline at end of file
+    return _deserializers[cls](data)
+
+def _copy(value):
+    # values of untyped fields, e.g. dicts, are copied like by dataclasses.asdict
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_copy(v) for v in value]
+
+    return value
+
+def _is_optional(field_type) -> bool:
+    return typing.get_origin(field_type) in [typing.Union, pytypes.UnionType] and type(None) in typing.get_args(field_type)
+
+def _create_expressions(field_type, depth: int = 0) -> tuple[str|None, str|None]:
+
+    # each expression contains a placeholder {} for the value to convert
+    # None means the value is taken as it is
+    if _is_optional(field_type):
+        inner_type = next(t for t in typing.get_args(field_type) if t is not type(None))
+        serialize_expression, deserialize_expression = _create_expressions(inner_type, depth)
+
+        return (
+            f"(None if {{0}} is None else {serialize_expression})" if serialize_expression is not None else None,
+            f"(None if {{0}} is None else {deserialize_expression})" if deserialize_expression is not None else None
+        )
+
+    if is_dataclass(field_type):
+        return (f"_serialize_{field_type.__name__}({{0}})", f"_deserialize_{field_type.__name__}({{0}})")
+
+    if typing.get_origin(field_type) is list:
+        item_type = typing.get_args(field_type)[0]
+        serialize_expression, deserialize_expression = _create_expressions(item_type, depth + 1)
+
+        item: str = f"item{depth}"
+        return (
+            f"[{serialize_expression.format(item)} for {item} in {{0}}]" if serialize_expression is not None else "list({0})",
+            f"[{deserialize_expression.format(item)} for {item} in {{0}}]" if deserialize_expression is not None else "list({0})"
+        )
+
+    if field_type in [str, int, float, bool]:
+        return (None, None)
+
+    return ("_copy({0})", "_copy({0})")
+
+def _create_codec(cls: type, namespace: dict) -> None:
+    type_hints: dict = typing.get_type_hints(cls, vars(types))
+
+    serialize_items: list[str] = list()
+    deserialize_arguments: list[str] = list()
+
+    for f in fields(cls):
+        serialize_expression, deserialize_expression = _create_expressions(type_hints[f.name])
+
+        value: str = f"obj.{f.name}"
+        serialize_items.append(f"'{f.name}': {serialize_expression.format(value) if serialize_expression is not None else value}")
+
+        # missing values are replaced by the defaults of the dataclass, unknown keys like _id are ignored
+        if f.default is not MISSING:
+            namespace[f"_default_{cls.__name__}_{f.name}"] = f.default
+            value = f"data.get('{f.name}', _default_{cls.__name__}_{f.name})"
+        elif f.default_factory is not MISSING:
+            namespace[f"_default_factory_{cls.__name__}_{f.name}"] = f.default_factory
+            value = f"(data['{f.name}'] if '{f.name}' in data else _default_factory_{cls.__name__}_{f.name}())"
+        else:
+            value = f"data['{f.name}']"
+
+        deserialize_arguments.append(f"{f.name}={deserialize_expression.format(value) if deserialize_expression is not None else value}")
+
+    source: str = '\n'.join([
+        f"def _serialize_{cls.__name__}(obj):",
+        f"    return {{{', '.join(serialize_items)}}}",
+        f"def _deserialize_{cls.__name__}(data):",
+        f"    return {cls.__name__}({', '.join(deserialize_arguments)})"
+    ])
+
+    exec(source, namespace)
+
+    _serializers[cls] = namespace[f"_serialize_{cls.__name__}"]
+    _deserializers[cls] = namespace[f"_deserialize_{cls.__name__}"]
+
+def _create_codecs() -> None:
+    model_types: list[type] = [t for t in vars(types).values() if isinstance(t, type) and is_dataclass(t) and t.__module__ == types.__name__]
+
+    # all converters share one namespace, so they can call each other
+    namespace: dict = {t.__name__: t for t in model_types}
+    namespace['_copy'] = _copy
+
+    for model_type in model_types:
+        _create_codec(model_type, namespace)
+
+_create_codecs()
@@ -2,7 +2,7 @@ from __future__ import annotations
 from dataclasses import dataclass, field
 from typing import Optional
 
-@dataclass
+@dataclass(slots=True)
 class GnssPosition:
     latitude: float
     longitude: float
@@ -28,7 +28,8 @@ class VehicleActivity:
 
 @dataclass
 class VehicleCache:
-    trip_candidates: list[Trip] = field(default_factory=list)
+    trip_candidate_refs: list[TripDescriptor] = field(default_factory=list)
+    last_raw_gnss_position: Optional[GnssPosition] = None
 
 @dataclass
 class Stop:
@@ -37,7 +38,7 @@ class Stop:
     longitude: float
     name: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class StopTime:
     arrival_timestamp: int 
     departure_timestamp: int
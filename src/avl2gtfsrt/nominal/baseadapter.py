@@ -7,4 +7,7 @@ class BaseAdapter(ABC):
 
     @abstractmethod
     def get_trip_candidates(self, latitude: float, longitude: float) -> list[Trip]:
-        pass
\ No newline at end of file
+        pass
+
+    def close(self) -> None:
+        pass
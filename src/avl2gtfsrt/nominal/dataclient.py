@@ -1,5 +1,9 @@
 import logging
+import math
 
+from time import time
+
+from avl2gtfsrt.common.cache import LruCache
 from avl2gtfsrt.common.env import is_debug
 from avl2gtfsrt.model.types import Trip
 from avl2gtfsrt.nominal.baseadapter import BaseAdapter
@@ -7,16 +11,42 @@ from avl2gtfsrt.nominal.baseadapter import BaseAdapter
 
 class NominalDataClient:
 
-    def __init__(self, adapter_type: str, adapter_config: dict):
+    def __init__(self, adapter_type: str, adapter_config: dict, caching_enabled: bool = False, caching_ttl_seconds: int = 60, caching_max_entries: int = 500, caching_grid_meters: int = 100):
         self._adapter_type = adapter_type
         self._adapter_config = adapter_config
 
+        # trip candidates are cached by a spatial grid cell and a time bucket
+        # vehicles near the same stops at the same time share the same candidates
+        # cached trips are the same objects for all vehicles, so they must not be modified by the callers
+        self._caching_enabled = caching_enabled
+        self._caching_ttl_seconds = max(1, caching_ttl_seconds)
+        self._caching_grid_meters = max(1, caching_grid_meters)
+
+        self._cache: LruCache = LruCache(caching_max_entries, self._caching_ttl_seconds)
+
+        # the adapter is created once at startup and shared by all threads
+        # in order to re-use its connections to the nominal data service
+        # creating it here keeps the loading of nominal data out of the matching threads
+        self._adapter: BaseAdapter = self._get_configured_adapter()
+
     def get_trip_candidates(self, latitude: float, longitude: float) -> list[Trip]|None:
-        adapter: BaseAdapter = self._get_configured_adapter()
+        cache_key: tuple|None = None
+        if self._caching_enabled:
+            cache_key = self._get_cache_key(latitude, longitude)
+
+            cached_result: list[Trip]|None = self._cache.get(cache_key)
+            if cached_result is not None:
+                logging.info(f"{self.__class__.__name__}: Loaded trip candidates from cache (Hits: {self._cache.hits}, Misses: {self._cache.misses}, Entries: {len(self._cache)}).")
+                return list(cached_result)
 
         try:
             logging.info(f"{self.__class__.__name__}: Loading trip candidates with adapter of type {self._adapter_type} ...")
-            result: list[Trip] = adapter.get_trip_candidates(latitude, longitude)
+            result: list[Trip] = self._adapter.get_trip_candidates(latitude, longitude)
+
+            # failures are raised by the adapter and never cached
+            # empty results are not cached either, nearby trips may be found with the next update
+            if cache_key is not None and result is not None and len(result) > 0:
+                self._cache.put(cache_key, list(result))
 
             return result
         
@@ -28,6 +58,20 @@ class NominalDataClient:
 
             return None
 
+    def _get_cache_key(self, latitude: float, longitude: float) -> tuple:
+        meters_per_degree: float = 111320.0
+
+        # map coordinates to a grid of approx. caching_grid_meters x caching_grid_meters
+        latitude_cell: int = math.floor(latitude * meters_per_degree / self._caching_grid_meters)
+        longitude_cell: int = math.floor(longitude * meters_per_degree * math.cos(math.radians(latitude)) / self._caching_grid_meters)
+
+        time_bucket: int = int(time() // self._caching_ttl_seconds)
+
+        return (latitude_cell, longitude_cell, time_bucket)
+
+    def close(self) -> None:
+        self._adapter.close()
+
     def _get_configured_adapter(self) -> BaseAdapter:
         adapter: BaseAdapter = None
         
@@ -36,7 +80,19 @@ class NominalDataClient:
             adapter = OtpAdapter(
                 self._adapter_config.get('endpoint', None),
                 self._adapter_config.get('username', None),
-                self._adapter_config.get('password', None)
+                self._adapter_config.get('password', None),
+                float(self._adapter_config.get('connect_timeout', 5.0)),
+                float(self._adapter_config.get('read_timeout', 30.0)),
+                int(self._adapter_config.get('pool_size', 10)),
+                int(self._adapter_config.get('max_parallel_requests', 4)),
+                int(self._adapter_config.get('trips_per_request', 20))
+            )
+        elif self._adapter_type == 'gtfs':
+            from avl2gtfsrt.nominal.gtfs.adapter import GtfsAdapter
+            adapter = GtfsAdapter(
+                self._adapter_config.get('endpoint', None),
+                str(self._adapter_config.get('feed_id', '1')),
+                int(self._adapter_config.get('radius', 200))
             )
         else:
             raise ValueError(f"Unknown nominal adapter type {self._adapter_type}!")
@@ -0,0 +1,368 @@
+import csv
+import io
+import logging
+import math
+import os
+import polyline
+import zipfile
+
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from threading import Lock
+from zoneinfo import ZoneInfo
+
+from avl2gtfsrt.common.datetime import get_operating_day_time_str, get_operating_day_seconds
+from avl2gtfsrt.model.types import StopTime, Stop, Trip, TripDescriptor
+from avl2gtfsrt.nominal.baseadapter import BaseAdapter
+
+
+class GtfsAdapter(BaseAdapter):
+
+    METERS_PER_DEGREE: float = 111320.0
+    MAX_GRID_LATITUDE: float = 89.0
+
+    def __init__(self, endpoint: str, feed_id: str = '1', radius: int = 200, max_trip_candidates: int = 20):
+        self._endpoint = endpoint
+        self._feed_id = feed_id
+        self._radius = radius
+        self._max_trip_candidates = max_trip_candidates
+
+        if self._endpoint is None or not os.path.isfile(self._endpoint):
+            raise ValueError(f"GTFS file {self._endpoint} not found!")
+
+        # stop data, referenced by the stop index
+        self._stop_ids: list[str] = list()
+        self._stop_latitudes: array = array('d')
+        self._stop_longitudes: array = array('d')
+
+        # spatial grid index of all stops, cell size is the search radius
+        self._grid_cell_latitude: float = self._radius / self.METERS_PER_DEGREE
+        self._grid_cell_longitude: float = self._grid_cell_latitude
+        self._grid: dict[tuple[int, int], list[int]] = dict()
+
+        # trip data, referenced by the trip index
+        self._trip_ids: list[str] = list()
+        self._trip_route_ids: list[str] = list()
+        self._trip_service_ids: list[str] = list()
+        self._trip_shape_ids: list[str|None] = list()
+        self._trip_stop_times: list[tuple[array, array, array]|None] = list()
+
+        # encoded shape polylines by shape ID
+        # trips carry their shape as encoded polyline, which is what all adapters return and what is stored in MongoDB
+        # the projected geometry of each shape is prepared once by the trip shape cache of the matching, so it's not kept here
+        self._shapes: dict[str, str] = dict()
+
+        # departures of each stop index as sorted departure seconds and trip indices
+        self._stop_departures: dict[int, tuple[array, array]] = dict()
+
+        # calendar data for determining active services on a certain date
+        self._calendar: dict[str, tuple[str, str, tuple[bool, ...]]] = dict()
+        self._calendar_dates: dict[str, dict[str, int]] = dict()
+
+        self._active_services: dict[str, set[str]] = dict()
+        self._active_services_lock: Lock = Lock()
+
+        self._load()
+
+    def _load(self) -> None:
+        logging.info(f"{self.__class__.__name__}: Loading GTFS data from {self._endpoint} ...")
+
+        with zipfile.ZipFile(self._endpoint) as gtfs:
+            self._load_stops(gtfs)
+            self._load_trips(gtfs)
+            self._load_shapes(gtfs)
+            self._load_stop_times(gtfs)
+            self._load_calendar(gtfs)
+
+        logging.info(f"{self.__class__.__name__}: Loaded {len(self._stop_ids)} stops, {len(self._trip_ids)} trips and {len(self._shapes)} shapes.")
+
+    def _read(self, gtfs: zipfile.ZipFile, filename: str) -> csv.DictReader|None:
+        if filename not in gtfs.namelist():
+            return None
+
+        return csv.DictReader(io.TextIOWrapper(gtfs.open(filename), encoding='utf-8-sig'))
+
+    def _load_stops(self, gtfs: zipfile.ZipFile) -> None:
+        reader: csv.DictReader|None = self._read(gtfs, 'stops.txt')
+        if reader is None:
+            raise ValueError(f"GTFS file {self._endpoint} does not contain stops.txt!")
+
+        for row in reader:
+            if row.get('stop_lat', '') == '' or row.get('stop_lon', '') == '':
+                continue
+
+            self._stop_ids.append(row['stop_id'])
+            self._stop_latitudes.append(float(row['stop_lat']))
+            self._stop_longitudes.append(float(row['stop_lon']))
+
+        # build spatial grid, longitude cell size depends on the maximum absolute latitude of the feed
+        # degrees of longitude are shortest there, so each cell is at least as wide as the search radius
+        # for all stops of the feed and the neighbouring cells of a query contain all stops within the radius
+        if len(self._stop_latitudes) > 0:
+            max_latitude: float = min(max(abs(l) for l in self._stop_latitudes), self.MAX_GRID_LATITUDE)
+            self._grid_cell_longitude = self._radius / (self.METERS_PER_DEGREE * math.cos(math.radians(max_latitude)))
+
+        for s in range(len(self._stop_ids)):
+            cell: tuple[int, int] = self._get_grid_cell(self._stop_latitudes[s], self._stop_longitudes[s])
+            self._grid.setdefault(cell, list()).append(s)
+
+    def _load_trips(self, gtfs: zipfile.ZipFile) -> None:
+        reader: csv.DictReader|None = self._read(gtfs, 'trips.txt')
+        if reader is None:
+            raise ValueError(f"GTFS file {self._endpoint} does not contain trips.txt!")
+
+        for row in reader:
+            self._trip_ids.append(row['trip_id'])
+            self._trip_route_ids.append(row['route_id'])
+            self._trip_service_ids.append(row['service_id'])
+            self._trip_shape_ids.append(row.get('shape_id', '') or None)
+            self._trip_stop_times.append(None)
+
+    def _load_shapes(self, gtfs: zipfile.ZipFile) -> None:
+        reader: csv.DictReader|None = self._read(gtfs, 'shapes.txt')
+        if reader is None:
+            return
+
+        shape_points: dict[str, list[tuple[int, float, float]]] = dict()
+        for row in reader:
+            shape_points.setdefault(row['shape_id'], list()).append((
+                int(row['shape_pt_sequence']),
+                float(row['shape_pt_lat']),
+                float(row['shape_pt_lon'])
+            ))
+
+        # store shapes encoded, this is the representation used in trips
+        # and much more compact than the raw coordinates
+        for shape_id, points in shape_points.items():
+            points.sort()
+            self._shapes[shape_id] = polyline.encode([(p[1], p[2]) for p in points])
+
+    def _load_stop_times(self, gtfs: zipfile.ZipFile) -> None:
+        reader: csv.DictReader|None = self._read(gtfs, 'stop_times.txt')
+        if reader is None:
+            raise ValueError(f"GTFS file {self._endpoint} does not contain stop_times.txt!")
+
+        trip_indices: dict[str, int] = {trip_id: t for t, trip_id in enumerate(self._trip_ids)}
+        stop_indices: dict[str, int] = {stop_id: s for s, stop_id in enumerate(self._stop_ids)}
+
+        trip_stop_times: dict[int, list[tuple[int, int|None, int|None, int]]] = dict()
+        for row in reader:
+            trip_index: int|None = trip_indices.get(row['trip_id'], None)
+            stop_index: int|None = stop_indices.get(row['stop_id'], None)
+            if trip_index is None or stop_index is None:
+                continue
+
+            arrival: str = row.get('arrival_time', '').strip()
+            departure: str = row.get('departure_time', '').strip()
+
+            trip_stop_times.setdefault(trip_index, list()).append((
+                int(row['stop_sequence']),
+                get_operating_day_seconds(arrival) if arrival != '' else None,
+                get_operating_day_seconds(departure) if departure != '' else None,
+                stop_index
+            ))
+
+        stop_departures: dict[int, list[tuple[int, int]]] = dict()
+        for trip_index, stop_times in trip_stop_times.items():
+            stop_times.sort()
+
+            arrivals: list[int|None] = [st[1] if st[1] is not None else st[2] for st in stop_times]
+            departures: list[int|None] = [st[2] if st[2] is not None else st[1] for st in stop_times]
+
+            # interpolate times of stops without times by their position in the trip
+            departures = self._interpolate(departures)
+            arrivals = [a if a is not None else d for a, d in zip(arrivals, departures)]
+
+            if len(stop_times) < 2 or None in departures:
+                continue
+
+            self._trip_stop_times[trip_index] = (
+                array('i', arrivals),
+                array('i', departures),
+                array('i', [st[3] for st in stop_times])
+            )
+
+            for st, departure in zip(stop_times, departures):
+                stop_departures.setdefault(st[3], list()).append((departure, trip_index))
+
+        # build departure index per stop sorted by departure seconds
+        for stop_index, departures in stop_departures.items():
+            departures.sort()
+
+            self._stop_departures[stop_index] = (
+                array('i', [d[0] for d in departures]),
+                array('i', [d[1] for d in departures])
+            )
+
+    def _load_calendar(self, gtfs: zipfile.ZipFile) -> None:
+        reader: csv.DictReader|None = self._read(gtfs, 'calendar.txt')
+        if reader is not None:
+            weekdays: list[str] = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+            for row in reader:
+                self._calendar[row['service_id']] = (
+                    row['start_date'],
+                    row['end_date'],
+                    tuple(row[w] == '1' for w in weekdays)
+                )
+
+        reader = self._read(gtfs, 'calendar_dates.txt')
+        if reader is not None:
+            for row in reader:
+                self._calendar_dates.setdefault(row['date'], dict())[row['service_id']] = int(row['exception_type'])
+
+    def _interpolate(self, values: list[int|None]) -> list[int|None]:
+        known: list[int] = [i for i, v in enumerate(values) if v is not None]
+        if len(known) < 2:
+            return values
+
+        result: list[int|None] = list(values)
+        for a, b in zip(known, known[1:]):
+            for i in range(a + 1, b):
+                result[i] = int(values[a] + (values[b] - values[a]) * (i - a) / (b - a))
+
+        return result
+
+    def _get_grid_cell(self, latitude: float, longitude: float) -> tuple[int, int]:
+        return (
+            math.floor(latitude / self._grid_cell_latitude),
+            math.floor(longitude / self._grid_cell_longitude)
+        )
+
+    def _get_active_services(self, service_date: datetime) -> set[str]:
+        date_str: str = service_date.strftime('%Y%m%d')
+
+        with self._active_services_lock:
+            if date_str in self._active_services:
+                return self._active_services[date_str]
+
+            active_services: set[str] = set()
+            for service_id, (start_date, end_date, weekdays) in self._calendar.items():
+                if start_date <= date_str <= end_date and weekdays[service_date.weekday()]:
+                    active_services.add(service_id)
+
+            for service_id, exception_type in self._calendar_dates.get(date_str, dict()).items():
+                if exception_type == 1:
+                    active_services.add(service_id)
+                elif exception_type == 2:
+                    active_services.discard(service_id)
+
+            # keep only a few service days, they are changing only once a day
+            if len(self._active_services) > 3:
+                self._active_services.clear()
+
+            self._active_services[date_str] = active_services
+
+            return active_services
+
+    def _find_nearby_stops(self, latitude: float, longitude: float) -> list[int]:
+        latitude_cell, longitude_cell = self._get_grid_cell(latitude, longitude)
+        longitude_factor: float = math.cos(math.radians(latitude))
+
+        nearby_stops: list[int] = list()
+        for d_latitude in (-1, 0, 1):
+            for d_longitude in (-1, 0, 1):
+                for s in self._grid.get((latitude_cell + d_latitude, longitude_cell + d_longitude), []):
+                    dy: float = (self._stop_latitudes[s] - latitude) * self.METERS_PER_DEGREE
+                    dx: float = (self._stop_longitudes[s] - longitude) * self.METERS_PER_DEGREE * longitude_factor
+
+                    if dx * dx + dy * dy <= self._radius * self._radius:
+                        nearby_stops.append(s)
+
+        return nearby_stops
+
+    def get_trip_candidates(self, lat: float, lon: float) -> list[Trip]:
+
+        reference_timestamp: datetime = datetime.now(ZoneInfo(os.getenv('A2G_TIMEZONE', 'Europe/Berlin'))).replace(microsecond=0)
+        reference_timestamp = reference_timestamp - timedelta(minutes=15)
+
+        # check whether the current timestamp is before the end of the last operating day
+        # if so, use the last calendar day as reference date
+        reference_timestamp_midnight: int = int(reference_timestamp.replace(hour=0, minute=0, second=0).timestamp())
+        operating_day_end_seconds: int = get_operating_day_seconds(os.getenv('A2G_OPERATING_DAY_END', '27:00:00')) - 86400
+
+        if reference_timestamp.timestamp() <= reference_timestamp_midnight + operating_day_end_seconds:
+            reference_date: datetime = reference_timestamp - timedelta(days=1)
+        else:
+            reference_date: datetime = reference_timestamp
+
+        reference_date_midnight: int = int(reference_date.replace(hour=0, minute=0, second=0).timestamp())
+        reference_seconds: int = int(reference_timestamp.timestamp()) - reference_date_midnight
+
+        active_services: set[str] = self._get_active_services(reference_date)
+
+        # find the earliest upcoming departure of each trip at all nearby stops
+        nearby_stops: list[int] = self._find_nearby_stops(lat, lon)
+        if len(nearby_stops) == 0:
+            logging.warning(f"{self.__class__.__name__}: No nearby stops found for coordinates ({lat}, {lon}).")
+
+        trip_departures: dict[int, int] = dict()
+        for stop_index in nearby_stops:
+            if stop_index not in self._stop_departures:
+                continue
+
+            # departures are sorted, so the loop stops after max_trip_candidates trips of this stop
+            # all later departures of this stop cannot be among the earliest trip candidates anymore
+            stop_trip_indices: set[int] = set()
+
+            departures, trip_indices = self._stop_departures[stop_index]
+            for d in range(bisect_left(departures, reference_seconds), len(departures)):
+                trip_index: int = trip_indices[d]
+                if self._trip_service_ids[trip_index] not in active_services:
+                    continue
+
+                if trip_index not in trip_departures or departures[d] < trip_departures[trip_index]:
+                    trip_departures[trip_index] = departures[d]
+
+                stop_trip_indices.add(trip_index)
+                if len(stop_trip_indices) >= self._max_trip_candidates:
+                    break
+
+        trip_indices: list[int] = sorted(trip_departures, key=lambda t: trip_departures[t])
+        trip_indices = trip_indices[:self._max_trip_candidates]
+
+        # construct final trips here ...
+        trips: list[Trip] = list()
+        for trip_index in trip_indices:
+            trips.append(self._create_trip(trip_index, reference_date, reference_date_midnight))
+
+        return trips
+
+    def _create_trip(self, trip_index: int, reference_date: datetime, reference_date_midnight: int) -> Trip:
+        arrivals, departures, stop_indices = self._trip_stop_times[trip_index]
+
+        stop_times: list[StopTime] = list()
+        for i in range(len(stop_indices)):
+            stop_index: int = stop_indices[i]
+
+            stop_times.append(StopTime(
+                arrival_timestamp=reference_date_midnight + arrivals[i],
+                departure_timestamp=reference_date_midnight + departures[i],
+                stop_sequence=i,
+                stop=Stop(
+                    stop_id=self._get_feed_scoped_id(self._stop_ids[stop_index]),
+                    latitude=self._stop_latitudes[stop_index],
+                    longitude=self._stop_longitudes[stop_index]
+                )
+            ))
+
+        # use the shape of the trip, or the sequence of stops if no shape is available
+        shape_id: str|None = self._trip_shape_ids[trip_index]
+        if shape_id is not None and shape_id in self._shapes:
+            shape_polyline: str = self._shapes[shape_id]
+        else:
+            shape_polyline: str = polyline.encode([(self._stop_latitudes[s], self._stop_longitudes[s]) for s in stop_indices])
+
+        return Trip(
+            descriptor=TripDescriptor(
+                trip_id=self._get_feed_scoped_id(self._trip_ids[trip_index]),
+                route_id=self._get_feed_scoped_id(self._trip_route_ids[trip_index]),
+                start_time=get_operating_day_time_str(departures[0]),
+                start_date=reference_date.strftime('%Y%m%d')
+            ),
+            shape_polyline=shape_polyline,
+            stop_times=stop_times
+        )
+
+    def _get_feed_scoped_id(self, id: str) -> str:
+        return f"{self._feed_id}:{id}"
@@ -2,10 +2,11 @@ import logging
 import os
 import requests
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
 from zoneinfo import ZoneInfo
 
-from avl2gtfsrt.common.env import is_debug
 from avl2gtfsrt.common.datetime import get_operating_day_time_str, get_operating_day_seconds
 from avl2gtfsrt.model.types import StopTime, Stop, Trip, TripDescriptor
 from avl2gtfsrt.nominal.baseadapter import BaseAdapter
@@ -13,101 +14,67 @@ from avl2gtfsrt.nominal.baseadapter import BaseAdapter
 
 class OtpAdapter(BaseAdapter):
 
-    def __init__(self, endpoint: str, username: str|None = None, password: str|None = None):
+    def __init__(self, endpoint: str, username: str|None = None, password: str|None = None, connect_timeout: float = 5.0, read_timeout: float = 30.0, pool_size: int = 10, max_parallel_requests: int = 4, trips_per_request: int = 20):
         self._endpoint = endpoint
         self._username = username
         self._password = password
+
+        self._timeout: tuple[float, float] = (connect_timeout, read_timeout)
+        self._trips_per_request: int = max(1, trips_per_request)
+
+        # use one long-lived session with a keep-alive connection pool
+        # this avoids a new TCP/TLS handshake for every single request
+        self._session: requests.Session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+        self._session.headers.update({
+            'Content-Type': 'application/json'
+        })
+
+        if self._username is not None and self._password is not None:
+            self._session.auth = (self._username, self._password)
+
+        # executor for loading trip details in parallel, bounded by max_parallel_requests
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max(1, max_parallel_requests), thread_name_prefix='otpadapter')
         
     def _request(self, query: str, variables: dict) -> dict:
-        try:
-            
-            authentication: tuple|None = None
-            if self._username is not None and self._password is not None:
-                authentication = (self._username, self._password)
-            
-            response = requests.post(
-                self._endpoint,
-                json={
-                    'query': query, 
-                    'variables': variables
-                },
-                headers={
-                    'Content-Type': 'application/json'
-                },
-                auth=authentication
-            )
-            
-            response.raise_for_status()
-            
-            return response.json()
-        except Exception as ex:
-            if is_debug():
-                logging.exception(ex)
-            else:
-                logging.error(str(ex)) 
-            
-            return None
+
+        # failed requests are raised instead of being handled as empty results
+        # so that results of partly failed lookups are never used or cached
+        response = self._session.post(
+            self._endpoint,
+            json={
+                'query': query, 
+                'variables': variables
+            },
+            timeout=self._timeout
+        )
+        
+        response.raise_for_status()
+
+        data: dict = response.json()
+        if data.get('data', None) is None or len(data.get('errors', [])) > 0:
+            raise RuntimeError(f"Request to OTP endpoint {self._endpoint} failed: {data.get('errors', None)}")
+        
+        return data
         
-    def _load_nearby_stops(self, lat: float, lon: float) -> list[str]:
+    def _load_departures(self, lat: float, lon: float, reference_timestamp: datetime) -> list[dict[str, any]]:
         query: str = """
-        query NearbyStops($lat: Float!, $lon: Float!) {
+        query NearbyDepartures($lat: Float!, $lon: Float!, $date: String!) {
           stopsByRadius(lat: $lat, lon: $lon, radius: 200) {
             edges {
               node {
                 distance,
                 stop {
                   gtfsId
-                }
-              }
-            }
-          }
-        }
-        """
-
-        variables: dict = {
-            'lat': lat,
-            'lon': lon
-        }
-
-        data: dict = self._request(query, variables)
-
-        
-        if data is not None and 'data' in data and 'stopsByRadius' in data['data'] and data['data']['stopsByRadius'] is not None and len(data['data']['stopsByRadius'].get('edges', [])) > 0:
-            stop_ids: list[str] = list()
-
-            for edge in data['data']['stopsByRadius']['edges']:
-                if 'node' in edge and 'stop' in edge['node'] and 'gtfsId' in edge['node']['stop']:
-                    stop_ids.append(edge['node']['stop']['gtfsId'])
-
-            return stop_ids
-        else:
-            return []
-        
-    def _load_departing_trips(self, stop_id: str, reference_timestamp: datetime) -> list[dict[str, any]]:
-        query: str = """
-        query DepartingTrips($date: String!, $stopId: String!) {
-          stop(id: $stopId) {
-            stoptimesForServiceDate(date: $date) {
-              stoptimes {
-                scheduledArrival
-                scheduledDeparture
-                trip {
-                  gtfsId
-                  route {
-                    gtfsId
-                  }
-                  tripGeometry {
-                    points
-                  }
-                  stoptimes {
-                    scheduledArrival
-                    scheduledDeparture
-                    stopPositionInPattern
-                    stop {
-                      gtfsId
-                      name
-                      lat
-                      lon
+                  stoptimesForServiceDate(date: $date) {
+                    stoptimes {
+                      scheduledArrival
+                      scheduledDeparture
+                      trip {
+                        gtfsId
+                      }
                     }
                   }
                 }
@@ -127,48 +94,135 @@ class OtpAdapter(BaseAdapter):
         else:
             reference_date: datetime = reference_timestamp
 
-        # construct variables and load data
+        # construct variables and load departures of all nearby stops with one single request
+        # only the trip IDs are loaded here, trip details are loaded once per trip later
         variables: dict = {
-            'stopId': stop_id,
+            'lat': lat,
+            'lon': lon,
             'date': reference_date.strftime('%Y-%m-%d')
         }
 
         data: dict = self._request(query, variables)
 
+        if data['data'].get('stopsByRadius', None) is None or len(data['data']['stopsByRadius'].get('edges', [])) == 0:
+            logging.warning(f"{self.__class__.__name__}: No nearby stops found for coordinates ({lat}, {lon}).")
+            return []
+
         # process everything here
-        if data is not None and 'data' in data and 'stop' in data['data'] and data['data']['stop'] is not None and len(data['data']['stop'].get('stoptimesForServiceDate', [])) > 0:
-            stoptimes_for_service_date: dict = data['data']['stop'].get('stoptimesForServiceDate')
+        # the same trip is departing at every nearby stop it serves, so keep only
+        # the earliest departure of each trip
+        departures: dict[str, dict[str, any]] = dict()
+        for edge in data['data']['stopsByRadius']['edges']:
+            if 'node' not in edge or edge['node'].get('stop', None) is None:
+                continue
+
+            stop: dict = edge['node']['stop']
+            stoptimes_for_service_date: list[dict]|None = stop.get('stoptimesForServiceDate', None)
+            if stoptimes_for_service_date is None or len(stoptimes_for_service_date) == 0:
+                logging.debug(f"{self.__class__.__name__}: No departing trips found for stop {stop.get('gtfsId', None)}.")
+                continue
 
-            trip_data: list[dict[str, any]] = list()
             for stoptimes_for_pattern in stoptimes_for_service_date:
                 if 'stoptimes' in stoptimes_for_pattern and len(stoptimes_for_pattern['stoptimes']) > 0:
                     for stoptime in stoptimes_for_pattern['stoptimes']:
                         departure_timestamp: int = reference_timestamp_midnight + int(stoptime['scheduledDeparture'] if 'scheduledDeparture' in stoptime else stoptime['scheduledArrival'])
                         if departure_timestamp >= int(reference_timestamp.timestamp()):
-                            trip: dict[str, any] = stoptime['trip']
-                            trip['stopScheduledDeparture'] = departure_timestamp
+                            trip_id: str = stoptime['trip']['gtfsId']
+                            if trip_id not in departures or departure_timestamp < departures[trip_id]['stopScheduledDeparture']:
+                                departures[trip_id] = {
+                                    'gtfsId': trip_id,
+                                    'stopScheduledDeparture': departure_timestamp
+                                }
 
-                            trip_data.append(stoptime['trip'])
+        return list(departures.values())
 
-            return trip_data
-        else:
-            return []
+    def _load_trip_details(self, trip_ids: list[str]) -> dict[str, dict[str, any]]:
+        if len(trip_ids) == 0:
+            return dict()
+
+        # with the default of 20 trips per request, the details of all trip candidates are loaded with one single request
+        # so each lookup takes two requests and the parallel loading is off unless smaller chunks are configured
+        # smaller chunks are loaded in parallel, as responses containing shapes and stop times of many trips can be quite large
+        chunks: list[list[str]] = [trip_ids[i:i + self._trips_per_request] for i in range(0, len(trip_ids), self._trips_per_request)]
+        if len(chunks) == 1:
+            return self._load_trip_details_chunk(chunks[0])
+
+        trip_details: dict[str, dict[str, any]] = dict()
+        for chunk_trip_details in self._executor.map(self._load_trip_details_chunk, chunks):
+            trip_details.update(chunk_trip_details)
+
+        return trip_details
+
+    def _load_trip_details_chunk(self, trip_ids: list[str]) -> dict[str, dict[str, any]]:
+
+        # load details of all trips with one single request using aliased trip fields
+        # this way, shape and stop times of each trip are transferred only once
+        aliases: list[str] = [f"t{i}" for i in range(len(trip_ids))]
+
+        query_variables: str = ', '.join(f"${a}: String!" for a in aliases)
+        query_fields: str = '\n'.join(f"          {a}: trip(id: ${a}) {{ ...TripDetails }}" for a in aliases)
+
+        query: str = f"""
+        query TripDetails({query_variables}) {{
+{query_fields}
+        }}
+
+        fragment TripDetails on Trip {{
+          gtfsId
+          route {{
+            gtfsId
+          }}
+          tripGeometry {{
+            points
+          }}
+          stoptimes {{
+            scheduledArrival
+            scheduledDeparture
+            stopPositionInPattern
+            stop {{
+              gtfsId
+              name
+              lat
+              lon
+            }}
+          }}
+        }}
+        """
+
+        variables: dict = {a: trip_id for a, trip_id in zip(aliases, trip_ids)}
+
+        data: dict = self._request(query, variables)
+
+        trip_details: dict[str, dict[str, any]] = dict()
+        for alias in aliases:
+            trip: dict|None = data['data'].get(alias, None)
+            if trip is not None and 'gtfsId' in trip:
+                trip_details[trip['gtfsId']] = trip
+
+        return trip_details
 
     def _load_trips(self, lat: float, lon: float, reference_timestamp: datetime) -> list[dict[str, any]]:
-        stop_ids: list[str] = self._load_nearby_stops(lat, lon)
-        if len(stop_ids) == 0:
-            logging.warning(f"{self.__class__.__name__}: No nearby stops found for coordinates ({lat}, {lon}).")
+        departures: list[dict[str, any]] = self._load_departures(lat, lon, reference_timestamp)
+
+        departures = sorted(departures, key=lambda x: x['stopScheduledDeparture'])
+        departures = departures[:20]
+
+        # load details for each trip and merge them with the departures
+        trip_ids: list[str] = [d['gtfsId'] for d in departures]
+        trip_details: dict[str, dict[str, any]] = self._load_trip_details(trip_ids)
 
         trip_data: list[dict[str, any]] = list()
-        for stop_id in stop_ids:
-            departing_trips: list[dict[str, any]] = self._load_departing_trips(stop_id, reference_timestamp)
-            if len(departing_trips) == 0:
-                logging.debug(f"{self.__class__.__name__}: No departing trips found for stop {stop_id}.")
+        for departure in departures:
+            if departure['gtfsId'] not in trip_details:
+                logging.debug(f"{self.__class__.__name__}: Details for trip {departure['gtfsId']} could not be loaded.")
+                continue
 
-            trip_data.extend(departing_trips)
+            trip: dict[str, any] = trip_details[departure['gtfsId']]
+            trip['stopScheduledDeparture'] = departure['stopScheduledDeparture']
 
-        trip_data = sorted(trip_data, key=lambda x: x['stopScheduledDeparture'])
-        return trip_data[:20]
+            trip_data.append(trip)
+
+        return trip_data
     
     def get_trip_candidates(self, lat: float, lon: float) -> list[Trip]:
         
@@ -221,4 +275,8 @@ class OtpAdapter(BaseAdapter):
 
             trips.append(trip)
         
-        return trips
\ No newline at end of file
+        return trips
+    
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self._session.close()
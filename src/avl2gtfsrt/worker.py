@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 import signal
@@ -12,7 +13,11 @@ from avl2gtfsrt.vdv.vdv435 import *
 from avl2gtfsrt.iom.logonoffhandler import TechnicalVehicleLogOnHandler
 from avl2gtfsrt.iom.logonoffhandler import TechnicalVehicleLogOffHandler
 from avl2gtfsrt.iom.positioninghandler import GnssPhysicalPositionHandler
-from avl2gtfsrt.objectstorage import ObjectStorage
+from avl2gtfsrt.iom.loadmonitor import LoadMonitor
+from avl2gtfsrt.avl.matchingengine import MatchingEngine, BatchMatchingEngine
+from avl2gtfsrt.common.env import is_set
+from avl2gtfsrt.nominal.dataclient import NominalDataClient
+from avl2gtfsrt.objectstorage import ObjectStorage, WriteBehindObjectStorage
 
 class Worker:
 
@@ -21,17 +26,72 @@ class Worker:
         mongodb_username: str = os.getenv('A2G_MONGODB_USERNAME', '')
         mongodb_password: str = os.getenv('A2G_MONGODB_PASSWORD', '')
 
+        # vehicle data is kept in memory and written to MongoDB in batches if a flush interval is configured
+        # with batch matching, vehicle data is written with each tick of the batch matching engine additionally
+        storage_flush_interval_ms: int = int(os.getenv('A2G_STORAGE_FLUSH_INTERVAL_MS', '0'))
+        matching_batch_interval_ms: int = int(os.getenv('A2G_MATCHING_BATCH_INTERVAL_MS', '0'))
+
         logging.info(f"{self.__class__.__name__}: Connecting to MongoDB ...")
-        self._object_storage: ObjectStorage = ObjectStorage(
-            mongodb_username, 
-            mongodb_password,
-            int(os.getenv('A2G_MATCHING_DATA_REVIEW_SECONDS', '120')),
-            int(os.getenv('A2G_MATCHING_MAX_DATA_POINTS', '60'))
+        if storage_flush_interval_ms > 0 or matching_batch_interval_ms > 0:
+            if storage_flush_interval_ms > 0:
+                logging.info(f"{self.__class__.__name__}: Setting up WriteBehindObjectStorage with flush interval of {storage_flush_interval_ms}ms ...")
+            else:
+                logging.info(f"{self.__class__.__name__}: Setting up WriteBehindObjectStorage flushed with each tick of the BatchMatchingEngine ...")
+
+            self._object_storage: ObjectStorage = WriteBehindObjectStorage(
+                mongodb_username, 
+                mongodb_password,
+                int(os.getenv('A2G_MATCHING_DATA_REVIEW_SECONDS', '120')),
+                int(os.getenv('A2G_MATCHING_MAX_DATA_POINTS', '60')),
+                int(os.getenv('A2G_STORAGE_TRIP_CANDIDATES_TTL_SECONDS', '3600')),
+                storage_flush_interval_ms
+            )
+        else:
+            self._object_storage: ObjectStorage = ObjectStorage(
+                mongodb_username, 
+                mongodb_password,
+                int(os.getenv('A2G_MATCHING_DATA_REVIEW_SECONDS', '120')),
+                int(os.getenv('A2G_MATCHING_MAX_DATA_POINTS', '60')),
+                int(os.getenv('A2G_STORAGE_TRIP_CANDIDATES_TTL_SECONDS', '3600'))
+            )
+
+        # create nominal data client, which is shared by all matching threads
+        adapter_type: str = os.getenv('A2G_NOMINAL_ADAPTER_TYPE', 'otp')
+        adapter_config: str = os.getenv('A2G_NOMINAL_ADAPTER_CONFIG', None)
+
+        if adapter_type not in ['otp', 'gtfs']:
+            raise RuntimeError(f"Invalid nominal adapter type {adapter_type}. Please configure a valid adapter type.")
+
+        if adapter_config is None:
+            raise RuntimeError('Nominal adapter configuration is not set. Please set a valid adapter configuration.')
+
+        logging.info(f"{self.__class__.__name__}: Setting up NominalDataClient ...")
+        self._nominal_data_client: NominalDataClient = NominalDataClient(
+            adapter_type,
+            json.loads(adapter_config),
+            is_set('A2G_NOMINAL_CACHING_ENABLED'),
+            int(os.getenv('A2G_NOMINAL_CACHING_TTL_SECONDS', '60')),
+            int(os.getenv('A2G_NOMINAL_CACHING_MAX_ENTRIES', '500')),
+            int(os.getenv('A2G_NOMINAL_CACHING_GRID_METERS', '100'))
         )
 
+        # number of matching threads, a batch of the BatchMatchingEngine contains one vehicle per matching thread at most
+        num_threads: int = 10
+
+        # create matching engine, which scores trip candidates in batches or in matching processes if configured
+        # I/O of all vehicles remains on the matching threads
+        matching_processes: int = int(os.getenv('A2G_MATCHING_PROCESSES', '0'))
+
+        if matching_batch_interval_ms > 0:
+            logging.info(f"{self.__class__.__name__}: Setting up BatchMatchingEngine with batch interval of {matching_batch_interval_ms}ms ...")
+            self._matching_engine: MatchingEngine = BatchMatchingEngine(self._object_storage, matching_batch_interval_ms, num_threads)
+        else:
+            logging.info(f"{self.__class__.__name__}: Setting up MatchingEngine with {matching_processes} matching processes ...")
+            self._matching_engine: MatchingEngine = MatchingEngine(self._object_storage, matching_processes)
+
         # create thread pool for matching threads
         logging.info(f"{self.__class__.__name__}: Setting up ThreadPoolExecutor ...")
-        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=10)
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=num_threads)
 
         # create IoM instance
         instance_id: str = os.getenv('A2G_INSTANCE_ID', 'default')
@@ -56,6 +116,18 @@ class Worker:
         self._iom.on_technical_vehicle_log_off = self._iom_technical_vehicle_log_off
         self._iom.on_gnss_position_update = self._iom_gnss_position_update
 
+        # create load monitor for adapting the matching interval if enabled
+        self._load_monitor: LoadMonitor|None = None
+        if is_set('A2G_MATCHING_ADAPTIVE_INTERVAL_ENABLED'):
+            logging.info(f"{self.__class__.__name__}: Setting up LoadMonitor ...")
+            self._load_monitor = LoadMonitor(
+                self._iom,
+                num_threads,
+                int(os.getenv('A2G_MATCHING_MAX_INTERVAL', '5')),
+                int(os.getenv('A2G_MATCHING_ADAPTIVE_MAX_INTERVAL', '30')),
+                int(os.getenv('A2G_MATCHING_ADAPTIVE_TARGET_LATENCY_MS', '500'))
+            )
+
         # create event stream for communication with the publisher
         self._event_stream: EventPublisher = EventPublisher()
 
@@ -90,18 +162,26 @@ class Worker:
             logging.error(f"{self.__class__.__name__}: Exception in worker: {ex}")
         finally:
 
-            logging.info(f"{self.__class__.__name__}: Stopping internal event stream ...")
-            self._event_stream.stop()
-
             logging.info(f"{self.__class__.__name__}: Terminating IoM ...")
             self._iom.terminate()
 
             logging.info(f"{self.__class__.__name__}: Shutting down ThreadPoolExecutor ...")
             self._executor.shutdown(wait=True)
 
+            logging.info(f"{self.__class__.__name__}: Shutting down MatchingEngine ...")
+            self._matching_engine.close()
+
+            logging.info(f"{self.__class__.__name__}: Closing NominalDataClient ...")
+            self._nominal_data_client.close()
+
+            # pending vehicle data and events are flushed when closing the object storage
+            # so the event stream is stopped afterwards
             logging.info(f"{self.__class__.__name__}: Closing MongoDB connection ...")
             self._object_storage.close()
 
+            logging.info(f"{self.__class__.__name__}: Stopping internal event stream ...")
+            self._event_stream.stop()
+
             logging.info(f"{self.__class__.__name__}: Worker shutdown complete.")
 
     def _iom_technical_vehicle_log_on(self, msg: AbstractBasicStructure) -> AbstractBasicStructure:
@@ -113,5 +193,10 @@ class Worker:
         return handler.handle_request(msg)
     
     def _iom_gnss_position_update(self, topic: str, msg: AbstractBasicStructure) -> None:
-        handler: GnssPhysicalPositionHandler = GnssPhysicalPositionHandler(self._object_storage, self._event_stream)
-        handler.handle(topic, msg)
\ No newline at end of file
+        start_time: float = time.time()
+
+        handler: GnssPhysicalPositionHandler = GnssPhysicalPositionHandler(self._object_storage, self._event_stream, self._nominal_data_client, self._matching_engine, self._load_monitor)
+        handler.handle(topic, msg)
+
+        if self._load_monitor is not None:
+            self._load_monitor.record_latency(time.time() - start_time)
\ No newline at end of file
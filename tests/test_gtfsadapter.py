@@ -0,0 +1,133 @@
+import math
+import os
+import polyline
+import random
+import zipfile
+
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from avl2gtfsrt.model.types import Trip
+from avl2gtfsrt.nominal.gtfs.adapter import GtfsAdapter
+
+
+# departures late on the second operating day are upcoming for any reference time
+# so the trip candidates do not depend on the time the test is running
+STOPS: list[tuple] = [
+    ('A', 50.0000, 8.0000),
+    ('B', 50.0010, 8.0000),
+    ('C', 50.0020, 8.0000),
+    ('D', 50.0500, 8.0000),
+    ('E', 50.0600, 8.0000)
+]
+
+TRIPS: list[tuple] = [
+    # trip ID, service ID, shape ID, stop times
+    ('T1', 'ALL', 'S1', [('A', '47:00:00', '47:01:00'), ('B', '', ''), ('C', '47:05:00', '47:05:00')]),
+    ('T2', 'REMOVED', '', [('A', '47:10:00', '47:10:00'), ('C', '47:15:00', '47:15:00')]),
+    ('T3', 'ADDED', '', [('B', '47:20:00', '47:20:00'), ('C', '47:25:00', '47:25:00')]),
+    ('T4', 'ALL', '', [('D', '47:30:00', '47:30:00'), ('E', '47:35:00', '47:35:00')])
+]
+
+SHAPE_COORDS: list[tuple] = [(50.0000, 8.0000), (50.0010, 8.0001), (50.0020, 8.0000)]
+
+def write_gtfs(filename: str, stops: list[tuple], trips: list[tuple]) -> None:
+
+    # exceptions of the calendar are added for all dates around today, so the reference date is always covered
+    today: datetime = datetime.now(ZoneInfo(os.getenv('A2G_TIMEZONE', 'Europe/Berlin')))
+    dates: list[str] = [(today + timedelta(days=d)).strftime('%Y%m%d') for d in range(-2, 3)]
+
+    with zipfile.ZipFile(filename, 'w') as gtfs:
+        gtfs.writestr('stops.txt', 'stop_id,stop_name,stop_lat,stop_lon\n' + ''.join(f"{s[0]},{s[0]},{s[1]},{s[2]}\n" for s in stops))
+        gtfs.writestr('trips.txt', 'route_id,service_id,trip_id,shape_id\n' + ''.join(f"R1,{t[1]},{t[0]},{t[2]}\n" for t in trips))
+        gtfs.writestr('stop_times.txt', 'trip_id,arrival_time,departure_time,stop_id,stop_sequence\n' + ''.join(
+            f"{t[0]},{st[1]},{st[2]},{st[0]},{(i + 1) * 10}\n" for t in trips for i, st in enumerate(t[3])
+        ))
+        gtfs.writestr('shapes.txt', 'shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence\n' + ''.join(
+            f"S1,{c[0]},{c[1]},{i}\n" for i, c in reversed(list(enumerate(SHAPE_COORDS)))
+        ))
+        gtfs.writestr('calendar.txt', 'service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n' +
+            'ALL,1,1,1,1,1,1,1,20000101,20991231\n' +
+            'REMOVED,1,1,1,1,1,1,1,20000101,20991231\n'
+        )
+        gtfs.writestr('calendar_dates.txt', 'service_id,date,exception_type\n' + ''.join(
+            f"REMOVED,{d},2\nADDED,{d},1\n" for d in dates
+        ))
+
+def test_trip_candidates_from_gtfs(tmp_path):
+    filename: str = str(tmp_path / 'gtfs.zip')
+    write_gtfs(filename, STOPS, TRIPS)
+
+    adapter: GtfsAdapter = GtfsAdapter(filename, feed_id='1', radius=200)
+
+    # stops A, B and C are within the radius, trip T4 of stops D and E is not found
+    # trip T2 is removed and trip T3 is added by calendar_dates
+    trips: list[Trip] = adapter.get_trip_candidates(50.0005, 8.0000)
+    assert [t.descriptor.trip_id for t in trips] == ['1:T1', '1:T3']
+
+    trip: Trip = trips[0]
+    assert trip.descriptor.route_id == '1:R1'
+    assert trip.descriptor.start_time == '47:01:00'
+    assert trip.shape_polyline == polyline.encode(SHAPE_COORDS)
+
+    # stop sequences are consecutive and times of stop B are interpolated
+    assert [st.stop.stop_id for st in trip.stop_times] == ['1:A', '1:B', '1:C']
+    assert [st.stop_sequence for st in trip.stop_times] == [0, 1, 2]
+    assert [st.departure_timestamp - trip.stop_times[0].arrival_timestamp for st in trip.stop_times] == [60, 180, 300]
+    assert trip.stop_times[1].arrival_timestamp == trip.stop_times[1].departure_timestamp
+
+    # trips without shape use the sequence of their stops
+    assert trips[1].shape_polyline == polyline.encode([(50.0010, 8.0000), (50.0020, 8.0000)])
+
+    # there are no stops within the radius
+    assert adapter.get_trip_candidates(50.1000, 8.1000) == []
+
+def test_nearby_stops_equal_linear_search(tmp_path):
+    randomizer: random.Random = random.Random(1)
+
+    # most stops of the feed are near the equator, but the longitude cell size must fit the northern stops as well
+    stops: list[tuple] = [(f"EQ{i}", randomizer.uniform(-0.1, 0.1), randomizer.uniform(7.9, 8.1)) for i in range(0, 500)]
+    for i in range(0, 500):
+        stops.append((f"S{i}", randomizer.uniform(69.98, 70.02), randomizer.uniform(7.98, 8.02)))
+
+    filename: str = str(tmp_path / 'gtfs.zip')
+    write_gtfs(filename, stops, [('T1', 'ALL', '', [('EQ0', '10:00:00', '10:00:00'), ('S0', '11:00:00', '11:00:00')])])
+
+    adapter: GtfsAdapter = GtfsAdapter(filename, feed_id='1', radius=200)
+
+    for i in range(0, 200):
+        latitude: float = randomizer.uniform(69.98, 70.02) if i % 2 == 0 else randomizer.uniform(-0.1, 0.1)
+        longitude: float = randomizer.uniform(7.98, 8.02) if i % 2 == 0 else randomizer.uniform(7.9, 8.1)
+
+        expected: set[str] = set()
+        for stop_id, stop_latitude, stop_longitude in stops:
+            dy: float = (stop_latitude - latitude) * GtfsAdapter.METERS_PER_DEGREE
+            dx: float = (stop_longitude - longitude) * GtfsAdapter.METERS_PER_DEGREE * math.cos(math.radians(latitude))
+            if dx * dx + dy * dy <= 200 * 200:
+                expected.add(stop_id)
+
+        assert {adapter._stop_ids[s] for s in adapter._find_nearby_stops(latitude, longitude)} == expected
+
+def test_departures_are_cut_off_after_max_trip_candidates(tmp_path):
+
+    # all trips depart at stop A, so only the earliest trips of stop A need to be considered
+    departing_trips: list[tuple] = [(f"T{i:02d}", 'ALL', '', [('A', f"47:{i:02d}:00", f"47:{i:02d}:00"), ('D', f"47:{i:02d}:30", f"47:{i:02d}:30")]) for i in range(0, 60)]
+
+    filename: str = str(tmp_path / 'gtfs.zip')
+    write_gtfs(filename, STOPS, list(reversed(departing_trips)))
+
+    adapter: GtfsAdapter = GtfsAdapter(filename, feed_id='1', radius=200, max_trip_candidates=5)
+
+    # count the departures which are considered by counting the lookups of their services
+    class CountingList(list):
+        num_lookups: int = 0
+
+        def __getitem__(self, index):
+            CountingList.num_lookups = CountingList.num_lookups + 1
+            return super().__getitem__(index)
+
+    adapter._trip_service_ids = CountingList(adapter._trip_service_ids)
+
+    trips: list[Trip] = adapter.get_trip_candidates(50.0000, 8.0000)
+    assert [t.descriptor.trip_id for t in trips] == [f"1:T{i:02d}" for i in range(0, 5)]
+    assert CountingList.num_lookups == 5
@@ -0,0 +1,170 @@
+import math
+import numpy as np
+import polyline
+import random
+import shapely
+import time
+
+from shapely.geometry import LineString
+
+from avl2gtfsrt.avl.hmmmatcher import HmmMatcher, HmmTripModel, HmmTripModelSet, HmmVehicleState, get_hmm_trip_model
+from avl2gtfsrt.avl.matchingengine import get_trip_key
+from avl2gtfsrt.avl.tripshape import TripShape, get_trip_shape
+from avl2gtfsrt.model.types import GnssPosition, Stop, StopTime, Trip, TripDescriptor, Vehicle, VehicleActivity, VehicleCache
+
+
+# trip shape with a turn and trip candidates running on it, later and in the opposite direction
+SHAPE_COORDS: list[tuple] = [(50.000, 8.000), (50.000, 8.010), (50.006, 8.010), (50.006, 8.002)]
+
+class FakeStorage:
+
+    def get_assigned_trip_ids(self) -> set[str]:
+        return set()
+
+def create_trip(trip_id: str, coords: list[tuple], first_departure_timestamp: int) -> Trip:
+    stop_times: list[StopTime] = [StopTime(first_departure_timestamp + i * 300, first_departure_timestamp + i * 300, i, Stop(f"{trip_id}-{i}", c[0], c[1])) for i, c in enumerate(coords)]
+    return Trip(TripDescriptor(trip_id=trip_id, start_date='20250101'), polyline.encode(coords), stop_times)
+
+def create_trip_candidates(now: int) -> list[Trip]:
+    return [
+        create_trip('hmm-trip', SHAPE_COORDS, now - 300),
+        create_trip('hmm-trip-late', SHAPE_COORDS, now + 600),
+        create_trip('hmm-trip-reverse', SHAPE_COORDS[::-1], now - 300)
+    ]
+
+def create_trace(now: int, num_positions: int) -> list[GnssPosition]:
+    shape: LineString = LineString([(c[1], c[0]) for c in SHAPE_COORDS])
+
+    # the vehicle is on the first leg of the trip shape, where the trip is scheduled right now
+    gnss_positions: list[GnssPosition] = list()
+    for i in range(0, num_positions):
+        point = shape.interpolate(0.007 + i * 0.0003)
+        gnss_positions.append(GnssPosition(point.y, point.x, now - (num_positions - i) * 10))
+
+    return gnss_positions
+
+def test_trip_model_segments():
+    now: int = int(time.time())
+    trip: Trip = create_trip_candidates(now)[0]
+
+    trip_shape: TripShape = get_trip_shape(trip)
+    trip_model: HmmTripModel = HmmTripModel(trip)
+
+    # segments have the same length for all trips, only the last segment is shorter
+    num_segments: int = math.ceil(trip_shape.length / HmmTripModel.SEGMENT_LENGTH)
+    assert len(trip_model.segment_starts) == num_segments
+    assert np.allclose(np.diff(trip_model.segment_centers)[:-1], HmmTripModel.SEGMENT_LENGTH)
+    assert trip_model.segment_centers[-1] < trip_shape.length
+
+    # segments start on the trip shape and are connected
+    assert np.allclose(shapely.distance(trip_shape.line, shapely.points(trip_model.segment_starts)), 0.0, atol=1e-6)
+    assert np.allclose(trip_model.segment_starts[1:], trip_model.segment_starts[:-1] + trip_model.segment_vectors[:-1])
+
+    # the nominal progress follows the departures at the stops
+    assert trip_model.nominal_projection(now - 300) == trip_shape.stop_projections[0]
+    assert trip_model.nominal_projection(now + 1200) == trip_shape.stop_projections[3]
+
+def test_banded_transition_equals_dense_transition():
+    now: int = int(time.time())
+    trip_model_set: HmmTripModelSet = HmmTripModelSet([get_hmm_trip_model(t) for t in create_trip_candidates(now)])
+
+    randomizer: random.Random = random.Random(17)
+    log_probabilities: np.ndarray = np.array([randomizer.uniform(-50.0, 0.0) for _ in range(0, len(trip_model_set.segment_starts))])
+
+    segment_length: float = HmmTripModel.SEGMENT_LENGTH
+    for distance in [0.0, 7.5, 20.0, 55.0, 130.0]:
+        result: np.ndarray = trip_model_set.log_transition(log_probabilities, distance)
+
+        # dense transition matrix with the same band, transitions are only possible within a trip
+        max_shift: int = math.ceil((distance + 2 * segment_length) / segment_length)
+        shifts: np.ndarray = np.arange(-1, max_shift + 1)
+        log_transitions: np.ndarray = -np.abs(shifts * segment_length - distance) / HmmTripModel.TRANSITION_BETA_METERS
+        log_transitions = log_transitions - np.log(np.exp(log_transitions).sum())
+
+        expected: list[np.ndarray] = list()
+        for trip_log_probabilities in trip_model_set.split(log_probabilities):
+            num_segments: int = len(trip_log_probabilities)
+            transitions: np.ndarray = np.full((num_segments, num_segments), -np.inf)
+            for i in range(0, num_segments):
+                for shift, log_transition in zip(shifts, log_transitions):
+                    if 0 <= i + shift < num_segments:
+                        transitions[i, i + shift] = log_transition
+
+            expected.append((trip_log_probabilities[:, None] + transitions).max(axis=0))
+
+        assert np.allclose(result, np.concatenate(expected))
+
+    # segments of the next trip are not reachable from the end of a trip
+    first_trip_only: np.ndarray = np.full(len(log_probabilities), -np.inf)
+    first_trip_only[trip_model_set.offsets[0] - 1] = 0.0
+
+    result: np.ndarray = trip_model_set.log_transition(first_trip_only, 100.0)
+    assert np.isfinite(result[:trip_model_set.offsets[0]]).any()
+    assert not np.isfinite(result[trip_model_set.offsets[0]:]).any()
+
+def test_incremental_update_equals_full_update():
+    now: int = int(time.time())
+    trip_candidates: list[Trip] = create_trip_candidates(now)
+    trace: list[GnssPosition] = create_trace(now, 12)
+
+    matcher: HmmMatcher = HmmMatcher(FakeStorage(), trip_candidates, False)
+
+    full_state: HmmVehicleState = HmmVehicleState()
+    matcher._update(full_state, trace, trip_candidates)
+
+    # sliding windows are truncated to the positions which are not processed yet
+    incremental_state: HmmVehicleState = HmmVehicleState()
+    for n in range(2, 13):
+        matcher._update(incremental_state, trace[max(0, n - 6):n], trip_candidates)
+
+    assert incremental_state.last_gnss_position == full_state.last_gnss_position
+    assert math.isclose(incremental_state.null_log_probability, full_state.null_log_probability)
+    for trip_key, log_probabilities in full_state.log_probabilities.items():
+        assert np.allclose(incremental_state.log_probabilities[trip_key], log_probabilities)
+
+def test_vehicle_state_retain_and_clear():
+    now: int = int(time.time())
+    trip_candidates: list[Trip] = create_trip_candidates(now)
+
+    matcher: HmmMatcher = HmmMatcher(FakeStorage(), trip_candidates, False)
+
+    vehicle_state: HmmVehicleState = HmmVehicleState()
+    matcher._update(vehicle_state, create_trace(now, 6), trip_candidates)
+
+    assert set(vehicle_state.log_probabilities.keys()) == {get_trip_key(t) for t in trip_candidates}
+
+    # trip candidates which are not considered anymore are removed, a new trip candidate starts with the latest position
+    vehicle_state.retain({get_trip_key(trip_candidates[0])})
+    assert set(vehicle_state.log_probabilities.keys()) == {get_trip_key(trip_candidates[0])}
+
+    matcher._update(vehicle_state, create_trace(now, 6), trip_candidates[:2])
+    assert set(vehicle_state.log_probabilities.keys()) == {get_trip_key(t) for t in trip_candidates[:2]}
+
+    # positions which do not continue the former update restart the state
+    last_gnss_position: GnssPosition = vehicle_state.last_gnss_position
+    matcher._update(vehicle_state, create_trace(now - 3600, 6), trip_candidates[:2])
+    assert vehicle_state.last_gnss_position.timestamp < last_gnss_position.timestamp
+
+    vehicle_state.clear()
+    assert vehicle_state.last_gnss_position is None
+    assert len(vehicle_state.log_probabilities) == 0
+
+def test_viterbi_converges_to_scheduled_trip():
+    now: int = int(time.time())
+    trip_candidates: list[Trip] = create_trip_candidates(now)
+    trace: list[GnssPosition] = create_trace(now, 16)
+
+    vehicle: Vehicle = Vehicle('hmm-vehicle', True, False, VehicleActivity(), VehicleCache())
+
+    probabilities: dict|None = None
+    convergence: bool = False
+    for n in range(2, 17):
+        matcher: HmmMatcher = HmmMatcher(FakeStorage(), trip_candidates, False)
+        convergence, probabilities = matcher.match(vehicle, trace[max(0, n - 12):n], probabilities)
+
+        if convergence:
+            break
+
+    # the trip scheduled at the positions wins against the late trip and the trip in the opposite direction
+    assert convergence
+    assert max(probabilities, key=lambda k: probabilities[k][-1]) == 'hmm-trip'
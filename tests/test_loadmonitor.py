@@ -0,0 +1,69 @@
+from avl2gtfsrt.iom.loadmonitor import LoadMonitor
+
+
+class FakeIomClient:
+
+    def __init__(self) -> None:
+        self.num_pending_tasks: int = 0
+        self.num_vehicles: int = 10
+        self.num_queued_messages: int = 0
+
+    def get_executor_stats(self) -> int:
+        return self.num_pending_tasks
+
+    def get_queue_stats(self) -> tuple[int, int]:
+        return (self.num_vehicles, self.num_queued_messages)
+
+def test_matching_interval_scales_with_load():
+    iom_client: FakeIomClient = FakeIomClient()
+    load_monitor: LoadMonitor = LoadMonitor(iom_client, 4, 5, 30, 500)
+
+    # no interval without overload
+    iom_client.num_pending_tasks = 6
+    assert load_monitor.get_load() == 0.5
+    assert load_monitor.get_matching_interval() == 0
+
+    # the interval grows with the load of the executor queue, the message queues and the latency
+    iom_client.num_pending_tasks = 12
+    assert load_monitor.get_matching_interval() == 10
+
+    iom_client.num_pending_tasks = 0
+    iom_client.num_queued_messages = 30
+    assert load_monitor.get_matching_interval() == 15
+
+    iom_client.num_queued_messages = 0
+    load_monitor.record_latency(10.0)
+    assert load_monitor.get_load() == 4.0
+    assert load_monitor.get_matching_interval() == 20
+
+    # but never beyond the maximum interval
+    iom_client.num_queued_messages = 1000
+    assert load_monitor.get_matching_interval() == 30
+
+def test_logged_on_vehicles_are_matched_less_often_under_load():
+    iom_client: FakeIomClient = FakeIomClient()
+    load_monitor: LoadMonitor = LoadMonitor(iom_client, 4, 5, 30, 500)
+
+    iom_client.num_queued_messages = 20
+    assert load_monitor.get_matching_interval() == 10
+
+    assert load_monitor.is_matching_required('logged-on', 1000, True)
+    assert not load_monitor.is_matching_required('logged-on', 1005, True)
+    assert load_monitor.is_matching_required('logged-on', 1010, True)
+
+    # timestamps before the last matching do not skip the matching
+    assert load_monitor.is_matching_required('logged-on', 900, True)
+
+    # without overload, each update is matched
+    iom_client.num_queued_messages = 0
+    assert load_monitor.is_matching_required('logged-on', 901, True)
+
+def test_vehicles_which_are_not_logged_on_are_always_matched():
+    iom_client: FakeIomClient = FakeIomClient()
+    load_monitor: LoadMonitor = LoadMonitor(iom_client, 4, 5, 30, 500)
+
+    iom_client.num_queued_messages = 1000
+    assert load_monitor.get_matching_interval() == 30
+
+    for timestamp in range(1000, 1060, 5):
+        assert load_monitor.is_matching_required('not-logged-on', timestamp, False)
@@ -0,0 +1,154 @@
+import polyline
+import threading
+import time
+
+from shapely.geometry import LineString
+
+from avl2gtfsrt.avl import matchingengine
+from avl2gtfsrt.avl.matchingengine import BatchMatchingEngine, score_trip_candidates, score_trip_candidates_batch
+from avl2gtfsrt.model.types import GnssPosition, Stop, StopTime, Trip, TripDescriptor
+
+
+# trip shape with a turn and trip candidates running on it, earlier and later, and in the opposite direction
+SHAPE_COORDS: list[tuple] = [(50.000, 8.000), (50.000, 8.010), (50.006, 8.010), (50.006, 8.002)]
+
+class FakeStorage:
+
+    def get_assigned_trip_ids(self) -> set[str]:
+        return set()
+
+def create_trip(trip_id: str, coords: list[tuple], first_departure_timestamp: int) -> Trip:
+    stop_times: list[StopTime] = [StopTime(first_departure_timestamp + i * 300, first_departure_timestamp + i * 300, i, Stop(f"{trip_id}-{i}", c[0], c[1])) for i, c in enumerate(coords)]
+    return Trip(TripDescriptor(trip_id=trip_id, start_date='20250101'), polyline.encode(coords), stop_times)
+
+def create_trip_candidates(now: int) -> list[Trip]:
+    return [
+        create_trip('trip', SHAPE_COORDS, now - 300),
+        create_trip('trip-late', SHAPE_COORDS, now + 600),
+        create_trip('trip-reverse', SHAPE_COORDS[::-1], now - 300)
+    ]
+
+def create_trace(now: int, num_positions: int) -> list[GnssPosition]:
+    shape: LineString = LineString([(c[1], c[0]) for c in SHAPE_COORDS])
+
+    # the vehicle is on the first leg of the trip shape, where the trip is scheduled right now
+    gnss_positions: list[GnssPosition] = list()
+    for i in range(0, num_positions):
+        point = shape.interpolate(0.007 + i * 0.0003)
+        gnss_positions.append(GnssPosition(point.y, point.x, now - (num_positions - i) * 10))
+
+    return gnss_positions
+
+def test_batch_scores_equal_local_scores():
+    now: int = int(time.time())
+    trip_candidates: list[Trip] = create_trip_candidates(now)
+
+    trace: list[GnssPosition] = create_trace(now, 16)
+
+    num_scores: int = 0
+    for n in range(3, 17):
+
+        # windows are growing and sliding, and vehicles consider different trip candidates over time
+        # so the new positions of the trip candidates of a vehicle start at different offsets
+        requests: list[tuple] = [
+            ('vehicle-1', trace[:n], trip_candidates),
+            ('vehicle-2', trace[max(0, n - 6):n], trip_candidates if n % 3 != 0 else trip_candidates[:1]),
+            ('vehicle-3', trace[max(0, n - 8):n], trip_candidates[n % 2:])
+        ]
+
+        local_results: list[dict] = [score_trip_candidates(f"local-{r}", g, t) for r, g, t in requests]
+        batch_results: list[dict] = score_trip_candidates_batch([(f"batch-{r}", g, t) for r, g, t in requests])
+
+        assert local_results == batch_results
+        num_scores = num_scores + sum(len(r) for r in local_results)
+
+    assert num_scores > 0
+
+def test_batch_is_scored_when_all_matching_threads_are_waiting():
+    now: int = int(time.time())
+    trip_candidates: list[Trip] = create_trip_candidates(now)
+
+    # the interval is much longer than the test, so the batch must be started by the waiting threads
+    engine: BatchMatchingEngine = BatchMatchingEngine(FakeStorage(), 60000, 2)
+
+    results: dict[str, dict] = dict()
+    def score(vehicle_ref: str) -> None:
+        results[vehicle_ref] = engine.score(vehicle_ref, create_trace(now, 6), trip_candidates)
+
+    start_time: float = time.monotonic()
+
+    threads: list[threading.Thread] = [threading.Thread(target=score, args=(f"full-batch-{i}",)) for i in range(0, 2)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert time.monotonic() - start_time < 10
+    assert len(results) == 2
+    assert results['full-batch-0'] == score_trip_candidates('full-batch-local', create_trace(now, 6), trip_candidates)
+
+    engine.close()
+
+def test_timed_out_request_is_withdrawn_and_scored_locally():
+    now: int = int(time.time())
+    trip_candidates: list[Trip] = create_trip_candidates(now)
+
+    engine: BatchMatchingEngine = BatchMatchingEngine(FakeStorage(), 60000, 10)
+    engine.SCORE_TIMEOUT_SECONDS = 0.1
+
+    result: dict = engine.score('withdrawn', create_trace(now, 6), trip_candidates)
+    assert result == score_trip_candidates('withdrawn-local', create_trace(now, 6), trip_candidates)
+
+    # the withdrawn request is still queued, but skipped by the next tick
+    assert len(engine._pending_requests) == 1
+    assert engine._pending_requests[0][3].cancelled()
+
+    engine.close()
+    assert len(engine._pending_requests) == 0
+
+def test_timed_out_request_is_awaited_while_scored(monkeypatch):
+    now: int = int(time.time())
+    trip_candidates: list[Trip] = create_trip_candidates(now)
+
+    # the tick scores the request longer than the matching thread waits, so the request cannot be withdrawn anymore
+    score_batch = matchingengine.score_trip_candidates_batch
+    def slow_score_batch(requests: list[tuple]) -> list[dict]:
+        time.sleep(0.5)
+        return score_batch(requests)
+
+    def fail_score(*args) -> dict:
+        raise AssertionError('request must not be scored locally')
+
+    monkeypatch.setattr(matchingengine, 'score_trip_candidates_batch', slow_score_batch)
+    monkeypatch.setattr(matchingengine, 'score_trip_candidates', fail_score)
+
+    engine: BatchMatchingEngine = BatchMatchingEngine(FakeStorage(), 60000, 1)
+    engine.SCORE_TIMEOUT_SECONDS = 0.1
+
+    result: dict = engine.score('awaited', create_trace(now, 6), trip_candidates)
+    assert result == score_batch([('awaited-batch', create_trace(now, 6), trip_candidates)])[0]
+
+    engine.close()
+
+def test_close_scores_pending_requests():
+    now: int = int(time.time())
+    trip_candidates: list[Trip] = create_trip_candidates(now)
+
+    engine: BatchMatchingEngine = BatchMatchingEngine(FakeStorage(), 60000, 10)
+
+    results: list[dict] = list()
+    thread: threading.Thread = threading.Thread(target=lambda: results.append(engine.score('closed', create_trace(now, 6), trip_candidates)))
+    thread.start()
+
+    while len(engine._pending_requests) == 0:
+        time.sleep(0.01)
+
+    # closing the engine releases the waiting matching thread with its result
+    engine.close()
+    thread.join(timeout=10)
+
+    assert results == [score_trip_candidates('closed-local', create_trace(now, 6), trip_candidates)]
+
+    # requests after closing the engine are scored locally
+    assert engine.score('closed-after', create_trace(now, 6), trip_candidates) == results[0]
@@ -0,0 +1,96 @@
+import random
+
+import numpy as np
+import shapely
+
+from shapely.geometry import LineString
+
+from avl2gtfsrt.avl.matchingstate import SpatialMatchState
+from avl2gtfsrt.avl.spatialmatch import SpatialMatch
+from avl2gtfsrt.avl.spatialvector import SpatialVectorCollection
+from avl2gtfsrt.common.shared import web_mercator, web_mercator_coords
+from avl2gtfsrt.model.types import GnssPosition
+
+
+# trip shape with a turn and some GNSS positions along it, partly off the shape and partly moving backwards
+SHAPE_COORDS: list[tuple] = [(8.000, 50.000), (8.010, 50.000), (8.010, 50.006), (8.002, 50.006)]
+
+def create_trace(randomizer: random.Random, num_positions: int) -> list[GnssPosition]:
+    shape: LineString = LineString(SHAPE_COORDS)
+
+    trace: list[GnssPosition] = list()
+    distance: float = 0.0
+    for i in range(0, num_positions):
+        distance = distance + randomizer.choice([0.0004, 0.0004, 0.0004, -0.0002, 0.0])
+        point = shape.interpolate(max(0.0, distance))
+
+        # some positions are far beyond the buffer of the trip shape
+        offset: float = randomizer.choice([0.0, 0.00005, -0.00005, 0.002]) if i % 7 != 3 else 0.003
+        trace.append(GnssPosition(point.y + offset, point.x, 1000 + i * 10))
+
+    return trace
+
+def calculate_reference(gnss_positions: list[GnssPosition], trip_shape: LineString, buffered_trip_shape) -> tuple[int, int, int, float]:
+
+    # evaluate the whole window at once without any state
+    x, y = web_mercator_coords([p.longitude for p in gnss_positions], [p.latitude for p in gnss_positions])
+    points: np.ndarray = shapely.points(x, y)
+
+    covered: np.ndarray = shapely.covers(buffered_trip_shape, points)
+    projections: np.ndarray = shapely.line_locate_point(trip_shape, points)
+    movements: np.ndarray = np.diff(projections)
+
+    return (int(covered.sum()), int((movements > 0).sum()), int((movements < 0).sum()), float(projections[-1]))
+
+def test_incremental_state_equals_full_evaluation():
+    randomizer: random.Random = random.Random(7)
+
+    trip_shape: LineString = web_mercator(LineString(SHAPE_COORDS))
+    buffered_trip_shape = trip_shape.buffer(SpatialMatch.TRIP_SHAPE_BUFFER_SIZE)
+
+    for _ in range(0, 20):
+        trace: list[GnssPosition] = create_trace(randomizer, 80)
+        state: SpatialMatchState = SpatialMatchState()
+
+        start: int = 0
+        end: int = 2
+        while end <= len(trace):
+            window: list[GnssPosition] = trace[start:end]
+
+            # the vehicle sometimes sends a corrected last position, which changes the history of the window
+            if randomizer.random() < 0.1:
+                window = window[:-1] + [GnssPosition(window[-1].latitude + 0.00001, window[-1].longitude, window[-1].timestamp)]
+
+            incremental_match: SpatialMatch = SpatialMatch(trip_shape, buffered_trip_shape)
+            incremental_score: float = incremental_match.calculate_match_score(SpatialVectorCollection(window), state)
+
+            full_match: SpatialMatch = SpatialMatch(trip_shape, buffered_trip_shape)
+            full_score: float = full_match.calculate_match_score(SpatialVectorCollection(window))
+
+            num_points_matching, num_forward_movements, num_backward_movements, last_projection = calculate_reference(window, trip_shape, buffered_trip_shape)
+
+            assert len(state) == len(window)
+            assert (state.num_points_matching, state.num_forward_movements, state.num_backward_movements) == (num_points_matching, num_forward_movements, num_backward_movements)
+            assert state.last_projection() == last_projection
+
+            assert incremental_score == full_score
+            assert incremental_match.spatial_progress_percentage == full_match.spatial_progress_percentage
+
+            # the window grows by several positions and drops old positions like the GNSS position history of a vehicle
+            end = end + randomizer.choice([1, 1, 1, 2, 3])
+            start = max(start, end - 12)
+
+def test_state_is_rebuilt_for_unrelated_window():
+    trip_shape: LineString = web_mercator(LineString(SHAPE_COORDS))
+    buffered_trip_shape = trip_shape.buffer(SpatialMatch.TRIP_SHAPE_BUFFER_SIZE)
+
+    trace: list[GnssPosition] = create_trace(random.Random(3), 40)
+    state: SpatialMatchState = SpatialMatchState()
+
+    SpatialMatch(trip_shape, buffered_trip_shape).calculate_match_score(SpatialVectorCollection(trace[0:12]), state)
+    SpatialMatch(trip_shape, buffered_trip_shape).calculate_match_score(SpatialVectorCollection(trace[25:37]), state)
+
+    num_points_matching, num_forward_movements, num_backward_movements, _ = calculate_reference(trace[25:37], trip_shape, buffered_trip_shape)
+
+    assert len(state) == 12
+    assert (state.num_points_matching, state.num_forward_movements, state.num_backward_movements) == (num_points_matching, num_forward_movements, num_backward_movements)
@@ -0,0 +1,401 @@
+import copy
+import pytest
+
+from avl2gtfsrt import objectstorage
+from avl2gtfsrt.common.shared import unixtimestamp
+from avl2gtfsrt.events.eventmessage import EventMessage
+from avl2gtfsrt.model.serialization import deserialize, serialize
+from avl2gtfsrt.model.types import GnssPosition, TripDescriptor, Vehicle, VehicleActivity, VehicleCache
+from avl2gtfsrt.objectstorage import ObjectStorage, WriteBehindObjectStorage
+
+
+def get_field(document: dict, key: str) -> object:
+    for k in key.split('.'):
+        if document is None:
+            return None
+
+        document = document.get(k, None)
+
+    return document
+
+def set_field(document: dict, key: str, value: object) -> None:
+    keys: list[str] = key.split('.')
+    for k in keys[:-1]:
+        document = document.setdefault(k, dict())
+
+    document[keys[-1]] = value
+
+def apply_update(document: dict, update: dict) -> dict:
+    document = copy.deepcopy(document)
+
+    # MongoDB update operators used by the object storage
+    for key, value in update.get('$set', dict()).items():
+        set_field(document, key, copy.deepcopy(value))
+
+    for key, value in update.get('$push', dict()).items():
+        values: list = (get_field(document, key) or list()) + copy.deepcopy(value['$each'])
+        set_field(document, key, values[value['$slice']:] if '$slice' in value else values)
+
+    return document
+
+def matches(document: dict, query: dict) -> bool:
+    for key, value in query.items():
+        if isinstance(value, dict) and '$ne' in value:
+            if get_field(document, key) == value['$ne']:
+                return False
+        elif get_field(document, key) != value:
+            return False
+
+    return True
+
+
+class FakeCollection:
+
+    def __init__(self) -> None:
+        self.documents: list[dict] = list()
+        self.fail_next_write: bool = False
+
+    def create_index(self, *args, **kwargs) -> None:
+        pass
+
+    def find(self, query: dict, projection: dict|None = None) -> list[dict]:
+        documents: list[dict] = [copy.deepcopy(d) for d in self.documents if matches(d, query)]
+
+        # projections of the object storage only remove or slice fields, other fields are kept
+        for document in documents:
+            for key, value in (projection or dict()).items():
+                if value == 0:
+                    document.pop(key, None)
+                elif isinstance(value, dict) and '$slice' in value and get_field(document, key) is not None:
+                    set_field(document, key, get_field(document, key)[value['$slice']:])
+
+        return documents
+
+    def find_one(self, query: dict) -> dict|None:
+        documents: list[dict] = self.find(query)
+        return documents[0] if len(documents) > 0 else None
+
+    def distinct(self, key: str, query: dict) -> list:
+        return list({get_field(d, key) for d in self.documents if matches(d, query)})
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False) -> None:
+        if self.fail_next_write:
+            self.fail_next_write = False
+            raise RuntimeError('write failed')
+
+        for i, document in enumerate(self.documents):
+            if matches(document, query):
+                self.documents[i] = apply_update(document, update)
+                return
+
+        if upsert:
+            self.documents.append(apply_update(dict(query), update))
+
+    def update_many(self, query: dict, update: dict) -> None:
+        pass
+
+    def bulk_write(self, operations: list, ordered: bool = True) -> None:
+        for operation in operations:
+            self.update_one(operation._filter, operation._doc, operation._upsert)
+
+
+class FakeDatabase(dict):
+
+    def __missing__(self, key: str) -> FakeCollection:
+        self[key] = FakeCollection()
+        return self[key]
+
+    def __getattr__(self, key: str) -> FakeCollection:
+        return self[key]
+
+
+class FakeMongoClient:
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.databases: FakeDatabase = FakeDatabase()
+        self.closed: bool = False
+
+    def __getitem__(self, key: str) -> FakeDatabase:
+        return self.databases
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def storage(monkeypatch) -> WriteBehindObjectStorage:
+    monkeypatch.setattr(objectstorage, 'MongoClient', FakeMongoClient)
+
+    # without flush interval, the tests flush themselves
+    return WriteBehindObjectStorage('username', 'password', 120, 10, flush_interval_ms=0)
+
+def create_vehicle(vehicle_ref: str, trip_id: str|None = None) -> Vehicle:
+    timestamp: int = unixtimestamp()
+
+    activity: VehicleActivity = VehicleActivity([GnssPosition(50.0, 8.0, timestamp - 10), GnssPosition(50.001, 8.001, timestamp)])
+    if trip_id is not None:
+        activity.trip_descriptor = TripDescriptor(trip_id=trip_id, start_date='20250101')
+
+    return Vehicle(vehicle_ref, True, trip_id is not None, activity, VehicleCache())
+
+def test_flush_writes_vehicles_before_events_are_published(storage: WriteBehindObjectStorage):
+    vehicle: Vehicle = create_vehicle('flushed', 'trip-1')
+
+    # events are published in order and each event sees the vehicle data stored in MongoDB
+    published: list[tuple] = list()
+    def publish(message: EventMessage) -> None:
+        published.append((message.event_type, storage._db.vehicles.find_one({'vehicle_ref': message.vehicle_id})))
+
+    storage.update_vehicle(vehicle)
+    storage.publish_when_stored(publish, EventMessage(EventMessage.TECHNICAL_VEHICLE_LOG_ON, 'flushed'))
+    storage.publish_when_stored(publish, EventMessage(EventMessage.TECHNICAL_VEHICLE_LOG_OFF, 'flushed'))
+
+    assert storage._db.vehicles.find_one({'vehicle_ref': 'flushed'}) is None
+    assert len(published) == 0
+
+    storage.flush()
+
+    assert storage._db.vehicles.find_one({'vehicle_ref': 'flushed'}) == serialize(vehicle)
+    assert [p[0] for p in published] == [EventMessage.TECHNICAL_VEHICLE_LOG_ON, EventMessage.TECHNICAL_VEHICLE_LOG_OFF]
+    assert all(p[1] == serialize(vehicle) for p in published)
+
+    # the vehicle is kept in memory while it is operationally logged on
+    assert storage.get_vehicle('flushed') is vehicle
+
+def test_failed_flush_is_repeated_with_the_next_flush(storage: WriteBehindObjectStorage):
+    vehicle: Vehicle = create_vehicle('failed', 'trip-1')
+
+    published: list[int] = list()
+
+    storage.update_vehicle(vehicle)
+    storage.publish_when_stored(lambda m: published.append(m.event_type), EventMessage(EventMessage.TECHNICAL_VEHICLE_LOG_ON, 'failed'))
+
+    storage._db.vehicles.fail_next_write = True
+    with pytest.raises(RuntimeError):
+        storage.flush()
+
+    assert storage._db.vehicles.find_one({'vehicle_ref': 'failed'}) is None
+    assert len(published) == 0
+
+    # events of later updates are published after the events of the failed flush
+    vehicle.activity.trip_candidate_failures = 1
+    storage.update_vehicle(vehicle)
+    storage.publish_when_stored(lambda m: published.append(m.event_type), EventMessage(EventMessage.TECHNICAL_VEHICLE_LOG_OFF, 'failed'))
+
+    storage.flush()
+
+    assert storage._db.vehicles.find_one({'vehicle_ref': 'failed'}) == serialize(vehicle)
+    assert published == [EventMessage.TECHNICAL_VEHICLE_LOG_ON, EventMessage.TECHNICAL_VEHICLE_LOG_OFF]
+
+def test_close_flushes_pending_vehicles(storage: WriteBehindObjectStorage):
+    vehicle: Vehicle = create_vehicle('closed', 'trip-1')
+
+    published: list[int] = list()
+
+    storage.update_vehicle(vehicle)
+    storage.publish_when_stored(lambda m: published.append(m.event_type), EventMessage(EventMessage.TECHNICAL_VEHICLE_LOG_ON, 'closed'))
+
+    storage.close()
+
+    assert storage._db.vehicles.find_one({'vehicle_ref': 'closed'}) == serialize(vehicle)
+    assert published == [EventMessage.TECHNICAL_VEHICLE_LOG_ON]
+    assert storage._mdb.closed
+
+def test_vehicles_are_reloaded_after_operational_log_off(storage: WriteBehindObjectStorage):
+    vehicle: Vehicle = create_vehicle('reloaded', 'trip-1')
+
+    storage.update_vehicle(vehicle)
+    storage.flush()
+
+    # the vehicle is removed from memory once its operational log off is written
+    vehicle.is_operationally_logged_on = False
+    storage.update_vehicle(vehicle)
+    storage.flush()
+
+    assert 'reloaded' not in storage._vehicles
+
+    # so changes of other processes are loaded with the next handler and not overwritten
+    storage._db.vehicles.update_one({'vehicle_ref': 'reloaded'}, {'$set': {'activity.trip_descriptor': None, 'activity.trip_metrics': None}})
+
+    reloaded_vehicle: Vehicle = storage.get_vehicle('reloaded')
+    assert reloaded_vehicle is not vehicle
+    assert reloaded_vehicle.activity.trip_descriptor is None
+
+    storage.update_vehicle(reloaded_vehicle)
+    storage.flush()
+
+    assert storage._db.vehicles.find_one({'vehicle_ref': 'reloaded'})['activity']['trip_descriptor'] is None
+
+def test_operational_log_on_writes_the_whole_vehicle(storage: WriteBehindObjectStorage):
+    vehicle: Vehicle = create_vehicle('logged-on-again', 'trip-1')
+    vehicle.is_operationally_logged_on = False
+
+    storage.update_vehicle(vehicle)
+    storage.flush()
+
+    # another process cleans up the trip refs after the vehicle has been loaded
+    loaded_vehicle: Vehicle = storage.get_vehicle('logged-on-again')
+    storage._db.vehicles.update_one({'vehicle_ref': 'logged-on-again'}, {'$set': {'activity.trip_descriptor': None, 'activity.trip_metrics': None}})
+
+    # the vehicle is logged on to the same trip again, which is not a change compared to the outdated snapshot
+    loaded_vehicle.is_operationally_logged_on = True
+    storage.update_vehicle(loaded_vehicle)
+    storage.flush()
+
+    assert storage._db.vehicles.find_one({'vehicle_ref': 'logged-on-again'}) == serialize(loaded_vehicle)
+    assert storage._db.vehicles.find_one({'vehicle_ref': 'logged-on-again'})['activity']['trip_descriptor']['trip_id'] == 'trip-1'
+
+def test_vehicles_are_evicted_after_technical_log_off(storage: WriteBehindObjectStorage):
+    vehicle: Vehicle = create_vehicle('logged-off', 'trip-1')
+
+    storage.update_vehicle(vehicle)
+    storage.flush()
+
+    vehicle.is_technically_logged_on = False
+    vehicle.is_operationally_logged_on = False
+    vehicle.cache = None
+    storage.update_vehicle(vehicle)
+
+    # the vehicle is kept in memory until its technical log off is written
+    assert storage.get_vehicle('logged-off') is vehicle
+
+    storage.flush()
+
+    assert 'logged-off' not in storage._vehicles
+    assert 'logged-off' not in storage._vehicle_documents
+    assert storage._vehicle_snapshots.get('logged-off') is None
+    assert storage.get_vehicle('logged-off') == vehicle
+
+def test_assigned_trip_ids_are_trips_of_operationally_logged_on_vehicles(storage: WriteBehindObjectStorage):
+
+    # MongoDB contains a logged on vehicle and a logged off vehicle, whose trip refs are not cleaned up yet
+    storage._db.vehicles.update_one({'vehicle_ref': 'stored'}, {'$set': serialize(create_vehicle('stored', 'trip-stored'))}, upsert=True)
+
+    logged_off_vehicle: Vehicle = create_vehicle('stored-logged-off', 'trip-stored-logged-off')
+    logged_off_vehicle.is_operationally_logged_on = False
+    storage._db.vehicles.update_one({'vehicle_ref': 'stored-logged-off'}, {'$set': serialize(logged_off_vehicle)}, upsert=True)
+
+    base_storage: ObjectStorage = ObjectStorage('username', 'password', 120, 10)
+    base_storage._db = storage._db
+
+    assert base_storage.get_assigned_trip_ids() == {'trip-stored'}
+    assert storage.get_assigned_trip_ids() == {'trip-stored'}
+
+    # vehicles in memory replace the vehicles in MongoDB with the same rule
+    stored_vehicle: Vehicle = storage.get_vehicle('stored')
+    stored_vehicle.is_operationally_logged_on = False
+    storage.update_vehicle(stored_vehicle)
+    storage.update_vehicle(create_vehicle('memory', 'trip-memory'))
+
+    assert storage.get_assigned_trip_ids() == {'trip-memory'}
+
+    storage.flush()
+
+    assert base_storage.get_assigned_trip_ids() == storage.get_assigned_trip_ids() == {'trip-memory'}
+
+@pytest.fixture
+def base_storage(monkeypatch) -> ObjectStorage:
+    monkeypatch.setattr(objectstorage, 'MongoClient', FakeMongoClient)
+    return ObjectStorage('username', 'password', 120, 10)
+
+def create_positions(timestamp: int, first: int, last: int) -> list[dict]:
+    return [serialize(GnssPosition(50.0 + i * 0.001, 8.0, timestamp + i * 10)) for i in range(first, last)]
+
+def create_update(storage: ObjectStorage, snapshot: dict, data: dict) -> dict|None:
+    storage._vehicle_snapshots.put(data['vehicle_ref'], copy.deepcopy(snapshot))
+    update: dict|None = storage._create_vehicle_update(data['vehicle_ref'], copy.deepcopy(data))
+
+    # the update applied to the document in MongoDB results in the complete vehicle
+    assert apply_update(snapshot, update or dict()) == data
+    assert storage._vehicle_snapshots.get(data['vehicle_ref']) == data
+
+    return update
+
+def test_appended_positions_are_pushed(base_storage: ObjectStorage):
+    timestamp: int = unixtimestamp() - 100
+    snapshot: dict = serialize(create_vehicle('diff', 'trip-1'))
+    snapshot['activity']['gnss_positions'] = create_positions(timestamp, 0, 5)
+
+    data: dict = copy.deepcopy(snapshot)
+    data['activity']['gnss_positions'] = create_positions(timestamp, 0, 7)
+
+    update: dict = create_update(base_storage, snapshot, data)
+    assert update == {'$push': {'activity.gnss_positions': {'$each': create_positions(timestamp, 5, 7), '$slice': -7}}}
+
+def test_appended_and_trimmed_positions_are_pushed_and_sliced(base_storage: ObjectStorage):
+    timestamp: int = unixtimestamp() - 100
+    snapshot: dict = serialize(create_vehicle('diff', 'trip-1'))
+    snapshot['activity']['gnss_positions'] = create_positions(timestamp, 0, 5)
+
+    # the oldest positions are removed by the time-based cleanup, while new positions are appended
+    data: dict = copy.deepcopy(snapshot)
+    data['activity']['gnss_positions'] = create_positions(timestamp, 2, 6)
+
+    update: dict = create_update(base_storage, snapshot, data)
+    assert update == {'$push': {'activity.gnss_positions': {'$each': create_positions(timestamp, 5, 6), '$slice': -4}}}
+
+def test_trimmed_positions_are_sliced(base_storage: ObjectStorage):
+    timestamp: int = unixtimestamp() - 100
+    snapshot: dict = serialize(create_vehicle('diff', 'trip-1'))
+    snapshot['activity']['gnss_positions'] = create_positions(timestamp, 0, 5)
+
+    data: dict = copy.deepcopy(snapshot)
+    data['activity']['gnss_positions'] = create_positions(timestamp, 3, 5)
+
+    update: dict = create_update(base_storage, snapshot, data)
+    assert update == {'$push': {'activity.gnss_positions': {'$each': [], '$slice': -2}}}
+
+def test_replaced_positions_are_set(base_storage: ObjectStorage):
+    timestamp: int = unixtimestamp() - 100
+    snapshot: dict = serialize(create_vehicle('diff', 'trip-1'))
+    snapshot['activity']['gnss_positions'] = create_positions(timestamp, 0, 5)
+
+    # the shape filter replaces positions by their projection onto the trip shape, timestamps are kept
+    data: dict = copy.deepcopy(snapshot)
+    data['activity']['gnss_positions'] = [{**p, 'longitude': 8.0001} for p in create_positions(timestamp, 0, 6)]
+
+    update: dict = create_update(base_storage, snapshot, data)
+    assert update == {'$set': {'activity.gnss_positions': data['activity']['gnss_positions']}}
+
+    # a new technical log on starts with other positions, which are not newer than the snapshot
+    data['activity']['gnss_positions'] = create_positions(timestamp - 1000, 0, 2)
+
+    update = create_update(base_storage, snapshot, data)
+    assert update == {'$set': {'activity.gnss_positions': data['activity']['gnss_positions']}}
+
+def test_log_on_with_identical_trip_descriptor(base_storage: ObjectStorage, storage: WriteBehindObjectStorage):
+    timestamp: int = unixtimestamp() - 100
+    snapshot: dict = serialize(create_vehicle('diff', 'trip-1'))
+    snapshot['is_operationally_logged_on'] = False
+    snapshot['activity']['gnss_positions'] = create_positions(timestamp, 0, 5)
+
+    data: dict = copy.deepcopy(snapshot)
+    data['is_operationally_logged_on'] = True
+    data['activity']['gnss_positions'] = create_positions(timestamp, 0, 6)
+
+    # the snapshot of the ObjectStorage is loaded with each update, so only the changed fields are written
+    update: dict = create_update(base_storage, snapshot, data)
+    assert update == {
+        '$set': {'is_operationally_logged_on': True},
+        '$push': {'activity.gnss_positions': {'$each': create_positions(timestamp, 5, 6), '$slice': -6}}
+    }
+
+    # the snapshot of the WriteBehindObjectStorage may be outdated, so the whole vehicle is written
+    update = create_update(storage, snapshot, data)
+    assert update == {'$set': data}
+
+def test_vehicles_loaded_with_latest_position_only_keep_the_snapshot(base_storage: ObjectStorage):
+    vehicle: Vehicle = create_vehicle('projected', 'trip-1')
+    vehicle.activity.gnss_positions = [deserialize(GnssPosition, p) for p in create_positions(unixtimestamp() - 100, 0, 5)]
+
+    base_storage.update_vehicle(vehicle)
+
+    # vehicles loaded for reading are not complete, so the next update is diffed against the complete vehicle
+    projected_vehicles: list[Vehicle] = base_storage.get_vehicles(vehicle_ref='projected', latest_gnss_position_only=True)
+    assert len(projected_vehicles[0].activity.gnss_positions) == 1
+    assert base_storage._vehicle_snapshots.get('projected') == serialize(vehicle)
+
+    vehicle.activity.gnss_positions.append(GnssPosition(50.01, 8.0, unixtimestamp()))
+    base_storage.update_vehicle(vehicle)
+
+    assert base_storage._db.vehicles.find_one({'vehicle_ref': 'projected'}) == serialize(vehicle)
@@ -0,0 +1,70 @@
+import typing
+
+from dataclasses import MISSING, asdict, fields, is_dataclass
+
+from avl2gtfsrt.model import types
+from avl2gtfsrt.model.serialization import deserialize, serialize, _is_optional
+
+
+MODEL_TYPES: list[type] = [t for t in vars(types).values() if isinstance(t, type) and is_dataclass(t) and t.__module__ == types.__name__]
+
+def create_value(field_type, seed: int):
+
+    # create a non-default value for each field, so that every field is converted explicitly
+    if _is_optional(field_type):
+        return create_value(next(t for t in typing.get_args(field_type) if t is not type(None)), seed)
+
+    if is_dataclass(field_type):
+        return create_instance(field_type, seed)
+
+    if typing.get_origin(field_type) is list:
+        return [create_value(typing.get_args(field_type)[0], seed + i) for i in range(0, 2)]
+
+    if field_type is dict:
+        return {f"key-{seed}": [0.1 * seed, 0.2 * seed]}
+
+    return {str: f"value-{seed}", int: seed, float: seed + 0.5, bool: True}[field_type]
+
+def create_instance(cls: type, seed: int = 1):
+    type_hints: dict = typing.get_type_hints(cls, vars(types))
+    return cls(**{f.name: create_value(type_hints[f.name], seed + i) for i, f in enumerate(fields(cls))})
+
+def test_all_model_types_have_codecs():
+    assert {'GnssPosition', 'Vehicle', 'VehicleActivity', 'VehicleCache', 'Stop', 'StopTime', 'Trip', 'TripDescriptor', 'TripMetrics'} <= {t.__name__ for t in MODEL_TYPES}
+
+def test_serialize_equals_asdict():
+    for cls in MODEL_TYPES:
+        obj = create_instance(cls)
+        assert serialize(obj) == asdict(obj), cls.__name__
+
+def test_round_trip():
+    for cls in MODEL_TYPES:
+        obj = create_instance(cls)
+        assert deserialize(cls, serialize(obj)) == obj, cls.__name__
+
+def test_unknown_keys_are_ignored():
+    for cls in MODEL_TYPES:
+        obj = create_instance(cls)
+
+        data: dict = serialize(obj)
+        data['_id'] = 'ignored'
+
+        assert deserialize(cls, data) == obj, cls.__name__
+
+def test_missing_keys_are_defaulted():
+    for cls in MODEL_TYPES:
+        type_hints: dict = typing.get_type_hints(cls, vars(types))
+        required_values: dict = {f.name: create_value(type_hints[f.name], 1) for f in fields(cls) if f.default is MISSING and f.default_factory is MISSING}
+
+        assert deserialize(cls, serialize(cls(**required_values))) == cls(**required_values), cls.__name__
+        assert deserialize(cls, {k: serialize(v) if is_dataclass(v) else v for k, v in required_values.items()}) == cls(**required_values), cls.__name__
+
+def test_serialized_data_is_copied():
+    vehicle: types.Vehicle = create_instance(types.Vehicle)
+    data: dict = serialize(vehicle)
+
+    data['activity']['gnss_positions'].clear()
+    data['activity']['trip_candidate_probabilities'][next(iter(data['activity']['trip_candidate_probabilities']))].append(1.0)
+
+    assert len(vehicle.activity.gnss_positions) == 2
+    assert all(len(v) == 2 for v in vehicle.activity.trip_candidate_probabilities.values())
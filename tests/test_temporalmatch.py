@@ -0,0 +1,99 @@
+import os
+import random
+
+from datetime import datetime
+from shapely.geometry import LineString, Point
+from zoneinfo import ZoneInfo
+
+from avl2gtfsrt.avl.temporalmatch import StopTimeIndex, TemporalMatch
+from avl2gtfsrt.common.shared import web_mercator
+from avl2gtfsrt.model.types import GnssPosition, Stop, StopTime
+
+
+SHAPE_COORDS: list[tuple] = [(8.000, 50.000), (8.010, 50.000), (8.010, 50.006), (8.002, 50.006)]
+
+def get_current_timestamp() -> int:
+    return int(datetime.now(ZoneInfo(os.getenv('A2G_TIMEZONE', 'Europe/Berlin'))).replace(microsecond=0, second=0).timestamp())
+
+def create_stop_times(randomizer: random.Random, current_timestamp: int, num_stops: int) -> list[StopTime]:
+
+    # departures are sorted, but may be equal for several stops and equal to the current timestamp
+    departure_timestamps: list[int] = sorted(current_timestamp + randomizer.randint(-5, 5) * 60 for _ in range(0, num_stops))
+    return [StopTime(d, d, i, Stop(f"stop-{i}", 50.0, 8.0)) for i, d in enumerate(departure_timestamps)]
+
+def create_stop_projections(randomizer: random.Random, length: float, num_stops: int, position_projections: list[float]) -> dict[int, float]:
+
+    # projections are mostly increasing, but stops may be projected onto a later or earlier part of the shape
+    # some stops are projected exactly onto a GNSS position
+    stop_projections: dict[int, float] = dict()
+    for i in range(0, num_stops):
+        if randomizer.random() < 0.2:
+            stop_projections[i] = randomizer.uniform(0.0, length)
+        elif randomizer.random() < 0.2:
+            stop_projections[i] = randomizer.choice(position_projections)
+        else:
+            stop_projections[i] = length * i / max(1, num_stops - 1)
+
+    return stop_projections
+
+def find_time_segment(stop_times: list[StopTime], current_timestamp: int) -> tuple[int, int]:
+
+    # linear search of the first pair of stops enclosing the current timestamp
+    for c in range(0, len(stop_times) - 1):
+        if stop_times[c].departure_timestamp <= current_timestamp <= stop_times[c + 1].departure_timestamp:
+            return (stop_times[c].stop_sequence, stop_times[c + 1].stop_sequence)
+
+def find_next_stop(stop_projections: dict[int, float], position_projection: float) -> int|None:
+
+    # linear search of the first stop projected on or beyond the position
+    for stop_sequence, stop_projection in stop_projections.items():
+        if stop_projection >= position_projection:
+            return stop_sequence
+
+    return None
+
+def test_stop_time_index_equals_linear_search():
+    randomizer: random.Random = random.Random(11)
+
+    trip_shape: LineString = web_mercator(LineString(SHAPE_COORDS))
+    wgs84_shape: LineString = LineString(SHAPE_COORDS)
+
+    for _ in range(0, 300):
+        current_timestamp: int = get_current_timestamp()
+        num_stops: int = randomizer.randint(2, 12)
+
+        gnss_positions: list[GnssPosition] = list()
+        for _ in range(0, 5):
+            point = wgs84_shape.interpolate(randomizer.uniform(0.0, wgs84_shape.length))
+            gnss_positions.append(GnssPosition(point.y, point.x, current_timestamp))
+
+        position_projections: list[float] = [trip_shape.project(web_mercator(Point(p.longitude, p.latitude))) for p in gnss_positions]
+
+        stop_times: list[StopTime] = create_stop_times(randomizer, current_timestamp, num_stops)
+        stop_projections: dict[int, float] = create_stop_projections(randomizer, trip_shape.length, num_stops, position_projections)
+
+        temporal_match: TemporalMatch = TemporalMatch(stop_times, trip_shape, stop_projections, StopTimeIndex(stop_times, stop_projections))
+
+        # the current timestamp may have changed meanwhile, the test is repeated in that case
+        if get_current_timestamp() != current_timestamp:
+            continue
+
+        if stop_times[0].departure_timestamp < current_timestamp < stop_times[-1].departure_timestamp:
+            this_stop_sequence, next_stop_sequence = find_time_segment(stop_times, current_timestamp)
+
+            assert temporal_match.time_based_current_stop_sequence == this_stop_sequence
+            assert temporal_match.time_based_next_stop_sequence == next_stop_sequence
+
+        for gnss_position, position_projection in zip(gnss_positions, position_projections):
+            next_stop_sequence: int|None = find_next_stop(stop_projections, position_projection)
+
+            trip_metrics = temporal_match.predict_trip_metrics(gnss_position)
+            assert trip_metrics.next_stop_sequence == next_stop_sequence
+
+            if next_stop_sequence is not None:
+                distance: float = stop_projections[next_stop_sequence] - position_projection
+                expected_status: str = 'STOPPED_AT' if abs(distance) < 30 else 'INCOMING_AT' if distance < 60 else 'IN_TRANSIT_TO'
+
+                assert trip_metrics.current_stop_status == expected_status
+                assert trip_metrics.current_stop_sequence == (next_stop_sequence - 1 if next_stop_sequence > 0 else None)
+                assert trip_metrics.current_stop_is_final == (True if expected_status != 'IN_TRANSIT_TO' and next_stop_sequence == num_stops - 1 else None)
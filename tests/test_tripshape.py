@@ -0,0 +1,22 @@
+import polyline
+
+from avl2gtfsrt.avl.tripshape import TripShape, get_trip_shape
+from avl2gtfsrt.model.types import Stop, StopTime, Trip, TripDescriptor
+
+
+SHAPE_COORDS: list[tuple] = [(50.000, 8.000), (50.000, 8.010), (50.006, 8.010)]
+
+def create_trip(first_departure_timestamp: int) -> Trip:
+    stop_times: list[StopTime] = [StopTime(first_departure_timestamp + i * 120, first_departure_timestamp + i * 120, i, Stop(f"stop-{i}", c[0], c[1])) for i, c in enumerate(SHAPE_COORDS)]
+    return Trip(TripDescriptor(trip_id='trip-1', start_date='20250101'), polyline.encode(SHAPE_COORDS), stop_times)
+
+def test_trip_shape_is_renewed_for_changed_stop_times():
+    trip_shape: TripShape = get_trip_shape(create_trip(1735722000))
+
+    # trips with identical nominal data share the prepared trip shape
+    assert get_trip_shape(create_trip(1735722000)) is trip_shape
+
+    # the shape is unchanged, but the stop times are not, so the stop time index must not be reused
+    changed_trip_shape: TripShape = get_trip_shape(create_trip(1735722600))
+    assert changed_trip_shape is not trip_shape
+    assert changed_trip_shape.stop_time_index is not trip_shape.stop_time_index
@@ -0,0 +1,231 @@
+import json
+import logging
+import random
+import sys
+import time
+
+from datetime import datetime
+from importlib.metadata import PackageNotFoundError, version
+
+from benchmark_matchers import create_trip
+from simulation import coordinates
+
+from avl2gtfsrt.avl import avlmatcher, matchingengine, temporalmatch, tripshape
+from avl2gtfsrt.avl.avlmatcher import AvlMatcher
+from avl2gtfsrt.avl.spatialmatch import SpatialMatch
+from avl2gtfsrt.avl.temporalmatch import TemporalMatch
+from avl2gtfsrt.model.types import GnssPosition, Trip, Vehicle, VehicleActivity, VehicleCache
+
+
+class StageTimer:
+
+    def __init__(self) -> None:
+        self.stages: dict[str, list[float]] = dict()
+
+    def instrument(self, owner: object, name: str, stage: str) -> None:
+
+        # wrap the function or method in order to measure each call for the given stage
+        function = getattr(owner, name)
+        durations: list[float] = self.stages.setdefault(stage, list())
+
+        def timed(*args, **kwargs):
+            start_time: float = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                durations.append(time.perf_counter() - start_time)
+
+        setattr(owner, name, timed)
+
+    def summary(self) -> dict:
+        return {
+            stage: {
+                'calls': len(durations),
+                'total_ms': sum(durations) * 1000.0,
+                'mean_ms': sum(durations) / len(durations) * 1000.0 if len(durations) > 0 else 0.0
+            } for stage, durations in self.stages.items()
+        }
+
+
+class ReplayClock(datetime):
+
+    # the replay runs faster than real time, so the temporal match uses the time of the replayed messages
+    current_timestamp: int = 0
+
+    @classmethod
+    def now(cls, tz=None) -> datetime:
+        return datetime.fromtimestamp(cls.current_timestamp, tz)
+
+
+class ReplayStorage:
+
+    # replays run without MongoDB, trips are assigned to vehicles of the replay only
+    def __init__(self) -> None:
+        self.assigned_trip_ids: set[str] = set()
+
+    def get_assigned_trip_ids(self) -> set[str]:
+        return set(self.assigned_trip_ids)
+
+
+class ReplayVehicle:
+
+    def __init__(self, vehicle_ref: str, trace: list[tuple], trip_id: str, first_index: int, first_timestamp: int) -> None:
+        self.vehicle: Vehicle = Vehicle(vehicle_ref, True, False, VehicleActivity(), VehicleCache())
+        self.trace: list[tuple] = trace
+        self.trip_id: str = trip_id
+        self.first_index: int = first_index
+        self.first_timestamp: int = first_timestamp
+
+        self.convergence_message: int|None = None
+        self.converged_trip_id: str|None = None
+
+
+def create_fleet(vehicles_per_line: int, lines: list[str], now: int, seconds_per_point: int = 10, gnss_noise_degrees: float = 0.00003) -> tuple[list[ReplayVehicle], list[Trip]]:
+    vehicles: list[ReplayVehicle] = list()
+    trips: list[Trip] = list()
+
+    randomizer: random.Random = random.Random(42)
+
+    for line in lines:
+        for v in range(0, vehicles_per_line):
+
+            # each vehicle of the fleet runs its own trip and starts at another point of the trace
+            # the start point is scheduled for the current time, GNSS positions are jittered by some noise
+            # short traces provide less vehicles than requested
+            first_index: int = 12 + v * 30
+            if first_index > len(coordinates[line]) - 10:
+                break
+
+            first_timestamp: int = now - first_index * seconds_per_point
+
+            trace: list[tuple] = [(c[0] + randomizer.uniform(-gnss_noise_degrees, gnss_noise_degrees), c[1] + randomizer.uniform(-gnss_noise_degrees, gnss_noise_degrees)) for c in coordinates[line]]
+            trip_id: str = f"{line}#{v}"
+
+            vehicles.append(ReplayVehicle(f"vehicle-{line}-{v}", trace, trip_id, first_index, first_timestamp))
+
+            # nominal data contains the trip of each vehicle, the opposite direction and the same trip 60s later
+            # the later trip overlaps with the trip of the vehicle, so it takes several messages to tell them apart
+            trips.append(create_trip(trip_id, coordinates[line], first_timestamp))
+            trips.append(create_trip(f"{trip_id}rev", coordinates[line][::-1], first_timestamp))
+            trips.append(create_trip(f"{trip_id}late", coordinates[line], first_timestamp + 60))
+
+    return (vehicles, trips)
+
+def run(vehicles_per_line: int, replay_points: int, window_size: int = 12, seconds_per_point: int = 10) -> dict:
+    stage_timer: StageTimer = StageTimer()
+    stage_timer.instrument(tripshape.TripShape, '__init__', 'shape_preparation')
+    stage_timer.instrument(SpatialMatch, 'calculate_match_score', 'spatial')
+    stage_timer.instrument(TemporalMatch, '__init__', 'temporal')
+    stage_timer.instrument(TemporalMatch, 'calculate_match_score', 'temporal')
+    stage_timer.instrument(avlmatcher, 'bayesian_update', 'bayesian')
+    stage_timer.instrument(AvlMatcher, 'predict_trip_metrics', 'metrics')
+
+    lines: list[str] = ['2', '6', '720', '743']
+    now: int = int(time.time()) // 60 * 60
+
+    vehicles, trips = create_fleet(vehicles_per_line, lines, now, seconds_per_point)
+
+    # the temporal match evaluates the schedule against the current time
+    temporalmatch.datetime = ReplayClock
+
+    storage: ReplayStorage = ReplayStorage()
+    matching_engine: matchingengine.MatchingEngine = matchingengine.MatchingEngine(storage)
+
+    num_messages: int = 0
+    start_time: float = time.perf_counter()
+
+    for step in range(0, replay_points):
+        ReplayClock.current_timestamp = now + step * seconds_per_point
+
+        for replay_vehicle in vehicles:
+            i: int = replay_vehicle.first_index + step
+            if i >= len(replay_vehicle.trace):
+                continue
+
+            # the vehicle is technically logged on at the start point of the replay, so there are no GNSS positions before
+            # the window grows with each message like in the position handler
+            vehicle: Vehicle = replay_vehicle.vehicle
+            vehicle.activity.gnss_positions = [GnssPosition(c[0], c[1], replay_vehicle.first_timestamp + j * seconds_per_point) for j, c in enumerate(replay_vehicle.trace[:i + 1]) if j >= replay_vehicle.first_index][-window_size:]
+
+            num_messages = num_messages + 1
+
+            # run the same steps as the position handler, but without storage and events
+            if len(vehicle.activity.gnss_positions) < 2:
+                continue
+
+            if not vehicle.is_operationally_logged_on:
+                trip_candidates: list[Trip] = [t for t in trips if t.descriptor.trip_id.split('#')[0] == replay_vehicle.trip_id.split('#')[0]]
+
+                matcher: AvlMatcher = AvlMatcher(storage, trip_candidates, False, matching_engine=matching_engine)
+                convergence, probabilities = matcher.match(vehicle, vehicle.activity.gnss_positions, vehicle.activity.trip_candidate_probabilities)
+
+                vehicle.activity.trip_candidate_probabilities = probabilities
+
+                if convergence:
+                    trip_id: str = max(probabilities, key=lambda k: probabilities[k][-1])
+                    trip: Trip = next(t for t in trip_candidates if t.descriptor.trip_id == trip_id)
+
+                    vehicle.is_operationally_logged_on = True
+                    vehicle.activity.trip_descriptor = trip.descriptor
+                    vehicle.activity.trip_metrics = matcher.predict_trip_metrics(vehicle, vehicle.activity.gnss_positions[-1])[trip_id]
+
+                    storage.assigned_trip_ids.add(trip_id)
+
+                    replay_vehicle.convergence_message = step + 1
+                    replay_vehicle.converged_trip_id = trip_id
+            else:
+                trip: Trip = next(t for t in trips if t.descriptor.trip_id == vehicle.activity.trip_descriptor.trip_id)
+
+                matcher: AvlMatcher = AvlMatcher(storage, [trip], True, 50, matching_engine=matching_engine)
+                if matcher.test(vehicle, vehicle.activity.gnss_positions):
+                    vehicle.activity.trip_metrics = matcher.predict_trip_metrics(vehicle, vehicle.activity.gnss_positions[-1])[trip.descriptor.trip_id]
+
+    elapsed_seconds: float = time.perf_counter() - start_time
+
+    convergence_messages: list[int] = sorted(v.convergence_message for v in vehicles if v.convergence_message is not None)
+
+    try:
+        package_version: str = version('avl2gtfsrt')
+    except PackageNotFoundError:
+        package_version: str = 'unknown'
+
+    return {
+        'version': package_version,
+        'timestamp': int(time.time()),
+        'parameters': {
+            'lines': lines,
+            'vehicles_per_line': vehicles_per_line,
+            'replay_points': replay_points,
+            'window_size': window_size,
+            'seconds_per_point': seconds_per_point
+        },
+        'messages': num_messages,
+        'elapsed_seconds': elapsed_seconds,
+        'messages_per_second': num_messages / elapsed_seconds if elapsed_seconds > 0 else 0.0,
+        'stages': stage_timer.summary(),
+        'convergence': {
+            'vehicles': len(vehicles),
+            'converged': len(convergence_messages),
+            'converged_correctly': len([v for v in vehicles if v.converged_trip_id == v.trip_id]),
+            'messages_to_convergence_median': convergence_messages[len(convergence_messages) // 2] if len(convergence_messages) > 0 else None,
+            'messages_to_convergence_max': convergence_messages[-1] if len(convergence_messages) > 0 else None,
+            'seconds_to_convergence_median': convergence_messages[len(convergence_messages) // 2] * seconds_per_point if len(convergence_messages) > 0 else None
+        }
+    }
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    # usage: python benchmark.py [output file] [vehicles per line] [replay points]
+    output_filename: str|None = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != '-' else None
+    vehicles_per_line: int = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    replay_points: int = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+
+    result: dict = run(vehicles_per_line, replay_points)
+
+    if output_filename is not None:
+        with open(output_filename, 'w') as output_file:
+            json.dump(result, output_file, indent=4)
+    else:
+        print(json.dumps(result, indent=4))
@@ -0,0 +1,68 @@
+import sys
+import time
+
+from benchmark import create_fleet
+
+from avl2gtfsrt.avl.matchingengine import score_trip_candidates, score_trip_candidates_batch
+from avl2gtfsrt.avl.tripshape import get_trip_shape
+from avl2gtfsrt.model.types import GnssPosition, Trip
+
+
+def run(batch_size: int, vehicles_per_line: int, replay_points: int, window_size: int = 12, seconds_per_point: int = 10) -> tuple[float, float, int]:
+    lines: list[str] = ['2', '6', '720', '743']
+    now: int = int(time.time()) // 60 * 60
+
+    vehicles, trips = create_fleet(vehicles_per_line, lines, now, seconds_per_point)
+
+    # each vehicle considers all trips of its line, so vehicles of the same line share their trip candidates
+    trip_candidates: list[list[Trip]] = [[t for t in trips if t.descriptor.trip_id.split('#')[0] == v.trip_id.split('#')[0]] for v in vehicles]
+
+    # prepare all trip shapes before, so that neither variant pays for the preparation
+    for trip in trips:
+        get_trip_shape(trip)
+
+    local_seconds: float = 0.0
+    batch_seconds: float = 0.0
+    num_requests: int = 0
+
+    for step in range(0, replay_points):
+        requests: list[tuple[str, list[GnssPosition], list[Trip]]] = list()
+        for replay_vehicle, vehicle_trip_candidates in zip(vehicles, trip_candidates):
+            i: int = replay_vehicle.first_index + step
+            if i >= len(replay_vehicle.trace):
+                continue
+
+            gnss_positions: list[GnssPosition] = [GnssPosition(c[0], c[1], replay_vehicle.first_timestamp + j * seconds_per_point) for j, c in enumerate(replay_vehicle.trace[:i + 1])][-window_size:]
+            requests.append((replay_vehicle.vehicle.vehicle_ref, gnss_positions, vehicle_trip_candidates))
+
+        num_requests = num_requests + len(requests)
+
+        # matching states are kept per vehicle ref, so both variants use their own vehicle refs
+        start_time: float = time.perf_counter()
+        for vehicle_ref, gnss_positions, vehicle_trip_candidates in requests:
+            score_trip_candidates(f"local-{vehicle_ref}", gnss_positions, vehicle_trip_candidates)
+
+        local_seconds = local_seconds + time.perf_counter() - start_time
+
+        # each tick contains one request per matching thread at most
+        start_time: float = time.perf_counter()
+        for b in range(0, len(requests), batch_size):
+            score_trip_candidates_batch([(f"batch-{vehicle_ref}", gnss_positions, vehicle_trip_candidates) for vehicle_ref, gnss_positions, vehicle_trip_candidates in requests[b:b + batch_size]])
+
+        batch_seconds = batch_seconds + time.perf_counter() - start_time
+
+    return (local_seconds, batch_seconds, num_requests)
+
+
+if __name__ == '__main__':
+
+    # usage: python benchmark_batch.py [batch size] [vehicles per line] [replay points]
+    batch_size: int = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    vehicles_per_line: int = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    replay_points: int = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+
+    local_seconds, batch_seconds, num_requests = run(batch_size, vehicles_per_line, replay_points)
+
+    print(f"{num_requests} requests, batch size {batch_size}")
+    print(f"local: {local_seconds / num_requests * 1e3:.2f}ms per request")
+    print(f"batch: {batch_seconds / num_requests * 1e3:.2f}ms per request ({local_seconds / batch_seconds:.2f}x)")
@@ -0,0 +1,91 @@
+import json
+import polyline
+import sys
+import time
+
+from simulation import coordinates
+
+from avl2gtfsrt.avl.avlmatcher import AvlMatcher
+from avl2gtfsrt.avl.hmmmatcher import HmmMatcher
+from avl2gtfsrt.model.types import GnssPosition, Stop, StopTime, Trip, TripDescriptor, Vehicle, VehicleActivity, VehicleCache
+
+
+class ReplayStorage:
+
+    # replays run without MongoDB, there're no trips assigned to other vehicles
+    def get_assigned_trip_ids(self) -> set[str]:
+        return set()
+
+
+def create_trip(trip_id: str, trace: list[tuple], first_departure_timestamp: int, seconds_per_point: int = 10, points_per_stop: int = 10) -> Trip:
+    stop_times: list[StopTime] = list()
+    for stop_sequence, i in enumerate(range(0, len(trace), points_per_stop)):
+        departure_timestamp: int = first_departure_timestamp + i * seconds_per_point
+        stop_times.append(StopTime(departure_timestamp, departure_timestamp, stop_sequence, Stop(f"{trip_id}:{stop_sequence}", trace[i][0], trace[i][1])))
+
+    return Trip(TripDescriptor(trip_id=trip_id, start_date='20250101'), polyline.encode([(c[0], c[1]) for c in trace]), stop_times)
+
+def replay(matcher_class: type, vehicle_ref: str, trace: list[tuple], trip_candidates: list[Trip], first_timestamp: int, first_index: int, last_index: int, window_size: int = 12, seconds_per_point: int = 10) -> dict:
+    vehicle: Vehicle = Vehicle(vehicle_ref, True, False, VehicleActivity(), VehicleCache())
+
+    probabilities: dict|None = None
+    cpu_seconds: list[float] = list()
+    convergence_message: int|None = None
+    convergence_trip_id: str|None = None
+
+    for n, i in enumerate(range(first_index, last_index)):
+        gnss_positions: list[GnssPosition] = [GnssPosition(c[0], c[1], first_timestamp + j * seconds_per_point) for j, c in enumerate(trace[:i + 1])][-window_size:]
+
+        start_time: float = time.process_time()
+        matcher = matcher_class(ReplayStorage(), trip_candidates, False)
+        convergence, probabilities = matcher.match(vehicle, gnss_positions, probabilities)
+        cpu_seconds.append(time.process_time() - start_time)
+
+        if convergence and convergence_message is None:
+            convergence_message = n + 1
+            convergence_trip_id = max(probabilities, key=lambda k: probabilities[k][-1])
+
+    return {
+        'matcher': matcher_class.__name__,
+        'vehicle': vehicle_ref,
+        'messages': len(cpu_seconds),
+        'cpu_ms_per_message_mean': sum(cpu_seconds) / len(cpu_seconds) * 1000.0,
+        'cpu_ms_per_message_median': sorted(cpu_seconds)[len(cpu_seconds) // 2] * 1000.0,
+        'cpu_ms_per_message_max': max(cpu_seconds) * 1000.0,
+        'messages_to_convergence': convergence_message,
+        'seconds_to_convergence': convergence_message * seconds_per_point if convergence_message is not None else None,
+        'converged_trip_id': convergence_trip_id
+    }
+
+
+if __name__ == '__main__':
+    seconds_per_point: int = 10
+    replay_points: int = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+
+    # AvlMatcher evaluates the schedule against the current time, so each recorded trace is
+    # replayed starting at the point which is scheduled for the current time
+    now: int = int(time.time()) // 60 * 60
+
+    # HmmMatcher is compared against AvlMatcher here only, it is not selectable in the worker
+    # on these traces with four trip candidates, it needs more CPU time per message than AvlMatcher
+    results: list[dict] = list()
+    for line in ['2', '6']:
+        trace: list[tuple] = coordinates[line]
+        first_index: int = min(len(trace) // 2, 20)
+        last_index: int = min(len(trace), first_index + replay_points)
+
+        first_timestamp: int = now - first_index * seconds_per_point
+
+        # trip candidates: the trip of the trace, the same trip 150s later, the opposite direction and the other line
+        other_line: str = '6' if line == '2' else '2'
+        trip_candidates: list[Trip] = [
+            create_trip(f"{line}", trace, first_timestamp),
+            create_trip(f"{line}late", trace, first_timestamp + 150),
+            create_trip(f"{line}rev", trace[::-1], first_timestamp),
+            create_trip(f"{other_line}", coordinates[other_line], first_timestamp)
+        ]
+
+        for matcher_class in [AvlMatcher, HmmMatcher]:
+            results.append(replay(matcher_class, f"{matcher_class.__name__}-{line}", trace, trip_candidates, first_timestamp, first_index, last_index))
+
+    print(json.dumps(results, indent=4))
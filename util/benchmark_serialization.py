@@ -0,0 +1,77 @@
+import polyline
+import sys
+import timeit
+
+from dataclasses import asdict
+
+# the previous deserialization path requires dacite, which is not a dependency anymore: pip install dacite
+try:
+    from dacite import from_dict
+except ImportError:
+    from_dict = None
+
+from simulation import coordinates
+
+from avl2gtfsrt.model.serialization import serialize, deserialize
+from avl2gtfsrt.model.types import GnssPosition, Stop, StopTime, Trip, TripDescriptor, TripMetrics, Vehicle, VehicleActivity, VehicleCache
+
+
+def create_vehicle(num_points: int, num_trip_candidates: int) -> Vehicle:
+    gnss_positions: list[GnssPosition] = [GnssPosition(c[0], c[1], i * 5) for i, c in enumerate(coordinates['2'][:num_points])]
+    trip_candidate_refs: list[TripDescriptor] = [TripDescriptor(trip_id=f"trip-{i}", route_id='2', start_date='20250101') for i in range(0, num_trip_candidates)]
+
+    return Vehicle(
+        'vehicle-1',
+        True,
+        True,
+        VehicleActivity(
+            gnss_positions,
+            True,
+            {d.trip_id: [0.1, 0.2, 0.3] for d in trip_candidate_refs},
+            0,
+            trip_candidate_refs[0],
+            TripMetrics(1, 'stop-1', 2, 'stop-2', 'IN_TRANSIT_TO', False, 60)
+        ),
+        VehicleCache(trip_candidate_refs)
+    )
+
+def create_trip(num_stops: int) -> Trip:
+    trace: list[tuple] = coordinates['2']
+    stop_times: list[StopTime] = [StopTime(i * 60, i * 60, i, Stop(f"stop-{i}", trace[i % len(trace)][0], trace[i % len(trace)][1], f"Stop {i}")) for i in range(0, num_stops)]
+
+    return Trip(TripDescriptor(trip_id='trip-1', route_id='2', start_date='20250101'), polyline.encode(trace), stop_times)
+
+def measure(name: str, obj: object, num_iterations: int) -> None:
+    cls: type = type(obj)
+    data: dict = serialize(obj)
+
+    # serialized data must equal the previous asdict path, deserialized objects must equal the original object
+    assert data == asdict(obj)
+    assert deserialize(cls, data) == obj
+
+    if from_dict is not None:
+        assert deserialize(cls, data) == from_dict(cls, data)
+
+    asdict_seconds: float = timeit.timeit(lambda: asdict(obj), number=num_iterations)
+    serialize_seconds: float = timeit.timeit(lambda: serialize(obj), number=num_iterations)
+    deserialize_seconds: float = timeit.timeit(lambda: deserialize(cls, data), number=num_iterations)
+
+    print(f"{name}, {num_iterations} iterations")
+    print(f"asdict:      {asdict_seconds / num_iterations * 1e6:.1f}us per call")
+    print(f"serialize:   {serialize_seconds / num_iterations * 1e6:.1f}us per call ({asdict_seconds / serialize_seconds:.2f}x)")
+
+    if from_dict is not None:
+        from_dict_seconds: float = timeit.timeit(lambda: from_dict(cls, data), number=num_iterations)
+
+        print(f"from_dict:   {from_dict_seconds / num_iterations * 1e6:.1f}us per call")
+        print(f"deserialize: {deserialize_seconds / num_iterations * 1e6:.1f}us per call ({from_dict_seconds / deserialize_seconds:.2f}x)")
+    else:
+        print("from_dict:   skipped, dacite is not installed")
+        print(f"deserialize: {deserialize_seconds / num_iterations * 1e6:.1f}us per call")
+
+
+if __name__ == '__main__':
+    num_iterations: int = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    measure('Vehicle with 60 GNSS positions and 20 trip candidates', create_vehicle(60, 20), num_iterations)
+    measure('Trip with 30 stop times', create_trip(30), num_iterations)
@@ -0,0 +1,41 @@
+import sys
+import timeit
+
+from simulation import coordinates
+
+from avl2gtfsrt.avl.spatialvector import SpatialVector, SpatialVectorCollection
+from avl2gtfsrt.model.types import GnssPosition
+
+
+def is_movement_per_pair(gnss_positions: list[GnssPosition], min_distance: int = 50) -> bool:
+
+    # reference implementation with one SpatialVector per consecutive pair of positions
+    spatial_vectors: list[SpatialVector] = [SpatialVector(p1, p2) for p1, p2 in zip(gnss_positions[:-1], gnss_positions[1:])]
+
+    total_distance: float = sum([v.length() for v in spatial_vectors])
+    direct_distance: float = SpatialVector(spatial_vectors[0].start, spatial_vectors[-1].end).length()
+
+    if total_distance < min_distance:
+        return False
+
+    linearity: float = direct_distance / total_distance if total_distance > 0 else 0
+
+    return linearity > 0.35
+
+def is_movement_array(gnss_positions: list[GnssPosition]) -> bool:
+    return SpatialVectorCollection(gnss_positions).is_movement()
+
+
+if __name__ == '__main__':
+    num_points: int = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    num_iterations: int = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    gnss_positions: list[GnssPosition] = [GnssPosition(c[0], c[1], i * 5) for i, c in enumerate(coordinates['2'][:num_points])]
+
+    per_pair_seconds: float = timeit.timeit(lambda: is_movement_per_pair(gnss_positions), number=num_iterations)
+    array_seconds: float = timeit.timeit(lambda: is_movement_array(gnss_positions), number=num_iterations)
+
+    print(f"SpatialVectorCollection.is_movement() with {len(gnss_positions)} points, {num_iterations} iterations")
+    print(f"per pair: {per_pair_seconds / num_iterations * 1e6:.1f}us per call")
+    print(f"array:    {array_seconds / num_iterations * 1e6:.1f}us per call")
+    print(f"speedup:  {per_pair_seconds / array_seconds:.2f}x")